@@ -1,24 +1,78 @@
+from __future__ import annotations
+import importlib
 import pathlib
+from collections.abc import Mapping
 from enum import Enum
-from typing import Union
-
-import gymnasium
-
-from auto_shaping.spec.reward_spec import RewardSpec, Variable, Constant
-from auto_shaping.tltl_shaping import TLTLWrapper
-from auto_shaping.hprs_shaping import HPRSWrapper
-from auto_shaping.bhnr_shaping import BHNRWrapper
-from auto_shaping.pam_shaping import PAMWrapper
-from auto_shaping.rpr_shaping import RPRWrapper
-
-__entry_points__ = {
-    "TLTL": TLTLWrapper,
-    "HPRS": HPRSWrapper,
-    "BHNR": BHNRWrapper,
-    "PAM": PAMWrapper,
-    "RPR": RPRWrapper,
+from typing import TYPE_CHECKING, Union
+
+if TYPE_CHECKING:
+    import gymnasium
+    from auto_shaping.spec.reward_spec import RewardSpec, Variable, Constant
+    from auto_shaping.tltl_shaping import TLTLWrapper
+    from auto_shaping.hprs_shaping import HPRSWrapper
+    from auto_shaping.bhnr_shaping import BHNRWrapper
+    from auto_shaping.pam_shaping import PAMWrapper
+    from auto_shaping.rpr_shaping import RPRWrapper
+    from auto_shaping.multi_reward import MultiRewardWrapper
+
+# public names and the modules defining them, imported on first access
+_lazy_attributes = {
+    "RewardSpec": "auto_shaping.spec.reward_spec",
+    "Variable": "auto_shaping.spec.reward_spec",
+    "Constant": "auto_shaping.spec.reward_spec",
+    "TLTLWrapper": "auto_shaping.tltl_shaping",
+    "HPRSWrapper": "auto_shaping.hprs_shaping",
+    "BHNRWrapper": "auto_shaping.bhnr_shaping",
+    "PAMWrapper": "auto_shaping.pam_shaping",
+    "RPRWrapper": "auto_shaping.rpr_shaping",
+    "MultiRewardWrapper": "auto_shaping.multi_reward",
 }
 
+__all__ = list(_lazy_attributes) + ["RewardType", "wrap"]
+
+
+def __getattr__(name: str):
+    if name not in _lazy_attributes:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(_lazy_attributes[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+
+class _EntryPoints(Mapping):
+    """
+    Map each reward name to its wrapper class, importing the wrapper module on first access,
+    so that using one reward does not import the dependencies of the others (e.g., rtamt).
+    """
+
+    def __init__(self, names: dict):
+        self._names = names
+
+    def __getitem__(self, reward: str):
+        return __getattr__(self._names[reward])
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+
+__entry_points__ = _EntryPoints(
+    {
+        "TLTL": "TLTLWrapper",
+        "HPRS": "HPRSWrapper",
+        "BHNR": "BHNRWrapper",
+        "PAM": "PAMWrapper",
+        "RPR": "RPRWrapper",
+    }
+)
+
 
 class RewardType(Enum):
     TLTL: int = 0
@@ -38,7 +92,7 @@ class RewardType(Enum):
 def wrap(
     env: Union[str, gymnasium.Env],
     reward: str,
-    spec: Union[RewardSpec, str, pathlib.Path] = None,
+    spec: Union[RewardSpec, dict, str, pathlib.Path] = None,
     env_kwargs: dict = None,
 ):
     """
@@ -46,8 +100,13 @@ def wrap(
 
     :param env: the environment to wrap or its name if it is a registered environment
     :param reward: the reward auto_shaping type
-    :param spec: the reward specification or the path to the yaml file, or None if registered environment with configs
+    :param spec: the reward specification, its compiled format (see `RewardSpec.to_compiled`),
+                 the path to the yaml file or to the compiled json file,
+                 or None if registered environment with configs
     """
+    import gymnasium
+    from auto_shaping.spec.reward_spec import RewardSpec
+
     if spec is None:
         assert isinstance(env, str), "spec must be provided if env is not a string"
         spec = pathlib.Path(__file__).parent.parent / "configs" / f"{env}.yaml"
@@ -57,22 +116,20 @@ def wrap(
         env_kwargs = env_kwargs or {}
         env = gymnasium.make(env, **env_kwargs)
 
-    if isinstance(spec, pathlib.Path) or isinstance(spec, str):
+    if isinstance(spec, dict):
+        spec = RewardSpec.from_compiled(spec)
+    elif isinstance(spec, pathlib.Path) or isinstance(spec, str):
         spec = pathlib.Path(spec)
-        spec = RewardSpec.from_yaml(spec)
+        if spec.suffix == ".json":
+            spec = RewardSpec.from_json(spec)
+        else:
+            spec = RewardSpec.from_yaml(spec)
 
     assert isinstance(
         spec, RewardSpec
-    ), "spec must be a RewardSpec or a path to a yaml file"
-
-    specs_str = [str(sp) for sp in spec.specs]
+    ), "spec must be a RewardSpec, a compiled spec or a path to a yaml or json file"
 
     if reward == "default":
         return env
 
-    return __entry_points__[reward](
-        env,
-        specs=specs_str,
-        variables=list(spec.variables.values()),
-        constants=list(spec.constants.values()),
-    )
+    return __entry_points__[reward](env, spec=spec)
@@ -1,12 +1,17 @@
-import warnings
-
 import gymnasium
 
 from auto_shaping.utils.collection_wrapper import CollectionWrapper
-from auto_shaping.spec.reward_spec import RewardSpec, Variable, Constant
+from auto_shaping.spec.reward_spec import (
+    RewardSpec,
+    Variable,
+    Constant,
+    build_reward_spec,
+)
+from auto_shaping.utils.online_monitor import OnlineRequirementsMonitor
+from auto_shaping.utils.robustness import stl_requirements
 from auto_shaping.utils.utils import (
     monitor_filtering_stl_episode,
-    extend_state,
+    StateExtractor,
 )
 
 
@@ -15,64 +20,92 @@ class BHNRWrapper(CollectionWrapper):
     Robustness-based reward auto_shaping from:
     "Structured Reward Shaping using Signal Temporal Logic specification" by Balakrishnan, and Deshmukh (2019)
     https://ieeexplore.ieee.org/document/8968254
+
+    :param window_len: the number of most recent steps on which the robustness is computed
+    :param engine: "rtamt" to monitor the window with the rtamt filtering semantics at every step,
+                   "online" to update incrementally, in amortized O(1) per step, the robustness of the window
+                   with the standard STL semantics, which is not checked against the filtering semantics
+                   and may differ from the "rtamt" engine
+    :param spec: the reward specification, alternative to specs, variables and constants
     """
 
     def __init__(
         self,
         env: gymnasium.Env,
-        specs: list[str],
-        variables: list[Variable],
+        specs: list[str] = None,
+        variables: list[Variable] = None,
         constants: list[Constant] = None,
         window_len: int = 10,
+        engine: str = "rtamt",
+        spec: RewardSpec = None,
     ):
-        var_names = [var[0] for var in variables]
-        super().__init__(env, variables=var_names)
-
-        self._spec = RewardSpec(
+        gymnasium.utils.RecordConstructorArgs.__init__(
+            self,
             specs=specs,
             variables=variables,
             constants=constants,
+            spec=spec,
+            window_len=window_len,
+            engine=engine,
         )
+        assert engine in ["rtamt", "online"], f"Unknown engine {engine}"
+        self._engine = engine
 
-        reqs = []
-        for req_spec in self._spec.specs:
-            try:
-                stl_req = req_spec.to_rtamt()
-                reqs.append(stl_req)
-            except Exception as e:
-                warnings.warn(
-                    f"Failed to parse requirement: {req_spec}, make sure it is a valid STL formula"
-                )
-        self._stl_spec = " and ".join(reqs)
-        self._variables = [var for var in self._spec.variables] + [
-            var for var in self._spec.constants
-        ]
+        self._spec = build_reward_spec(specs, variables, constants, spec)
 
-        extractor_fn = lambda state, action: extend_state(
-            env=env, state=state, action=action, spec=self._spec
-        )
+        var_names = list(self._spec.variables)
+        super().__init__(env, variables=var_names)
+
+        self._reqs = stl_requirements(self._spec)
+        self._stl_spec = " and ".join([req.to_rtamt() for req in self._reqs])
+        # constants are resolved in the requirements, only used variables are collected
+        self._variables = list(self._spec.used_variables)
+
+        # the online monitor keeps the window, only the last sample is collected
+        extractor_fn = StateExtractor(env=env, spec=self._spec)
         super(BHNRWrapper, self).__init__(
             env,
             extractor_fn=extractor_fn,
             variables=self._variables,
-            window_len=window_len,
+            window_len=1 if engine == "online" else window_len,
         )
 
+        self._monitor = None
+        if self._engine == "online":
+            self._monitor = OnlineRequirementsMonitor(self._reqs, window_len=window_len)
+
     def _reward(self, obs, done, info):
         reward = 0.0
 
         # compute robustness if episode is at least 2 steps long
-        if len(self._episode["time"]) > 1:
+        if self._monitor is not None:
+            if self._monitor.n_samples > 1:
+                reward = self._monitor.robustness
+        elif len(self._episode["time"]) > 1:
+            t0 = self.profiler.start()
             robustness_trace = monitor_filtering_stl_episode(
                 self._stl_spec,
                 self._variables,
                 self._episode,
             )
             reward = robustness_trace[0][1]
+            self.profiler.stop("monitor", t0)
 
         return reward
 
+    def reset(self, **kwargs):
+        obs, info = super().reset(**kwargs)
+        if self._monitor is not None:
+            self._monitor.reset()
+            self._monitor.update_last(self._episode)
+        return obs, info
+
     def step(self, action):
         obs, _, done, truncated, info = super().step(action)
+        if self._monitor is not None:
+            t0 = self.profiler.start()
+            self._monitor.update_last(self._episode)
+            self.profiler.stop("monitor", t0)
         reward = self._reward(obs, done, info)
+        self.profiler.step(info)
         return obs, reward, done, truncated, info
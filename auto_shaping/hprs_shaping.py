@@ -4,86 +4,208 @@ import gymnasium
 import numpy as np
 
 from auto_shaping import RewardSpec
-from auto_shaping.spec.reward_spec import Variable, Constant
-from auto_shaping.utils.utils import clip_and_norm, extend_state
-
-_cmp_lambdas = {
-    "<": lambda x, y: x < y,
-    ">": lambda x, y: x > y,
-    "<=": lambda x, y: x <= y,
-    ">=": lambda x, y: x >= y,
-    "==": lambda x, y: (x - y) < 1e-6,
-    "!=": lambda x, y: (x - y) > 1e-6,
-}
-
-fns = {
-    "abs": np.abs,
-    "exp": np.exp,
-    None: lambda x: x,
-}
-
-
-class SparseSuccessRewardWrapper(gymnasium.Wrapper):
+from auto_shaping.spec.reward_spec import Variable, Constant, build_reward_spec
+from auto_shaping.utils.kernels import requirement_satisfaction, requirement_scores
+from auto_shaping.utils.profiling import StepProfiler
+from auto_shaping.utils.utils import (
+    BatchStateExtractor,
+    EnvVariablesWrapper,
+    ExtendedState,
+    env_variables,
+    extend_state,
+    get_extraction_cache,
+    resolve_constants,
+    SpecContext,
+    state_values,
+)
+
+
+def _potentials(safety_reqs, target_reqs, comfort_reqs, values: np.ndarray) -> tuple:
+    """
+    Compute the safety, target and comfort potentials from the values of the variables,
+    of one state or of a batch of states, scoring all the requirements of each class at once.
+    """
+    safety_sat = requirement_satisfaction(safety_reqs, values)
+    safety_reward = np.sum(safety_sat, axis=0, dtype=np.float64)
+    safety_weight = np.all(safety_sat, axis=0).astype(np.float64)
+
+    target_scores = requirement_scores(target_reqs, values)
+    target_reward = safety_weight * np.sum(target_scores, axis=0)
+    target_weight = np.prod(target_scores, axis=0)
+
+    comfort_scores = requirement_scores(comfort_reqs, values)
+    comfort_reward = safety_weight * target_weight * np.sum(comfort_scores, axis=0)
+
+    return safety_reward, target_reward, comfort_reward
+
+
+def _base_reward(target_reqs, values: np.ndarray) -> np.ndarray:
+    """
+    Compute the sparse base reward, the number of satisfied target requirements,
+    of one state or of a batch of states.
+    """
+    return np.sum(
+        requirement_satisfaction(target_reqs, values), axis=0, dtype=np.float64
+    )
+
+
+def _hprs_reward(
+    base_reward, potentials: tuple, next_potentials: tuple, gamma: float, terminated
+) -> np.ndarray:
+    """
+    Add the potential-based shaping of the safety, target and comfort potentials to the base reward,
+    except for terminal states, of one step or of a batch of steps.
+    """
+    shaping = sum(
+        gamma * next_potential - potential
+        for potential, next_potential in zip(potentials, next_potentials)
+    )
+    return base_reward + np.where(terminated, 0.0, shaping)
+
+
+class SparseSuccessRewardWrapper(
+    gymnasium.Wrapper, gymnasium.utils.RecordConstructorArgs
+):
     """
     This wrapper provides a reward of 1.0 every time the agent satisfies the target condition.
+
+    The time spent to extract the variables and compute the reward is recorded by `profiler`, if enabled
+    (see `auto_shaping.utils.profiling`). The extended states, actions and done flags of every episode
+    are streamed to disk by `recorder`, if any (see `auto_shaping.utils.episode_recorder`).
     """
 
     def __init__(
         self,
         env: gymnasium.Env,
-        specs: list[str],
-        variables: list[Variable],
+        specs: list[str] = None,
+        variables: list[Variable] = None,
         constants: list[Constant] = None,
+        spec: RewardSpec = None,
     ):
+        gymnasium.utils.RecordConstructorArgs.__init__(
+            self,
+            specs=specs,
+            variables=variables,
+            constants=constants,
+            spec=spec,
+        )
         super(SparseSuccessRewardWrapper, self).__init__(env)
 
-        self._spec = RewardSpec(specs, variables, constants)
+        self._spec = build_reward_spec(specs, variables, constants, spec)
         self._target_specs = [
             spec
             for spec in self._spec.specs
             if spec._operator in ["achieve", "conquer"]
         ]
+        self._target_reqs = self._spec.requirement_arrays(["achieve", "conquer"])
         self._variables = self._spec.variables
         self._constants = self._spec.constants
 
-    def _reward(self, state, action, next_state, done, info):
-        reward = 0.0
+        # extended states of the last observation and of the previous one, swapped at every step
+        self._ext_state = ExtendedState(self._spec)
+        self._prev_ext_state = ExtendedState(self._spec)
+        self._context = SpecContext(self._spec)
+        self.extraction_cache, self._owns_cache = get_extraction_cache(env)
+        self.profiler = StepProfiler(name=type(self).__name__)
+        self.recorder = None
 
-        for target_spec in self._target_specs:
-            (fn, var_name), aritm_op, threshold = target_spec._predicate.to_tuple()
-            cmp_lambda = _cmp_lambdas[aritm_op]
+    def _reward(self, state, action, next_state, done, info):
+        values = state_values(next_state, self._spec)
+        return float(_base_reward(self._target_reqs, values))
+
+    def _extend(self, state, action) -> ExtendedState:
+        """
+        Compute the extended state once per step, or read it from the extraction cache
+        if a stacked wrapper already computed it.
+        """
+        if self._owns_cache:
+            self.extraction_cache.clear()
+
+        out = self._prev_ext_state
+        ext_state = self.extraction_cache.lookup(self._spec, state, action, out=out)
+        if ext_state is not None:
+            self.profiler.count("extract_cached")
+        else:
+            ext_state = extend_state(
+                env=self,
+                state=state,
+                action=action,
+                spec=self._spec,
+                out=out,
+                context=self._context,
+            )
+            self.extraction_cache.store(self._spec, ext_state)
+
+        self._prev_ext_state, self._ext_state = self._ext_state, ext_state
+        return ext_state
 
-            val = fns[fn](next_state[var_name])
+    def reset(self, **kwargs):
+        obs, info = super().reset(**kwargs)
+        resolve_constants(env=self, spec=self._spec, context=self._context)
+        action0 = np.zeros_like(self.action_space.sample())
+        self._extend(obs, action0)
 
-            reward += float(cmp_lambda(val, threshold))
-        return reward
+        if self.recorder is not None:
+            self.recorder.end_episode()
+            self.recorder.append(self._ext_state.array, action0)
+        return obs, info
 
     def step(self, action):
         next_obs, _, done, truncated, info = super().step(action)
-        ext_state = extend_state(
-            env=self, state=next_obs, action=action, spec=self._spec
-        )
-        reward = self._reward(None, action, ext_state, done, info)
+
+        t0 = self.profiler.start()
+        ext_state = self._extend(next_obs, action)
+        self.profiler.stop("extract", t0)
+
+        t0 = self.profiler.start()
+        reward = self._step_reward(action, ext_state, done, info)
+        self.profiler.stop("reward", t0)
+
+        if self.recorder is not None:
+            self.recorder.append(ext_state.array, action, done, truncated)
+            if done or truncated:
+                self.recorder.end_episode()
+
+        self.profiler.step(info)
         return next_obs, reward, done, truncated, info
 
+    def _step_reward(self, action, next_state, done, info) -> float:
+        return self._reward(None, action, next_state, done, info)
+
+    def _recorded_names(self) -> list[str]:
+        # the constants and used variables of the extended states
+        return list(self._spec.state_layout)
+
+    def close(self):
+        if self.recorder is not None:
+            self.recorder.close()
+        super().close()
+
+    def __getstate__(self) -> dict:
+        state = dict(self.__dict__)
+        state["recorder"] = None
+        return state
+
 
 class HPRSWrapper(SparseSuccessRewardWrapper):
     def __init__(
         self,
         env: gymnasium.Env,
-        specs: list[str],
-        variables: list[Variable],
+        specs: list[str] = None,
+        variables: list[Variable] = None,
         constants: list[Constant] = None,
         gamma: float = 1.0,
+        spec: RewardSpec = None,
     ):
         gymnasium.utils.RecordConstructorArgs.__init__(
             self,
             specs=specs,
             variables=variables,
             constants=constants,
+            spec=spec,
             gamma=gamma,
         )
-        super(HPRSWrapper, self).__init__(env, specs, variables, constants)
+        super(HPRSWrapper, self).__init__(env, specs, variables, constants, spec=spec)
 
         self._gamma = gamma
 
@@ -104,120 +226,205 @@ class HPRSWrapper(SparseSuccessRewardWrapper):
             len(self._target_spec) == 1
         ), f"There should be exactly one target specification, got {len(self._target_spec)}"
 
-        self._obs = None
+        # requirements compiled once into arrays, scored at once at every evaluation
+        self._safety_reqs = self._spec.requirement_arrays(["ensure"])
+        self._comfort_reqs = self._spec.requirement_arrays(["encourage"])
+
+        self._potentials = None
+
+    @property
+    def _obs(self) -> ExtendedState:
+        # extended state of the last observation, computed once per step by the sparse reward wrapper
+        return self._ext_state
 
     def reset(self, **kwargs):
         obs, info = super().reset(**kwargs)
-        action0 = np.zeros_like(self.action_space.sample())
-        self._obs = extend_state(env=self, state=obs, action=action0, spec=self._spec)
+        self._potentials = self._shaping_potentials(self._ext_state)
         return obs, info
 
-    def step(self, action):
-        next_obs, _, done, truncated, info = super().step(action)
-        ext_next_obs = extend_state(
-            env=self, state=next_obs, action=action, spec=self._spec
-        )
-        reward = self._hprs_reward(self._obs, action, ext_next_obs, done, info)
-        self._obs = ext_next_obs
-        return next_obs, reward, done, truncated, info
-
-    def _hprs_reward(self, state, action, next_state, done, info):
-        base_reward = super()._reward(state, action, next_state, done, info)
-
+    def _step_reward(self, action, next_state, done, info) -> float:
+        # the sparse reward of the base wrapper is the base reward of hprs
+        base_reward = super()._step_reward(action, next_state, done, info)
         # return base_reward for terminal states
         if done:
             return base_reward
 
-        # hierarchical auto_shaping
-        safety_shaping = self._gamma * self._safety_shaping(
-            next_state
-        ) - self._safety_shaping(state)
-        target_shaping = self._gamma * self._target_shaping(
-            next_state
-        ) - self._target_shaping(state)
-        comfort_shaping = self._gamma * self._comfort_shaping(
-            next_state
-        ) - self._comfort_shaping(state)
-
-        return base_reward + safety_shaping + target_shaping + comfort_shaping
-
-    def _safety_shaping(self, state) -> float:
-        reward = 0.0
-
-        for spec in self._safety_specs:
-            (fn, var), aritm_op, threshold = spec._predicate.to_tuple()
-            cmp_lambda = _cmp_lambdas[aritm_op]
-            val = fns[fn](state[var])
-
-            reward += float(cmp_lambda(val, threshold))
-
-        return reward
-
-    def _target_shaping(self, state) -> float:
-        reward = 0.0
-
-        safety_weight = 1.0
-        for spec in self._safety_specs:
-            (fn, var), aritm_op, threshold = spec._predicate.to_tuple()
-            cmp_lambda = _cmp_lambdas[aritm_op]
-            val = fns[fn](state[var])
-
-            safety_weight *= float(cmp_lambda(val, threshold))
-
-        for spec in self._target_spec:
-            (fn, var), aritm_op, threshold = spec._predicate.to_tuple()
-            val = fns[fn](state[var])
-
-            minv = self._variables[var].min
-            maxv = self._variables[var].max
-
-            if aritm_op in [">", ">="]:
-                target_reward = clip_and_norm(val, minv, threshold)
-            elif aritm_op in ["<", "<="]:
-                target_reward = 1.0 - clip_and_norm(val, threshold, maxv)
-
-            reward += safety_weight * target_reward
+        # hierarchical auto_shaping, the potentials of state are carried from the previous step
+        potentials = self._potentials
+        self._potentials = self._shaping_potentials(next_state)
+        return float(
+            _hprs_reward(base_reward, potentials, self._potentials, self._gamma, done)
+        )
 
-        return reward
+    def _shaping_potentials(self, state) -> tuple[float, float, float]:
+        """
+        Compute the safety, target and comfort potentials of a state in a single pass,
+        evaluating each predicate once.
+        """
+        safety, target, comfort = _potentials(
+            self._safety_reqs,
+            self._target_reqs,
+            self._comfort_reqs,
+            state_values(state, self._spec),
+        )
+        return float(safety), float(target), float(comfort)
 
-    def _comfort_shaping(self, state) -> float:
-        reward = 0.0
 
-        safety_weight = 1.0
-        for spec in self._safety_specs:
-            (fn, var), aritm_op, threshold = spec._predicate.to_tuple()
-            cmp_lambda = _cmp_lambdas[aritm_op]
-            val = fns[fn](state[var])
+class HPRSVectorWrapper(gymnasium.vector.VectorEnvWrapper):
+    """
+    HPRS for vectorized environments, where the rewards of all the sub-environments are computed
+    together with array operations over the batch of observations.
 
-            safety_weight *= float(cmp_lambda(val, threshold))
+    The vector environment is expected to autoreset the sub-environments, as the ones of gymnasium:
+    at the end of an episode, the reward is computed on the terminal observation from `info["final_observation"]`
+    and the potential carried to the next step is the one of the reset observation.
 
-        target_weight = 1.0
-        for spec in self._target_spec:
-            (fn, var), aritm_op, threshold = spec._predicate.to_tuple()
-            val = fns[fn](state[var])
+    Variables referring to `env` require a vector environment which exposes the sub-environments
+    in `envs` (e.g., `SyncVectorEnv`). Since the sub-environments are autoreset before the step returns,
+    they are wrapped in `EnvVariablesWrapper` to evaluate these variables before the reset,
+    and the values of the terminal states are read from `info["final_info"]`.
+    """
 
-            minv = self._variables[var].min
-            maxv = self._variables[var].max
+    def __init__(
+        self,
+        env: gymnasium.vector.VectorEnv,
+        specs: list[str] = None,
+        variables: list[Variable] = None,
+        constants: list[Constant] = None,
+        gamma: float = 1.0,
+        spec: RewardSpec = None,
+    ):
+        super(HPRSVectorWrapper, self).__init__(env)
 
-            if aritm_op in [">", ">="]:
-                target_reward = clip_and_norm(val, minv, threshold)
-            elif aritm_op in ["<", "<="]:
-                target_reward = 1.0 - clip_and_norm(val, threshold, maxv)
+        self._spec = build_reward_spec(specs, variables, constants, spec)
+        self._gamma = gamma
 
-            target_weight *= target_reward
+        target_specs = [
+            spec
+            for spec in self._spec.specs
+            if spec._operator in ["achieve", "conquer"]
+        ]
 
-        for spec in self._comfort_specs:
-            (fn, var), aritm_op, threshold = spec._predicate.to_tuple()
-            val = fns[fn](state[var])
+        assert (
+            len(target_specs) == 1
+        ), f"There should be exactly one target specification, got {len(target_specs)}"
 
-            minv = self._variables[var].min
-            maxv = self._variables[var].max
+        self._safety_reqs = self._spec.requirement_arrays(["ensure"])
+        self._target_reqs = self._spec.requirement_arrays(["achieve", "conquer"])
+        self._comfort_reqs = self._spec.requirement_arrays(["encourage"])
 
-            if aritm_op in [">", ">="]:
-                comfort_reward = clip_and_norm(val, minv, threshold)
-            elif aritm_op in ["<", "<="]:
-                comfort_reward = 1.0 - clip_and_norm(val, threshold, maxv)
+        envs = getattr(env.unwrapped, "envs", None)
+        self._extractor = BatchStateExtractor(
+            spec=self._spec, envs=None if envs is None else list(envs)
+        )
 
-            reward += safety_weight * target_weight * comfort_reward
+        # the variables referring to env are reported by the sub-environments in their infos
+        self._info_key = f"env_variables/{id(self)}"
+        self._env_variables = []
+        if envs is not None and len(env_variables(self._spec)) > 0:
+            for i, sub_env in enumerate(envs):
+                envs[i] = EnvVariablesWrapper(sub_env, self._spec, key=self._info_key)
+            self._env_variables = envs[0]._reported
+        self._actions = None
+        self._potentials = None
+        self.profiler = StepProfiler(name=type(self).__name__)
+
+    def reset_wait(self, **kwargs):
+        obs, infos = self.env.reset_wait(**kwargs)
+        self._extractor.reset()
+        actions0 = np.zeros_like(self.action_space.sample())
+        reset_state = self._extractor(obs, actions0, env_values=self._env_values(infos))
+        self._potentials = self._shaping_potentials(
+            state_values(reset_state, self._spec)
+        )
+        return obs, infos
+
+    def step_async(self, actions):
+        self._actions = np.asarray(actions)
+        self.env.step_async(actions)
+
+    def step_wait(self):
+        obs, _, terminateds, truncateds, infos = self.env.step_wait()
+        dones = np.logical_or(terminateds, truncateds)
+        done_ids = np.flatnonzero(dones)
+
+        # the rewards of the ended episodes are computed on their final observations
+        next_obs = obs
+        if len(done_ids) > 0 and "final_observation" in infos:
+            next_obs = np.array(obs, copy=True)
+            for i in np.flatnonzero(infos["_final_observation"]):
+                next_obs[i] = infos["final_observation"][i]
+
+        t0 = self.profiler.start()
+        next_state = self._extractor(
+            next_obs, self._actions, env_values=self._env_values(infos, final=True)
+        )
+        self.profiler.stop("extract", t0)
+
+        t0 = self.profiler.start()
+        rewards = self._hprs_rewards(next_state, terminateds)
+        self.profiler.stop("reward", t0)
+
+        # the potentials of the autoreset sub-environments restart from the reset observations
+        if len(done_ids) > 0:
+            t0 = self.profiler.start()
+            self.profiler.count("autoresets", len(done_ids))
+            self._extractor.reset(done_ids)
+            actions0 = np.zeros_like(self._actions[done_ids])
+            reset_values = self._env_values(infos)
+            if reset_values is not None:
+                reset_values = {k: v[done_ids] for k, v in reset_values.items()}
+            reset_state = self._extractor(
+                obs[done_ids], actions0, indices=done_ids, env_values=reset_values
+            )
+            reset_values = state_values(reset_state, self._spec)
+            for potential, reset_potential in zip(
+                self._potentials, self._shaping_potentials(reset_values)
+            ):
+                potential[done_ids] = reset_potential
+            self.profiler.stop("autoreset", t0)
+
+        self.profiler.step(infos)
+        return obs, rewards, terminateds, truncateds, infos
+
+    def _env_values(self, infos: dict, final: bool = False) -> dict:
+        """
+        Return the values of the variables referring to `env` reported in the infos of the sub-environments,
+        for the terminal states of the ended episodes if `final`, otherwise for the current states.
+        """
+        if len(self._env_variables) == 0:
+            return None
+
+        env_values = {
+            var_name: np.zeros(self.num_envs, dtype=np.float64)
+            for var_name in self._env_variables
+        }
+        final_mask = infos.get("_final_info", np.zeros(self.num_envs, dtype=bool))
+        for i in range(self.num_envs):
+            if final and final_mask[i]:
+                values = infos["final_info"][i][self._info_key]
+            else:
+                values = infos[self._info_key][i]
+            for var_name in self._env_variables:
+                env_values[var_name][i] = values[var_name]
+        return env_values
+
+    def _hprs_rewards(self, next_state, terminateds) -> np.ndarray:
+        values = state_values(next_state, self._spec)
+        base_rewards = _base_reward(self._target_reqs, values)
+
+        # hierarchical auto_shaping, except for terminal states
+        potentials = self._potentials
+        self._potentials = self._shaping_potentials(values)
+        return _hprs_reward(
+            base_rewards, potentials, self._potentials, self._gamma, terminateds
+        )
 
-        return reward
+    def _shaping_potentials(self, values) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Compute the safety, target and comfort potentials of a batch of states,
+        given the values of their variables with shape (n_variables, batch_size).
+        """
+        return _potentials(
+            self._safety_reqs, self._target_reqs, self._comfort_reqs, values
+        )
@@ -0,0 +1,280 @@
+"""
+Several reward shaping signals computed from one extraction and one trace per step.
+"""
+
+from typing import List, Mapping
+
+import gymnasium
+import numpy as np
+
+from auto_shaping.hprs_shaping import _base_reward, _hprs_reward, _potentials
+from auto_shaping.pam_shaping import pam_reward
+from auto_shaping.rpr_shaping import rpr_reward
+from auto_shaping.spec.reward_spec import (
+    Variable,
+    Constant,
+    RewardSpec,
+    build_reward_spec,
+)
+from auto_shaping.utils.collection_wrapper import CollectionWrapper
+from auto_shaping.utils.online_monitor import OnlineRequirementsMonitor
+from auto_shaping.utils.robustness import (
+    monitor_requirements,
+    split_requirements,
+    stl_requirements,
+)
+from auto_shaping.utils.utils import (
+    ExtendedState,
+    StateExtractor,
+    monitor_filtering_stl_episode,
+    state_values,
+)
+
+
+class _TLTLReward:
+    def __init__(self, spec: RewardSpec, engine: str = "native"):
+        assert engine in ["native", "rtamt", "online"], f"Unknown engine {engine}"
+        self._engine = engine
+        self._reqs = stl_requirements(spec)
+        self._variables = list(spec.used_variables)
+        self._monitor = None
+        if engine == "online":
+            self._monitor = OnlineRequirementsMonitor(self._reqs)
+        self.window_len = 1 if engine == "online" else None
+
+    def reset(self, episode: Mapping, ext_state: ExtendedState):
+        if self._monitor is not None:
+            self._monitor.reset()
+            self._monitor.update_last(episode)
+
+    def __call__(self, episode: Mapping, ext_state: ExtendedState, done: bool) -> float:
+        if self._monitor is not None:
+            self._monitor.update_last(episode)
+
+        if not done:
+            return 0.0
+        if self._monitor is not None:
+            return self._monitor.robustness
+        return monitor_requirements(
+            self._reqs, self._variables, episode, engine=self._engine
+        )
+
+
+class _BHNRReward:
+    def __init__(self, spec: RewardSpec, window_len: int = 10, engine: str = "rtamt"):
+        assert engine in ["rtamt", "online"], f"Unknown engine {engine}"
+        self._window_len = window_len
+        self._reqs = stl_requirements(spec)
+        self._stl_spec = " and ".join([req.to_rtamt() for req in self._reqs])
+        self._variables = list(spec.used_variables)
+        self._monitor = None
+        if engine == "online":
+            self._monitor = OnlineRequirementsMonitor(self._reqs, window_len=window_len)
+        self.window_len = 1 if engine == "online" else window_len
+
+    def reset(self, episode: Mapping, ext_state: ExtendedState):
+        if self._monitor is not None:
+            self._monitor.reset()
+            self._monitor.update_last(episode)
+
+    def __call__(self, episode: Mapping, ext_state: ExtendedState, done: bool) -> float:
+        if self._monitor is not None:
+            self._monitor.update_last(episode)
+
+        # compute robustness if episode is at least 2 steps long
+        if self._monitor is not None:
+            return self._monitor.robustness if self._monitor.n_samples > 1 else 0.0
+        if len(episode["time"]) < 2:
+            return 0.0
+
+        # the most recent window of the shared trace
+        window = {name: trace[-self._window_len :] for name, trace in episode.items()}
+        robustness_trace = monitor_filtering_stl_episode(
+            self._stl_spec, self._variables, window
+        )
+        return robustness_trace[0][1]
+
+
+class _HPRSReward:
+    def __init__(self, spec: RewardSpec, gamma: float = 1.0):
+        target_specs = [
+            req for req in spec.specs if req._operator in ["achieve", "conquer"]
+        ]
+        assert (
+            len(target_specs) == 1
+        ), f"There should be exactly one target specification, got {len(target_specs)}"
+
+        self._spec = spec
+        self._gamma = gamma
+        self._safety_reqs = spec.requirement_arrays(["ensure"])
+        self._target_reqs = spec.requirement_arrays(["achieve", "conquer"])
+        self._comfort_reqs = spec.requirement_arrays(["encourage"])
+        self._potentials = None
+        self.window_len = 1
+
+    def _shaping_potentials(self, values: np.ndarray) -> tuple[float, float, float]:
+        potentials = _potentials(
+            self._safety_reqs, self._target_reqs, self._comfort_reqs, values
+        )
+        return tuple([float(potential) for potential in potentials])
+
+    def reset(self, episode: Mapping, ext_state: ExtendedState):
+        self._potentials = self._shaping_potentials(state_values(ext_state, self._spec))
+
+    def __call__(self, episode: Mapping, ext_state: ExtendedState, done: bool) -> float:
+        values = state_values(ext_state, self._spec)
+        base_reward = float(_base_reward(self._target_reqs, values))
+        if done:
+            return base_reward
+
+        # hierarchical auto_shaping, the potentials of state are carried from the previous step
+        potentials = self._potentials
+        self._potentials = self._shaping_potentials(values)
+        return float(
+            _hprs_reward(base_reward, potentials, self._potentials, self._gamma, done)
+        )
+
+
+class _PAMReward:
+    def __init__(self, spec: RewardSpec, params: dict = None, engine: str = "native"):
+        assert engine in ["native", "rtamt"], f"Unknown engine {engine}"
+        self._engine = engine
+        self._params = {"max_length": None}
+        self._params.update(params or {})
+        self._specs = split_requirements(spec)
+        self._variables = list(spec.used_variables)
+        self.window_len = None
+
+    def reset(self, episode: Mapping, ext_state: ExtendedState):
+        pass
+
+    def __call__(self, episode: Mapping, ext_state: ExtendedState, done: bool) -> float:
+        if not done:
+            return 0.0
+        return pam_reward(
+            *self._specs,
+            self._variables,
+            episode,
+            max_length=self._params["max_length"],
+            engine=self._engine,
+        )
+
+
+class _RPRReward(_PAMReward):
+    def __init__(self, spec: RewardSpec, params: dict = None, engine: str = "native"):
+        super().__init__(spec, params={"base_coeff": 2.01}, engine=engine)
+        self._params.update(params or {})
+
+    def __call__(self, episode: Mapping, ext_state: ExtendedState, done: bool) -> float:
+        if not done:
+            return 0.0
+        return rpr_reward(
+            *self._specs,
+            self._variables,
+            episode,
+            max_length=self._params["max_length"],
+            base_coeff=self._params["base_coeff"],
+            engine=self._engine,
+        )
+
+
+_reward_terms = {
+    "TLTL": _TLTLReward,
+    "BHNR": _BHNRReward,
+    "HPRS": _HPRSReward,
+    "PAM": _PAMReward,
+    "RPR": _RPRReward,
+}
+
+
+class MultiRewardWrapper(CollectionWrapper):
+    """
+    Computes several rewards of the same specification, among TLTL, BHNR, HPRS, PAM and RPR,
+    from one extended state and one collected trace per step, instead of one wrapper for each reward.
+
+    The step returns the training reward, and all the computed rewards are in `info["rewards"]`.
+    The trace is collected over the whole episode if any reward needs it (e.g., PAM),
+    otherwise only over the longest window needed (e.g., BHNR).
+
+    :param env: the environment to wrap
+    :param rewards: the names of the rewards to compute
+    :param train_reward: the reward returned by `step`, by default the first of `rewards`
+    :param reward_kwargs: the keyword arguments of each reward as in its wrapper,
+                          e.g. {"HPRS": {"gamma": 0.99}, "BHNR": {"window_len": 10}}
+    :param spec: the reward specification, alternative to specs, variables and constants
+    """
+
+    def __init__(
+        self,
+        env: gymnasium.Env,
+        rewards: List[str],
+        train_reward: str = None,
+        specs: list[str] = None,
+        variables: list[Variable] = None,
+        constants: list[Constant] = None,
+        reward_kwargs: dict = None,
+        spec: RewardSpec = None,
+    ):
+        gymnasium.utils.RecordConstructorArgs.__init__(
+            self,
+            rewards=rewards,
+            train_reward=train_reward,
+            specs=specs,
+            variables=variables,
+            constants=constants,
+            reward_kwargs=reward_kwargs,
+            spec=spec,
+        )
+        assert len(rewards) > 0, "At least one reward must be provided"
+        for reward in rewards:
+            assert reward in _reward_terms, f"Unknown reward {reward}"
+        train_reward = train_reward or rewards[0]
+        assert (
+            train_reward in rewards
+        ), f"train reward {train_reward} must be one of {rewards}"
+        self._train_reward = train_reward
+
+        self._spec = build_reward_spec(specs, variables, constants, spec)
+        reward_kwargs = reward_kwargs or {}
+        self._rewards = {
+            reward: _reward_terms[reward](self._spec, **reward_kwargs.get(reward, {}))
+            for reward in rewards
+        }
+
+        window_lens = [term.window_len for term in self._rewards.values()]
+        window_len = None if None in window_lens else max(window_lens)
+
+        # constants are resolved in the requirements, only used variables are collected
+        self._variables = list(self._spec.used_variables)
+        extractor_fn = StateExtractor(env=env, spec=self._spec)
+        super(MultiRewardWrapper, self).__init__(
+            env,
+            extractor_fn=extractor_fn,
+            variables=self._variables,
+            window_len=window_len,
+        )
+        self._ext_state = None
+
+    def _collect(self, obs):
+        # the extended state is also read by the rewards on the current state (e.g., HPRS)
+        self._ext_state = obs
+        super()._collect(obs)
+
+    def reset(self, **kwargs):
+        obs, info = super().reset(**kwargs)
+        for term in self._rewards.values():
+            term.reset(self._episode, self._ext_state)
+        return obs, info
+
+    def step(self, action):
+        obs, _, done, truncated, info = super().step(action)
+
+        rewards = {}
+        for name, term in self._rewards.items():
+            t0 = self.profiler.start()
+            rewards[name] = float(term(self._episode, self._ext_state, done))
+            self.profiler.stop(f"reward/{name}", t0)
+
+        info["rewards"] = rewards
+        self.profiler.step(info)
+        return obs, rewards[self._train_reward], done, truncated, info
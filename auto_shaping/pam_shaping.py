@@ -3,65 +3,161 @@ Policy-Assessment Metric from:
 "Hierarchical Potential-based Reward Shaping from Task Specifications" by Berducci et al., (arxiv, 2021)
 https://arxiv.org/abs/2110.02792
 """
-import warnings
+from typing import List, Mapping
 
 import gymnasium
 import numpy as np
 
-from auto_shaping.spec.reward_spec import Variable, Constant, RewardSpec
-from auto_shaping.utils import monitor_stl_episode
+from auto_shaping.spec.reward_spec import (
+    Variable,
+    Constant,
+    PredicateSpec,
+    RequirementSpec,
+    RewardSpec,
+    build_reward_spec,
+)
 from auto_shaping.utils.collection_wrapper import CollectionWrapper
-from auto_shaping.utils.utils import extend_state
+from auto_shaping.utils.profiling import StepProfiler
+from auto_shaping.utils.robustness import (
+    monitor_requirements,
+    monitor_predicate,
+    split_requirements,
+)
+from auto_shaping.utils.utils import StateExtractor
+
+
+def pam_reward(
+    safety_specs: List[RequirementSpec],
+    target_specs: List[RequirementSpec],
+    comfort_specs: List[PredicateSpec],
+    variables: List[str],
+    episode: Mapping,
+    max_length: int = None,
+    engine: str = "native",
+    profiler: StepProfiler = None,
+) -> float:
+    """
+    Policy-assessment metric of a complete episode.
+
+    :param safety_specs: the safety requirements
+    :param target_specs: the target requirements
+    :param comfort_specs: the predicates of the comfort requirements
+    :param variables: the variables collected in the episode
+    :param episode: the collected episode, as a mapping of variable traces with "time"
+    :param max_length: the maximum length of an episode, steps missing to it count as comfort violations
+    :param engine: "native" or "rtamt"
+    :param profiler: the profiler recording the time to monitor each requirement, if any
+    """
+    profiler = profiler or StepProfiler(name="PAM")
+    safety_sat, target_sat, comfort_sat = 1.0, 1.0, 1.0
+
+    for req_spec in safety_specs:
+        t0 = profiler.start()
+        rho = monitor_requirements(
+            [req_spec],
+            variables,
+            episode,
+            engine=engine,
+        )
+        profiler.stop(f"monitor/{req_spec}", t0)
+        sat = float(rho >= 0)
+        safety_sat *= sat
+
+    for req_spec in target_specs:
+        t0 = profiler.start()
+        rho = monitor_requirements(
+            [req_spec],
+            variables,
+            episode,
+            engine=engine,
+        )
+        profiler.stop(f"monitor/{req_spec}", t0)
+        sat = float(rho >= 0)
+        target_sat *= sat
+
+    comfort_sat = 1.0
+    comfort_rhos = []
+    for pred_spec in comfort_specs:
+        t0 = profiler.start()
+        robustness_trace = monitor_predicate(
+            pred_spec,
+            variables,
+            episode,
+            engine=engine,
+        )
+        profiler.stop(f"monitor/encourage {pred_spec.to_rtamt()}", t0)
+        # steps missing to max length count as violations
+        max_len_episode = max_length or len(episode["time"])
+        n_steps = max(max_len_episode, len(robustness_trace))
+        rho = np.sum(robustness_trace >= 0) / n_steps
+        comfort_rhos.append(rho)
+
+    if len(comfort_rhos) > 0:
+        comfort_sat *= float(np.mean(comfort_rhos))
+
+    return safety_sat + 0.5 * target_sat + 0.25 * comfort_sat
+
+
+def pam_reward_batch(
+    safety_rhos: np.ndarray,
+    target_rhos: np.ndarray,
+    comfort_rates: np.ndarray,
+) -> np.ndarray:
+    """
+    Policy-assessment metric of a batch of complete episodes, as `pam_reward` for each episode.
+
+    :param safety_rhos: the robustness of each safety requirement, with shape (n_episodes, n_safety)
+    :param target_rhos: the robustness of each target requirement, with shape (n_episodes, n_target)
+    :param comfort_rates: the fraction of steps satisfying each comfort predicate, with shape (n_episodes, n_comfort)
+    """
+    safety_sat = np.all(safety_rhos >= 0, axis=1).astype(np.float64)
+    target_sat = np.all(target_rhos >= 0, axis=1).astype(np.float64)
+    comfort_sat = np.ones(len(comfort_rates), dtype=np.float64)
+    if comfort_rates.shape[1] > 0:
+        comfort_sat *= np.mean(comfort_rates, axis=1)
+
+    return safety_sat + 0.5 * target_sat + 0.25 * comfort_sat
 
 
 class PAMWrapper(CollectionWrapper):
     def __init__(
         self,
         env: gymnasium.Env,
-        specs: list[str],
-        variables: list[Variable],
+        specs: list[str] = None,
+        variables: list[Variable] = None,
         constants: list[Constant] = None,
         params: dict = None,
+        engine: str = "native",
+        spec: RewardSpec = None,
     ):
+        gymnasium.utils.RecordConstructorArgs.__init__(
+            self,
+            specs=specs,
+            variables=variables,
+            constants=constants,
+            spec=spec,
+            params=params,
+            engine=engine,
+        )
+        assert engine in ["native", "rtamt"], f"Unknown engine {engine}"
+        self._engine = engine
+
         self._params = {
             "max_length": None,
         }
         self._params.update(params or {})
 
-        self._spec = RewardSpec(
-            specs=specs,
-            variables=variables,
-            constants=constants,
-        )
+        self._spec = build_reward_spec(specs, variables, constants, spec)
 
-        self._stl_safety_specs = []
-        self._stl_target_specs = []
-        self._stl_comfort_specs = []
-        for req_spec in self._spec.specs:
-            try:
-                if req_spec._operator == "ensure":
-                    stl_req = req_spec.to_rtamt()
-                    self._stl_safety_specs.append(stl_req)
-                elif req_spec._operator in ["achieve", "conquer"]:
-                    stl_req = req_spec.to_rtamt()
-                    self._stl_target_specs.append(stl_req)
-                elif req_spec._operator == "encourage":
-                    # encourage is a special case, in which PAM uses average semantics
-                    stl_req = req_spec._predicate.to_rtamt()    # does it even work?
-                    self._stl_comfort_specs.append(stl_req)
-                else:
-                    raise NotImplementedError()
-            except Exception as e:
-                warnings.warn(
-                    f"Failed to parse requirement: {req_spec}, make sure it is a valid STL formula"
-                )
-
-        self._variables = [var for var in self._spec.variables] + [
-            var for var in self._spec.constants
-        ]
-        extractor_fn = lambda state, action: extend_state(
-            env=env, state=state, action=action, spec=self._spec
-        )
+        (
+            self._safety_specs,
+            self._target_specs,
+            self._comfort_specs,
+        ) = split_requirements(self._spec)
+
+        # constants are resolved in the requirements, only used variables are collected
+        self._variables = list(self._spec.used_variables)
+        extractor_fn = StateExtractor(env=env, spec=self._spec)
         super(PAMWrapper, self).__init__(
             env,
             extractor_fn=extractor_fn,
@@ -74,49 +170,21 @@ class PAMWrapper(CollectionWrapper):
         reward = 0.0
 
         if done:
-            safety_sat, target_sat, comfort_sat = 1.0, 1.0, 1.0
-
-            for stl_spec in self._stl_safety_specs:
-                robustness_trace = monitor_stl_episode(
-                    stl_spec,
-                    self._variables,
-                    self._episode,
-                )
-                sat = float(robustness_trace[0][1] >= 0)
-                safety_sat *= sat
-
-            for stl_spec in self._stl_target_specs:
-                robustness_trace = monitor_stl_episode(
-                    stl_spec,
-                    self._variables,
-                    self._episode,
-                )
-                sat = float(robustness_trace[0][1] >= 0)
-                target_sat *= sat
-
-            comfort_sat = 1.0
-            comfort_rhos = []
-            for stl_spec in self._stl_comfort_specs:
-                robustness_trace = monitor_stl_episode(
-                    stl_spec,
-                    self._variables,
-                    self._episode,
-                )
-                max_len_episode = self._params["max_length"] or len(self._episode["time"])
-                robustness_trace = robustness_trace + [
-                    [-1, -1] for _ in range((max_len_episode - len(robustness_trace)))
-                ]
-                rho = np.mean([float(rob >= 0) for t, rob in robustness_trace])
-                comfort_rhos.append(rho)
-
-            if len(comfort_rhos) > 0:
-                comfort_sat *= float(np.mean(comfort_rhos))
-
-            reward = safety_sat + 0.5 * target_sat + 0.25 * comfort_sat
+            reward = pam_reward(
+                self._safety_specs,
+                self._target_specs,
+                self._comfort_specs,
+                self._variables,
+                self._episode,
+                max_length=self._params["max_length"],
+                engine=self._engine,
+                profiler=self.profiler,
+            )
 
         return reward
 
     def step(self, action):
         obs, _, done, truncated, info = super().step(action)
         reward = self._reward(obs, done, info)
+        self.profiler.step(info)
         return obs, reward, done, truncated, info
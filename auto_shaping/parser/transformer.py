@@ -2,8 +2,17 @@ from lark import Transformer
 
 
 class RewardShapingTransformer(Transformer):
+    """
+    Transforms the parse tree of requirements, resolving the constants with their values.
+
+    :param assignments: the values of the constants, by name
+    """
+
     list = list
-    assignments = {}
+
+    def __init__(self, assignments: dict = None):
+        super().__init__()
+        self.assignments = dict(assignments or {})
 
     def add_constant(self, name, value):
         self.assignments[name] = value
@@ -61,8 +70,8 @@ class RewardShapingTransformer(Transformer):
             raise ValueError(f"Variable {var} not defined")
 
         if isinstance(self.assignments[var], str):
-            assert False
-            evaluated = eval(self.assignments[var], self.assignments)
-        else:
-            evaluated = self.assignments[var]
-        return float(evaluated)
+            raise ValueError(
+                f"Constant {var} depends on the environment, it cannot be used in a requirement"
+            )
+
+        return float(self.assignments[var])
@@ -0,0 +1,159 @@
+"""
+Relabeling of the rewards of stored transitions under a new reward specification
+(e.g., another `gamma`, thresholds or constants for HPRS), without collecting new data.
+
+The transitions are mapped to extended states in bulk by `BatchStateExtractor`
+and the rewards are computed with the kernels of `HPRSVectorWrapper`, chunk by chunk,
+so that the memory stays bounded by the chunk size.
+"""
+
+import numpy as np
+
+from auto_shaping.hprs_shaping import _base_reward, _hprs_reward, _potentials
+from auto_shaping.spec.reward_spec import RewardSpec
+from auto_shaping.utils.utils import BatchStateExtractor, state_values
+
+
+class RewardRelabeler:
+    """
+    Computes the HPRS or sparse success rewards of batches of transitions (s, a, s'),
+    with the same rewards as `HPRSVectorWrapper` and `SparseSuccessRewardWrapper`.
+
+    The potential of s is computed on its extended state with the action of the previous step,
+    as carried by the wrappers from the previous step, and the null action at the start of episodes.
+    Variables and constants depending on `env` are not supported, since the transitions do not keep it.
+
+    :param spec: the reward specification
+    :param reward: "HPRS" or "sparse"
+    :param gamma: the discount factor of the potential-based shaping of HPRS
+    """
+
+    def __init__(self, spec: RewardSpec, reward: str = "HPRS", gamma: float = 1.0):
+        assert reward in ["HPRS", "sparse"], f"Unknown reward {reward}"
+        target_specs = [
+            req for req in spec.specs if req._operator in ["achieve", "conquer"]
+        ]
+        assert (
+            reward == "sparse" or len(target_specs) == 1
+        ), f"There should be exactly one target specification, got {len(target_specs)}"
+
+        self._spec = spec
+        self._reward = reward
+        self._gamma = gamma
+        self._safety_reqs = spec.requirement_arrays(["ensure"])
+        self._target_reqs = spec.requirement_arrays(["achieve", "conquer"])
+        self._comfort_reqs = spec.requirement_arrays(["encourage"])
+        self._extractor = BatchStateExtractor(spec=spec)
+
+    def _values(self, states: np.ndarray, actions: np.ndarray) -> np.ndarray:
+        return state_values(self._extractor(states, actions), self._spec)
+
+    def __call__(
+        self,
+        observations: np.ndarray,
+        actions: np.ndarray,
+        next_observations: np.ndarray,
+        terminated: np.ndarray,
+        prev_actions: np.ndarray = None,
+    ) -> np.ndarray:
+        """
+        Return the rewards of a batch of transitions, with shape (batch_size,).
+
+        :param observations: the observations s, with shape (batch_size, ...)
+        :param actions: the actions a, with shape (batch_size, ...)
+        :param next_observations: the observations s' after the actions, with shape (batch_size, ...)
+        :param terminated: whether s' is terminal, with shape (batch_size,)
+        :param prev_actions: the actions leading to s, null at the start of episodes, by default all null
+        """
+        actions = np.asarray(actions)
+        next_values = self._values(next_observations, actions)
+        base_rewards = _base_reward(self._target_reqs, next_values)
+        if self._reward == "sparse":
+            return base_rewards
+
+        if prev_actions is None:
+            prev_actions = np.zeros_like(actions)
+        values = self._values(observations, prev_actions)
+
+        # hierarchical auto_shaping, except for terminal states
+        reqs = (self._safety_reqs, self._target_reqs, self._comfort_reqs)
+        return _hprs_reward(
+            base_rewards,
+            _potentials(*reqs, values),
+            _potentials(*reqs, next_values),
+            self._gamma,
+            terminated,
+        )
+
+
+def _flat(x: np.ndarray) -> np.ndarray:
+    # the transitions of all the environments, from shape (n_rows, n_envs, ...)
+    return x.reshape((x.shape[0] * x.shape[1],) + x.shape[2:])
+
+
+def relabel_replay_buffer(
+    buffer,
+    spec: RewardSpec,
+    reward: str = "HPRS",
+    gamma: float = 1.0,
+    chunk_size: int = 65536,
+) -> np.ndarray:
+    """
+    Recompute in place the rewards of the transitions stored in a stable-baselines3 `ReplayBuffer`,
+    processing the buffer in chunks of about `chunk_size` transitions, and return them.
+
+    The stored observations must be the states expected by the specification (e.g., flattened Box observations).
+    The done flags of the buffer are the ends of the episodes, and they are terminal unless marked as timeouts.
+    With `optimize_memory_usage`, the next observations of the last transitions of the episodes are overwritten
+    by the reset observations, so the stored rewards of these transitions are kept.
+
+    :param buffer: the replay buffer, with arrays of shape (buffer_size, n_envs, ...)
+    :param spec: the reward specification
+    :param reward: "HPRS" or "sparse"
+    :param gamma: the discount factor of the potential-based shaping of HPRS
+    :param chunk_size: the number of transitions processed at once
+    """
+    if isinstance(buffer.observations, dict):
+        raise ValueError("Replay buffers of dict observations are not supported")
+    assert chunk_size > 0, "chunk_size must be positive"
+
+    relabeler = RewardRelabeler(spec=spec, reward=reward, gamma=gamma)
+    buffer_size, n_envs = buffer.buffer_size, buffer.n_envs
+    n_rows = buffer_size if buffer.full else buffer.pos
+    # the oldest row has no previous step, the previous row was overwritten or never stored
+    first_row = buffer.pos if buffer.full else 0
+    rows_per_chunk = max(1, chunk_size // n_envs)
+
+    for start in range(0, n_rows, rows_per_chunk):
+        rows = np.arange(start, min(start + rows_per_chunk, n_rows))
+        next_rows = (rows + 1) % buffer_size
+        prev_rows = (rows - 1) % buffer_size
+
+        observations = buffer.observations[rows]
+        if buffer.optimize_memory_usage:
+            next_observations = buffer.observations[next_rows]
+        else:
+            next_observations = buffer.next_observations[rows]
+        actions = buffer.actions[rows]
+        dones = buffer.dones[rows]
+        terminated = dones * (1 - buffer.timeouts[rows]) > 0
+
+        # the action of the previous step, null at the start of episodes
+        prev_actions = buffer.actions[prev_rows]
+        episode_start = buffer.dones[prev_rows] > 0
+        episode_start[rows == first_row] = True
+        prev_actions[episode_start] = 0
+
+        rewards = relabeler(
+            observations=_flat(observations),
+            actions=_flat(actions),
+            next_observations=_flat(next_observations),
+            terminated=_flat(terminated),
+            prev_actions=_flat(prev_actions),
+        )
+        rewards = rewards.reshape(len(rows), n_envs)
+        if buffer.optimize_memory_usage:
+            rewards = np.where(dones > 0, buffer.rewards[rows], rewards)
+        buffer.rewards[rows] = rewards
+
+    return buffer.rewards[:n_rows]
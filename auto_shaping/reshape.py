@@ -0,0 +1,249 @@
+"""
+Offline computation of the rewards of recorded episodes under a reward specification,
+without stepping any environment.
+
+The episodes are read from a store written by `auto_shaping.utils.episode_recorder.EpisodeRecorder`,
+split across a pool of processes, and the rewards are streamed to a new store with one column
+per reward and the same episodes, in the same order.
+
+Usage:
+    python -m auto_shaping.reshape STORE OUT --spec configs/CartPole-v1.yaml --rewards TLTL PAM HPRS
+"""
+
+import json
+import multiprocessing
+import os
+import pathlib
+from typing import Dict, List, Union
+
+import numpy as np
+
+from auto_shaping.multi_reward import _reward_terms
+from auto_shaping.spec.reward_spec import RewardSpec
+from auto_shaping.utils.episode_recorder import EpisodeRecorder, EpisodeStore
+
+# state of the worker processes, set by `_init_worker`
+_worker = {}
+
+
+def episode_variables(spec: RewardSpec, episode: Dict[str, np.ndarray]) -> dict:
+    """
+    Return the traces of the used variables of the specification and of time.
+
+    The variables depending on the state, action or env are read from the recorded columns
+    with the same name, as well as the constants depending on the environment. The other variables
+    (e.g., derived variables) are evaluated step by step on these traces with the constants
+    of the specification, as by the wrappers, so that a new specification changes them.
+
+    :param spec: the reward specification
+    :param episode: the recorded episode, as a dict of traces
+    """
+    length = len(episode["terminated"])
+    namespace = {"np": np, **spec._constant_values}
+    for const_name in spec._env_constant_codes:
+        if const_name not in episode:
+            raise ValueError(
+                f"Constant {const_name} depends on env and is not recorded"
+            )
+        namespace[const_name] = float(episode[const_name][0])
+
+    traces = {}
+    for var_name in spec.used_variables:
+        names = spec._variable_names[var_name]
+        if len(names & {"state", "action", "env"}) > 0:
+            if var_name not in episode:
+                raise ValueError(
+                    f"Variable {var_name} is not recorded and depends on the state, action or env"
+                )
+            traces[var_name] = np.asarray(episode[var_name], dtype=np.float64)
+            continue
+
+        code = spec._variable_codes[var_name]
+        inputs = [name for name in names if name in traces]
+        if len(inputs) == 0:
+            traces[var_name] = np.full(length, float(eval(code, namespace)))
+            continue
+
+        trace = np.empty(length, dtype=np.float64)
+        for t in range(length):
+            namespace.update({name: float(traces[name][t]) for name in inputs})
+            trace[t] = float(eval(code, namespace))
+        traces[var_name] = trace
+
+    # the time of the collection wrappers, counted from 1 at reset
+    if "time" in episode:
+        traces["time"] = np.asarray(episode["time"], dtype=np.float64)
+    else:
+        traces["time"] = np.arange(1, length + 1, dtype=np.float64)
+    return traces
+
+
+def episode_rewards(
+    terms: dict, spec: RewardSpec, episode: Dict[str, np.ndarray]
+) -> np.ndarray:
+    """
+    Replay a recorded episode and return the rewards of each step, with shape (length, n_rewards),
+    as computed by the wrappers at each step (0.0 for the first sample, recorded at reset).
+
+    :param terms: the reward terms by name, as in `MultiRewardWrapper`
+    :param spec: the reward specification
+    :param episode: the recorded episode, as a dict of traces
+    """
+    traces = episode_variables(spec, episode)
+    terminated = episode["terminated"]
+    length = len(terminated)
+    variables = list(spec.used_variables)
+
+    rewards = np.zeros((length, len(terms)), dtype=np.float64)
+    for t in range(length):
+        prefix = {name: trace[: t + 1] for name, trace in traces.items()}
+        sample = {var: traces[var][t] for var in variables}
+        for j, term in enumerate(terms.values()):
+            if t == 0:
+                term.reset(prefix, sample)
+            else:
+                rewards[t, j] = term(prefix, sample, bool(terminated[t]))
+    return rewards
+
+
+def _init_worker(
+    store_path: str, compiled_spec: dict, rewards: List[str], reward_kwargs: dict
+):
+    spec = RewardSpec.from_compiled(compiled_spec)
+    _worker["store"] = EpisodeStore(store_path)
+    _worker["spec"] = spec
+    _worker["terms"] = {
+        reward: _reward_terms[reward](spec, **reward_kwargs.get(reward, {}))
+        for reward in rewards
+    }
+
+
+def _reshape_episodes(indices: List[int]) -> list:
+    store, spec, terms = _worker["store"], _worker["spec"], _worker["terms"]
+    results = []
+    for i in indices:
+        episode = store[i]
+        rewards = episode_rewards(terms, spec, episode)
+        results.append((rewards, episode["terminated"][:], episode["truncated"][:]))
+    return results
+
+
+def reshape(
+    store_path: Union[str, pathlib.Path],
+    out_path: Union[str, pathlib.Path],
+    spec: RewardSpec,
+    rewards: List[str],
+    reward_kwargs: dict = None,
+    workers: int = None,
+    chunk_size: int = 16,
+) -> EpisodeStore:
+    """
+    Compute the rewards of all the episodes of a store, and write them to a new store
+    with one column per reward, the done flags and the same episodes in the same order.
+
+    :param store_path: the store of the recorded episodes
+    :param out_path: the store of the rewards
+    :param spec: the reward specification
+    :param rewards: the rewards to compute, among TLTL, BHNR, HPRS, PAM, RPR
+    :param reward_kwargs: the keyword arguments of each reward as in its wrapper, e.g. {"HPRS": {"gamma": 0.99}}
+    :param workers: the number of processes, by default the number of cpus, 0 to run in this process
+    :param chunk_size: the number of episodes of a task
+    """
+    for reward in rewards:
+        assert reward in _reward_terms, f"Unknown reward {reward}"
+    assert chunk_size > 0, "chunk_size must be positive"
+
+    reward_kwargs = reward_kwargs or {}
+    workers = os.cpu_count() if workers is None else workers
+    n_episodes = len(EpisodeStore(store_path))
+    chunks = [
+        list(range(i, min(i + chunk_size, n_episodes)))
+        for i in range(0, n_episodes, chunk_size)
+    ]
+    init_args = (str(store_path), spec.to_compiled(), list(rewards), reward_kwargs)
+
+    recorder = EpisodeRecorder(out_path, names=rewards, action_size=0)
+    try:
+        if workers == 0:
+            _init_worker(*init_args)
+            results = map(_reshape_episodes, chunks)
+            _write_results(recorder, results)
+        else:
+            with multiprocessing.Pool(
+                workers, initializer=_init_worker, initargs=init_args
+            ) as pool:
+                # in order, so that the episodes are written as in the input store
+                _write_results(recorder, pool.imap(_reshape_episodes, chunks))
+    finally:
+        recorder.close()
+
+    return EpisodeStore(out_path)
+
+
+def _write_results(recorder: EpisodeRecorder, results):
+    for chunk in results:
+        for rewards, terminated, truncated in chunk:
+            for t in range(len(rewards)):
+                recorder.append(rewards[t], (), terminated[t], truncated[t])
+            recorder.end_episode()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Compute the rewards of recorded episodes under a reward specification."
+    )
+    parser.add_argument("store", type=str, help="The store of the recorded episodes.")
+    parser.add_argument("out", type=str, help="The store of the computed rewards.")
+    parser.add_argument(
+        "--spec",
+        type=str,
+        required=True,
+        help="The specification, as yaml or compiled json file.",
+    )
+    parser.add_argument(
+        "--rewards",
+        type=str,
+        nargs="+",
+        default=list(_reward_terms),
+        choices=list(_reward_terms),
+        help="The rewards to compute.",
+    )
+    parser.add_argument(
+        "--reward-kwargs",
+        type=json.loads,
+        default=None,
+        help='The keyword arguments of each reward, as json, e.g. \'{"HPRS": {"gamma": 0.99}}\'.',
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="The number of processes, by default the number of cpus.",
+    )
+    parser.add_argument(
+        "--chunk-size", type=int, default=16, help="The number of episodes of a task."
+    )
+    args = parser.parse_args()
+
+    spec_path = pathlib.Path(args.spec)
+    if spec_path.suffix == ".json":
+        spec = RewardSpec.from_json(spec_path)
+    else:
+        spec = RewardSpec.from_yaml(spec_path)
+
+    out = reshape(
+        args.store,
+        args.out,
+        spec=spec,
+        rewards=args.rewards,
+        reward_kwargs=args.reward_kwargs,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+    )
+    print(f"Computed {', '.join(args.rewards)} for {len(out)} episodes in {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,17 +3,27 @@ Rank-Preserving Reward from:
 "Receding Horizon Planning with Rule Hierarchies for Autonomous Vehicles" by Veer et al., (ICRA, 2023)
 https://ieeexplore.ieee.org/document/10160622
 """
-import warnings
+from typing import List, Mapping
 
 import gymnasium
 import numpy as np
 
-from auto_shaping.spec.reward_spec import RewardSpec
-from auto_shaping.utils import monitor_stl_episode
+from auto_shaping.spec.reward_spec import (
+    PredicateSpec,
+    RequirementSpec,
+    RewardSpec,
+    build_reward_spec,
+)
 from auto_shaping.utils.collection_wrapper import CollectionWrapper
+from auto_shaping.utils.profiling import StepProfiler
+from auto_shaping.utils.robustness import (
+    monitor_requirements,
+    monitor_predicate,
+    split_requirements,
+)
 
 from auto_shaping import Variable, Constant
-from auto_shaping.utils.utils import extend_state
+from auto_shaping.utils.utils import StateExtractor
 
 
 def sigmoid(x):
@@ -23,55 +33,153 @@ def step(x):
     return 1.0 if x > 0 else 0.0
 
 
+def rpr_reward(
+    safety_specs: List[RequirementSpec],
+    target_specs: List[RequirementSpec],
+    comfort_specs: List[PredicateSpec],
+    variables: List[str],
+    episode: Mapping,
+    max_length: int = None,
+    base_coeff: float = 2.01,
+    engine: str = "native",
+    profiler: StepProfiler = None,
+) -> float:
+    """
+    Rank-preserving reward of a complete episode.
+
+    :param safety_specs: the safety requirements
+    :param target_specs: the target requirements
+    :param comfort_specs: the predicates of the comfort requirements
+    :param variables: the variables collected in the episode
+    :param episode: the collected episode, as a mapping of variable traces with "time"
+    :param max_length: the maximum length of an episode, steps missing to it count as comfort violations
+    :param base_coeff: the base of the exponential coefficients of the ranks
+    :param engine: "native" or "rtamt"
+    :param profiler: the profiler recording the time to monitor the requirements, if any
+    """
+    profiler = profiler or StepProfiler(name="RPR")
+    rhos = []
+    for name, req_specs in [("safety", safety_specs), ("target", target_specs)]:
+        if len(req_specs) == 0:  # skip if no safety/target specs
+            continue
+        t0 = profiler.start()
+        rho = monitor_requirements(
+            req_specs,
+            variables,
+            episode,
+            engine=engine,
+        )
+        profiler.stop(f"monitor/{name}", t0)
+        rhos.append(rho)
+
+    comfort_rhos = []
+    for pred_spec in comfort_specs:
+        t0 = profiler.start()
+        robustness_trace = monitor_predicate(
+            pred_spec,
+            variables,
+            episode,
+            engine=engine,
+        )
+        profiler.stop(f"monitor/encourage {pred_spec.to_rtamt()}", t0)
+        # steps missing to max length count as violations
+        max_len_episode = max_length or len(episode["time"])
+        n_steps = max(max_len_episode, len(robustness_trace))
+        rho = np.sum(robustness_trace >= 0) / n_steps  # this is in 0..1
+
+        # we need to scale rho to be in -1..1
+        rho = 2 * rho - 1
+
+        comfort_rhos.append(rho)
+
+    if len(comfort_rhos) > 0:
+        comfort_rho = float(np.mean(comfort_rhos))
+        rhos.append(comfort_rho)
+
+    # here, we should have 3 rhos for safety, target, comfort respectively
+    # we compute rank-preserving reward as in Eq. 6 of the paper
+    a = base_coeff
+    n = len(rhos)
+    exp_coeff = [
+        a ** (n - i) for i in range(0, n) if rhos[i] is not None
+    ]
+    norm_rhos = [step(r) for r in rhos if r is not None]            # step used for sat/unsat
+    avg_rhos = [1/n * sigmoid(r) for r in rhos if r is not None]    # sigmoid used to norm in -1..1
+    return np.dot(exp_coeff, norm_rhos) + np.sum(avg_rhos)
+
+
+def rpr_reward_batch(
+    safety_rhos: np.ndarray,
+    target_rhos: np.ndarray,
+    comfort_rates: np.ndarray,
+    base_coeff: float = 2.01,
+) -> np.ndarray:
+    """
+    Rank-preserving reward of a batch of complete episodes, as `rpr_reward` for each episode.
+
+    :param safety_rhos: the robustness of each safety requirement, with shape (n_episodes, n_safety)
+    :param target_rhos: the robustness of each target requirement, with shape (n_episodes, n_target)
+    :param comfort_rates: the fraction of steps satisfying each comfort predicate, with shape (n_episodes, n_comfort)
+    :param base_coeff: the base of the exponential coefficients of the ranks
+    """
+    rhos = []
+    for req_rhos in [safety_rhos, target_rhos]:
+        if req_rhos.shape[1] > 0:  # skip if no safety/target specs
+            rhos.append(np.min(req_rhos, axis=1))
+    if comfort_rates.shape[1] > 0:
+        rhos.append(np.mean(2 * comfort_rates - 1, axis=1))
+
+    # Eq. 6 of the paper, over the ranks of the episodes at once
+    a = base_coeff
+    n = len(rhos)
+    reward = np.zeros(len(safety_rhos), dtype=np.float64)
+    for i, rho in enumerate(rhos):
+        reward += a ** (n - i) * (rho > 0)
+    for rho in rhos:
+        reward += 1 / n * sigmoid(rho)
+    return reward
+
+
 class RPRWrapper(CollectionWrapper):
     def __init__(
         self,
         env: gymnasium.Env,
-        specs: list[str],
-        variables: list[Variable],
+        specs: list[str] = None,
+        variables: list[Variable] = None,
         constants: list[Constant] = None,
         params: dict = None,
+        engine: str = "native",
+        spec: RewardSpec = None,
     ):
+        gymnasium.utils.RecordConstructorArgs.__init__(
+            self,
+            specs=specs,
+            variables=variables,
+            constants=constants,
+            spec=spec,
+            params=params,
+            engine=engine,
+        )
+        assert engine in ["native", "rtamt"], f"Unknown engine {engine}"
+        self._engine = engine
+
         self._params = {
             "base_coeff": 2.01,
             "max_length": None,
         }
         self._params.update(params or {})
 
-        self._spec = RewardSpec(
-            specs=specs,
-            variables=variables,
-            constants=constants,
-        )
+        self._spec = build_reward_spec(specs, variables, constants, spec)
 
-        self._stl_safety_specs = []
-        self._stl_target_specs = []
-        self._stl_comfort_specs = []
-        for req_spec in self._spec.specs:
-            try:
-                if req_spec._operator == "ensure":
-                    stl_req = req_spec.to_rtamt()
-                    self._stl_safety_specs.append(stl_req)
-                elif req_spec._operator in ["achieve", "conquer"]:
-                    stl_req = req_spec.to_rtamt()
-                    self._stl_target_specs.append(stl_req)
-                elif req_spec._operator == "encourage":
-                    # encourage is a special case, in which PAM uses average semantics
-                    stl_req = req_spec._predicate.to_rtamt()
-                    self._stl_comfort_specs.append(stl_req)
-                else:
-                    raise NotImplementedError()
-            except Exception as e:
-                warnings.warn(
-                    f"Failed to parse requirement: {req_spec}, make sure it is a valid STL formula"
-                )
-
-        self._variables = [var for var in self._spec.variables] + [
-            var for var in self._spec.constants
-        ]
-        extractor_fn = lambda state, action: extend_state(
-            env=env, state=state, action=action, spec=self._spec
-        )
+        (
+            self._safety_specs,
+            self._target_specs,
+            self._comfort_specs,
+        ) = split_requirements(self._spec)
+
+        # constants are resolved in the requirements, only used variables are collected
+        self._variables = list(self._spec.used_variables)
+        extractor_fn = StateExtractor(env=env, spec=self._spec)
         super(RPRWrapper, self).__init__(
             env,
             extractor_fn=extractor_fn,
@@ -82,59 +190,22 @@ class RPRWrapper(CollectionWrapper):
         reward = 0.0
 
         if done:
-            joint_safety_spec = " and ".join(
-                [f"({spec})" for spec in self._stl_safety_specs]
+            reward = rpr_reward(
+                self._safety_specs,
+                self._target_specs,
+                self._comfort_specs,
+                self._variables,
+                self._episode,
+                max_length=self._params["max_length"],
+                base_coeff=self._params["base_coeff"],
+                engine=self._engine,
+                profiler=self.profiler,
             )
-            joint_target_spec = " and ".join(self._stl_target_specs)
-
-            rhos = []
-            for stl_spec in [joint_safety_spec, joint_target_spec]:
-                if stl_spec == "":  # skip if no safety/target specs
-                    continue
-                robustness_trace = monitor_stl_episode(
-                    stl_spec,
-                    self._variables,
-                    self._episode,
-                )
-                rho = robustness_trace[0][1]
-                rhos.append(rho)
-
-            comfort_rhos = []
-            for stl_spec in self._stl_comfort_specs:
-                robustness_trace = monitor_stl_episode(
-                    stl_spec,
-                    self._variables,
-                    self._episode,
-                )
-                max_len_episode = self._params["max_length"] or len(self._episode["time"])
-                robustness_trace = robustness_trace + [
-                    [-1, -1] for _ in range((max_len_episode - len(robustness_trace)))
-                ]
-                rho = np.mean([float(rob >= 0) for t, rob in robustness_trace]) # this is in 0..1
-
-                # we need to scale rho to be in -1..1
-                rho = 2 * rho - 1
-
-                comfort_rhos.append(rho)
-
-            if len(comfort_rhos) > 0:
-                comfort_rho = float(np.mean(comfort_rhos))
-                rhos.append(comfort_rho)
-
-            # here, we should have 3 rhos for safety, target, comfort respectively
-            # we compute rank-preserving reward as in Eq. 6 of the paper
-            a = self._params["base_coeff"]
-            n = len(rhos)
-            exp_coeff = [
-                a ** (n - i) for i in range(0, n) if rhos[i] is not None
-            ]
-            norm_rhos = [step(r) for r in rhos if r is not None]            # step used for sat/unsat
-            avg_rhos = [1/n * sigmoid(r) for r in rhos if r is not None]    # sigmoid used to norm in -1..1
-            reward = np.dot(exp_coeff, norm_rhos) + np.sum(avg_rhos)
 
         return reward
 
     def step(self, action):
         obs, _, done, truncated, info = super().step(action)
         reward = self._reward(obs, done, info)
+        self.profiler.step(info)
         return obs, reward, done, truncated, info
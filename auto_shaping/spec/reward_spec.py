@@ -1,18 +1,71 @@
 from __future__ import annotations
+import functools
+import hashlib
+import json
 import logging
+import os
 import pathlib
+import symtable
+import tempfile
+import threading
+import types
 from collections import namedtuple
-from typing import List, Union, Any
+from typing import TYPE_CHECKING, List, Union, Any
 
-from lark import Lark
+import numpy as np
 
-from auto_shaping.parser.transformer import RewardShapingTransformer
+if TYPE_CHECKING:
+    # lark is imported only to parse requirements, not to load compiled specs
+    from lark import Lark
+    from auto_shaping.parser.transformer import RewardShapingTransformer
 
 Variable = namedtuple(
     "Variable", ["name", "fn", "min", "max", "description"], defaults=[None] * 5
 )
 Constant = namedtuple("Constant", ["name", "value", "description"], defaults=[None] * 3)
 
+# requirements compiled into flat arrays, one entry per requirement, see `RewardSpec.requirement_arrays`
+RequirementArrays = namedtuple(
+    "RequirementArrays",
+    [
+        "var_index",  # index of the variable in `RewardSpec.used_variables`
+        "abs_rows",  # indices of the requirements applying abs to the variable
+        "exp_rows",  # indices of the requirements applying exp to the variable
+        "threshold",  # threshold of the comparison
+        "sign",  # +1 for upper bounds (<, <=, ==), -1 for lower bounds (>, >=, !=)
+        "offset",  # satisfied if sign * (value - threshold) is below offset
+        "strict",  # strict or non-strict comparison with offset
+        "lower",  # True for lower bounds (>, >=), scored in [min, threshold]
+        "score_min",  # lower extreme of the normalization domain
+        "score_max",  # upper extreme of the normalization domain
+    ],
+)
+
+# per-requirement robustness and aggregated rewards of a batch of episodes, see `RewardSpec.evaluate_batch`
+BatchEvaluation = namedtuple(
+    "BatchEvaluation",
+    [
+        "robustness",  # robustness of each requirement, (n_episodes, n_requirements), nan for encourage
+        "comfort",  # fraction of steps satisfying each encourage requirement, (n_episodes, n_comfort)
+        "pam",  # policy-assessment metric, (n_episodes,)
+        "rpr",  # rank-preserving reward, (n_episodes,)
+    ],
+)
+
+# identifier and version of the compiled format, see `RewardSpec.to_compiled`
+COMPILED_FORMAT = "auto_shaping.RewardSpec"
+COMPILED_VERSION = 1
+
+# comparison operator -> (sign, offset, strict), consistent with the comparisons of the wrappers
+_cmp_codes = {
+    "<": (1.0, 0.0, True),
+    "<=": (1.0, 0.0, False),
+    "==": (1.0, 1e-6, True),
+    ">": (-1.0, 0.0, True),
+    ">=": (-1.0, 0.0, False),
+    "!=": (-1.0, -1e-6, True),
+}
+
 
 def check_var(name, min, max, fn=None, description=None):
     assert isinstance(name, str), f"Variable name must be a string, got {type(name)}"
@@ -41,6 +94,24 @@ def check_const(name, value, description=None):
     ), f"Constant description must be a string or None, got {type(description)}"
 
 
+def expression_names(expression: str) -> set[str]:
+    """
+    Return the free names read by an expression, e.g. the variables, constants, `state` or `env`.
+    Attribute names (as `x` in `env.unwrapped.x`) are not included, nor the names bound
+    in comprehensions or lambdas, only within their own scope.
+    """
+    names = set()
+    tables = [symtable.symtable(expression, "<expression>", "eval")]
+    while len(tables) > 0:
+        table = tables.pop()
+        # the names not bound in the expression nor in an enclosing scope of it
+        for symbol in table.get_symbols():
+            if symbol.is_referenced() and symbol.is_global():
+                names.add(symbol.get_name())
+        tables.extend(table.get_children())
+    return names
+
+
 class PredicateSpec:
     def __init__(self, variable: tuple[Any, str], operator: str, value: float):
         self._variable = variable
@@ -72,25 +143,77 @@ class PredicateSpec:
 
 
 class RequirementSpec:
+    """
+    A requirement parsed from its string, with the constants resolved by the given transformer.
+
+    :param spec: the requirement, e.g. 'ensure abs "x" <= "x_limit"'
+    :param transformer: the transformer holding the constants of the reward specification
+    """
+
     grammar_path = pathlib.Path(__file__).parent.parent / "parser" / "grammar.txt"
-    transformer = RewardShapingTransformer()
     parser = None
 
-    def __init__(self, spec: str):
-        if self.parser is None:
-            with open(self.grammar_path, "r") as f:
+    def __init__(self, spec: str, transformer: RewardShapingTransformer = None):
+        from lark.exceptions import VisitError
+        from auto_shaping.parser.transformer import RewardShapingTransformer
+
+        transformer = transformer or RewardShapingTransformer()
+        try:
+            tree = transformer.transform(self.get_parser().parse(spec))
+        except VisitError as e:
+            raise e.orig_exc from None
+        self._spec = spec
+        # plain strings rather than lark tokens, the requirement does not depend on lark once parsed
+        self._operator = str(tree.data)
+        (fn, var), operator, value = tree.children[0]
+        variable = (str(fn) if fn is not None else None, str(var))
+        self._predicate = PredicateSpec(variable, str(operator), value)
+
+    @classmethod
+    def from_tuple(
+        cls,
+        spec: str,
+        operator: str,
+        predicate: tuple[tuple[str | None, str], str, float],
+    ) -> "RequirementSpec":
+        """
+        Build an already parsed requirement, without the parser.
+
+        :param spec: the requirement as string
+        :param operator: the temporal operator, e.g. "ensure"
+        :param predicate: the predicate as ((fn, variable), comparison, threshold), see `PredicateSpec.to_tuple`
+        """
+        (fn, var), cmp_op, value = predicate
+        req = cls.__new__(cls)
+        req._spec = spec
+        req._operator = operator
+        req._predicate = PredicateSpec((fn, var), cmp_op, float(value))
+        return req
+
+    @classmethod
+    def get_parser(cls) -> Lark:
+        """
+        Return the LALR parser of requirements, built once per process and shared by all requirements.
+        The grammar analysis is cached on disk by lark, so that new processes load the parse table
+        instead of analyzing the grammar again.
+
+        The parser holds no state: the constants are resolved by the transformer of each reward specification.
+        """
+        if cls.parser is None:
+            from lark import Lark
+
+            with open(cls.grammar_path, "r") as f:
                 grammar = f.read()
-                self.parser = Lark(
-                    grammar, start="start", parser="lalr", transformer=self.transformer
+                cls.parser = Lark(
+                    grammar,
+                    start="start",
+                    parser="lalr",
+                    cache=True,
                 )
 
-            logging.debug(f"Loaded grammar from {self.grammar_path}")
+            logging.debug(f"Loaded grammar from {cls.grammar_path}")
 
-        tree = self.parser.parse(spec)
-        self._spec = spec
-        self._operator = tree.data
-        variable, operator, value = tree.children[0]
-        self._predicate = PredicateSpec(variable, operator, value)
+        return cls.parser
 
     def __str__(self):
         return self._spec
@@ -109,16 +232,72 @@ class RequirementSpec:
             raise NotImplementedError("Encourage not implemented")
 
 
+def build_reward_spec(
+    specs: List[str] = None,
+    variables: List[Variable] = None,
+    constants: List[Constant] = None,
+    spec: RewardSpec = None,
+) -> RewardSpec:
+    """
+    Return the reward specification of a wrapper, given either its definition or a `RewardSpec`.
+
+    A given `RewardSpec` is shared as is, since the wrappers keep their state in a separate context.
+    Specifications built from the same definition are also shared, so that wrapping many environments
+    parses and compiles the requirements only once.
+    """
+    if spec is not None:
+        assert (
+            specs is None and variables is None and constants is None
+        ), "Either spec or specs, variables and constants must be provided"
+        return spec
+
+    return _shared_reward_spec(
+        tuple(specs),
+        tuple(variables),
+        tuple(constants) if constants is not None else None,
+    )
+
+
+@functools.lru_cache(maxsize=64)
+def _shared_reward_spec(
+    specs: tuple, variables: tuple, constants: tuple = None
+) -> RewardSpec:
+    return RewardSpec(
+        specs=list(specs),
+        variables=list(variables),
+        constants=list(constants) if constants is not None else None,
+    )
+
+
 class RewardSpec:
+    """
+    Reward specification, with the requirements parsed and the expressions of variables and constants compiled.
+
+    A specification is not modified after construction, so one instance can be shared by many wrappers
+    and threads. The constants depending on the environment are resolved by each wrapper in its own
+    context (see `auto_shaping.utils.utils.SpecContext`).
+
+    :param specs: the requirements, as strings or already parsed `RequirementSpec`
+    :param variables: the variables of the requirements
+    :param constants: the constants of the requirements and variables
+    """
+
     def __init__(
         self,
-        specs: List[str],
+        specs: List[Union[str, RequirementSpec]],
         variables: List[Variable],
         constants: List[Constant] = None,
     ):
         assert len(specs) > 0, "At least one specification must be provided"
         assert len(variables) > 0, "At least one variable must be provided"
 
+        # specs with the same content have the same extended states
+        self._key = (
+            tuple([str(sp) for sp in specs]),
+            tuple(variables),
+            tuple(constants) if constants is not None else (),
+        )
+
         self._variables = {}
         for var in variables:
             assert isinstance(
@@ -128,7 +307,12 @@ class RewardSpec:
 
             self._variables[var.name] = var
 
+        # constants are resolved once here, except the ones depending on the environment
+        # which are resolved at the beginning of each episode
+        assignments = {}
         self._constants = {}
+        self._constant_values = {}
+        self._env_constant_codes = {}
         if constants is not None:
             for const in constants:
                 assert isinstance(
@@ -137,15 +321,186 @@ class RewardSpec:
                 check_const(const.name, const.value, const.description)
 
                 self._constants[const.name] = const
-                RequirementSpec.transformer.add_constant(
-                    name=const.name, value=const.value
+
+                value = const.value
+                if isinstance(value, str):
+                    code = compile(value, f"<constant {const.name}>", "eval")
+                    names = expression_names(value)
+                    if "env" in names or any(
+                        [n in self._env_constant_codes for n in names]
+                    ):
+                        self._env_constant_codes[const.name] = code
+                    else:
+                        value = float(eval(code, {"np": np, **self._constant_values}))
+
+                if const.name not in self._env_constant_codes:
+                    self._constant_values[const.name] = value
+                assignments[const.name] = value
+
+        # important to do this after constants are set, the parser is needed only for strings
+        transformer = None
+        if any([not isinstance(sp, RequirementSpec) for sp in specs]):
+            from auto_shaping.parser.transformer import RewardShapingTransformer
+
+            transformer = RewardShapingTransformer(assignments)
+        self._specs = tuple(
+            [
+                (
+                    sp
+                    if isinstance(sp, RequirementSpec)
+                    else RequirementSpec(sp, transformer=transformer)
                 )
+                for sp in specs
+            ]
+        )
+
+        # compile expressions once, to be evaluated in the namespace of each wrapper
+        self._variable_codes = {
+            name: compile(var.fn, f"<variable {name}>", "eval")
+            for name, var in self._variables.items()
+        }
+        self._variable_names = {
+            name: expression_names(var.fn) for name, var in self._variables.items()
+        }
+
+        # only the variables used in the requirements, directly or through derived variables
+        self._used_variables = self._sort_variables()
+        self._requirement_arrays = {}
+        self._lock = threading.Lock()
+
+        # layout of the extended states: the constants, then the used variables
+        layout_names = list(self._constants) + self._used_variables
+        self._state_layout = types.MappingProxyType(
+            {name: i for i, name in enumerate(layout_names)}
+        )
+        self._constant_array = np.array(
+            [self._constant_values.get(name, np.nan) for name in self._constants],
+            dtype=np.float64,
+        )
+        self._constant_array.setflags(write=False)
+
+    def _sort_variables(self) -> list[str]:
+        """
+        Return the variables reachable from the requirements, in topological order
+        of their dependencies and otherwise in the order of declaration.
+        """
+        deps = {}
+        for name, names in self._variable_names.items():
+            deps[name] = [v for v in self._variables if v in names]
+
+        # variables reachable from the requirements
+        reachable = set()
+        frontier = [req._predicate.to_tuple()[0][1] for req in self._specs]
+        while len(frontier) > 0:
+            name = frontier.pop()
+            if name in self._variables and name not in reachable:
+                reachable.add(name)
+                frontier.extend(deps[name])
+
+        order = []
+        visited = {}
+
+        def visit(name, path):
+            if visited.get(name) == "done":
+                return
+            if visited.get(name) == "visiting":
+                cycle = " -> ".join(path + [name])
+                raise ValueError(f"Circular dependency among variables: {cycle}")
+
+            visited[name] = "visiting"
+            for dep in deps[name]:
+                visit(dep, path + [name])
+            visited[name] = "done"
+            order.append(name)
+
+        for name in self._variables:
+            if name in reachable:
+                visit(name, [])
+
+        return order
+
+    def __getstate__(self) -> dict:
+        # pickled in the compiled format, loaded without parsing
+        return self.to_compiled()
+
+    def __setstate__(self, state: dict):
+        self.__init__(**self._compiled_args(state))
+
+    def to_compiled(self) -> dict:
+        """
+        Export the specification in a versioned format of plain data, serializable to json,
+        which is loaded by `from_compiled` without parsing the requirements.
+
+        The requirements are stored as tuples with their thresholds already resolved,
+        the variables and constants as defined with their expressions.
+        """
+        return {
+            "format": COMPILED_FORMAT,
+            "version": COMPILED_VERSION,
+            "requirements": [
+                {
+                    "spec": req._spec,
+                    "operator": req._operator,
+                    "fn": req._predicate.to_tuple()[0][0],
+                    "variable": req._predicate.to_tuple()[0][1],
+                    "comparison": req._predicate.to_tuple()[1],
+                    "threshold": req._predicate.to_tuple()[2],
+                }
+                for req in self._specs
+            ],
+            "variables": [dict(var._asdict()) for var in self._variables.values()],
+            "constants": [dict(const._asdict()) for const in self._constants.values()],
+        }
 
-        # important to do this after constants are set
-        self._specs = [RequirementSpec(sp) for sp in specs]
+    @staticmethod
+    def _compiled_args(compiled: dict) -> dict:
+        if compiled.get("format") != COMPILED_FORMAT:
+            raise ValueError(f"Unknown format {compiled.get('format')}")
+        if compiled.get("version") != COMPILED_VERSION:
+            raise ValueError(
+                f"Unsupported version {compiled.get('version')} of compiled spec, expected {COMPILED_VERSION}"
+            )
+
+        specs = [
+            RequirementSpec.from_tuple(
+                spec=req["spec"],
+                operator=req["operator"],
+                predicate=(
+                    (req["fn"], req["variable"]),
+                    req["comparison"],
+                    req["threshold"],
+                ),
+            )
+            for req in compiled["requirements"]
+        ]
+        variables = [Variable(**var) for var in compiled["variables"]]
+        constants = [Constant(**const) for const in compiled["constants"]]
+        return dict(specs=specs, variables=variables, constants=constants or None)
+
+    @staticmethod
+    def from_compiled(compiled: dict) -> "RewardSpec":
+        """
+        Load a specification exported by `to_compiled`, without the requirements parser.
+        """
+        return RewardSpec(**RewardSpec._compiled_args(compiled))
+
+    def to_json(self, file: pathlib.Path):
+        with open(file, "w") as f:
+            json.dump(self.to_compiled(), f, indent=2)
+
+    @staticmethod
+    def from_json(file: pathlib.Path) -> "RewardSpec":
+        with open(file, "r") as f:
+            return RewardSpec.from_compiled(json.load(f))
+
+    def copy(self) -> "RewardSpec":
+        """
+        Return a new specification with the same definition, without parsing the requirements again.
+        """
+        return RewardSpec.from_compiled(self.to_compiled())
 
     @property
-    def specs(self) -> List[RequirementSpec]:
+    def specs(self) -> tuple[RequirementSpec, ...]:
         return self._specs
 
     @property
@@ -156,12 +511,196 @@ class RewardSpec:
     def constants(self) -> dict[str, Constant]:
         return self._constants
 
+    @property
+    def used_variables(self) -> list[str]:
+        """
+        The names of the variables needed to evaluate the requirements, in evaluation order.
+        """
+        return self._used_variables
+
+    @property
+    def state_layout(self) -> types.MappingProxyType:
+        """
+        Read-only map from the names of the constants and used variables to their index
+        in the array of an extended state.
+        """
+        return self._state_layout
+
+    def requirement_arrays(self, operators: List[str]) -> RequirementArrays:
+        """
+        Compile the requirements with the given temporal operators into flat arrays,
+        to score a state against all of them at once (see `auto_shaping.utils.kernels`).
+
+        :param operators: the temporal operators of the requirements, e.g. ["ensure"]
+        """
+        key = tuple(operators)
+        arrays = self._requirement_arrays.get(key)
+        if arrays is not None:
+            return arrays
+
+        with self._lock:
+            if key not in self._requirement_arrays:
+                self._requirement_arrays[key] = self._compile_requirements(operators)
+            return self._requirement_arrays[key]
+
+    def _compile_requirements(self, operators: List[str]) -> RequirementArrays:
+        reqs = [req for req in self._specs if req._operator in operators]
+        n_reqs = len(reqs)
+
+        var_index = np.zeros(n_reqs, dtype=np.intp)
+        fn_names = []
+        threshold = np.zeros(n_reqs, dtype=np.float64)
+        sign = np.zeros(n_reqs, dtype=np.float64)
+        offset = np.zeros(n_reqs, dtype=np.float64)
+        strict = np.zeros(n_reqs, dtype=bool)
+        lower = np.zeros(n_reqs, dtype=bool)
+        score_min = np.zeros(n_reqs, dtype=np.float64)
+        score_max = np.zeros(n_reqs, dtype=np.float64)
+
+        for i, req in enumerate(reqs):
+            (fn, var), cmp_op, value = req._predicate.to_tuple()
+            if fn not in [None, "abs", "exp"]:
+                raise ValueError(f"Unknown processing function {fn}")
+            if cmp_op not in _cmp_codes:
+                raise ValueError(f"Unknown comparison operator {cmp_op}")
+
+            var_index[i] = self._used_variables.index(var)
+            fn_names.append(fn)
+            threshold[i] = value
+            sign[i], offset[i], strict[i] = _cmp_codes[cmp_op]
+            lower[i] = cmp_op in [">", ">="]
+            variable = self._variables[var]
+            score_min[i] = variable.min if lower[i] else value
+            score_max[i] = value if lower[i] else variable.max
+
+        arrays = RequirementArrays(
+            var_index=var_index,
+            abs_rows=np.array(
+                [i for i, fn in enumerate(fn_names) if fn == "abs"], dtype=np.intp
+            ),
+            exp_rows=np.array(
+                [i for i, fn in enumerate(fn_names) if fn == "exp"], dtype=np.intp
+            ),
+            threshold=threshold,
+            sign=sign,
+            offset=offset,
+            strict=strict,
+            lower=lower,
+            score_min=score_min,
+            score_max=score_max,
+        )
+        for array in arrays:
+            array.setflags(write=False)
+        return arrays
+
+    def evaluate_batch(
+        self,
+        traces: np.ndarray,
+        lengths: np.ndarray,
+        max_length: int = None,
+        base_coeff: float = 2.01,
+    ) -> BatchEvaluation:
+        """
+        Evaluate the requirements on a batch of complete episodes at once, with the semantics
+        of the native engine (the same as `monitor_stl_episode` on the supported fragment),
+        and aggregate them into the PAM and RPR rewards of each episode.
+
+        :param traces: the used variables of the padded episodes, with shape (n_episodes, max_steps, n_variables)
+                       and the variables in the order of `used_variables`
+        :param lengths: the lengths of the episodes, with shape (n_episodes,), the steps beyond them are ignored
+        :param max_length: the maximum length of an episode, steps missing to it count as comfort violations
+        :param base_coeff: the base of the exponential coefficients of the ranks in RPR
+        """
+        from auto_shaping.pam_shaping import pam_reward_batch
+        from auto_shaping.rpr_shaping import rpr_reward_batch
+        from auto_shaping.utils.robustness import (
+            batch_predicate_robustness,
+            batch_temporal_robustness,
+            valid_steps,
+        )
+
+        traces = np.asarray(traces, dtype=np.float64)
+        lengths = np.asarray(lengths, dtype=np.int64)
+        if traces.ndim != 3 or traces.shape[2] != len(self._used_variables):
+            raise ValueError(
+                f"Expected traces with shape (n_episodes, max_steps, {len(self._used_variables)}), "
+                f"got {traces.shape}"
+            )
+        if lengths.shape != traces.shape[:1]:
+            raise ValueError(f"Expected lengths with shape {traces.shape[:1]}")
+        if np.any(lengths < 1) or np.any(lengths > traces.shape[1]):
+            raise ValueError(f"Lengths must be in [1, {traces.shape[1]}]")
+
+        valid = valid_steps(lengths, traces.shape[1])
+        n_steps = np.maximum(max_length or 0, lengths)
+
+        # one requirement at a time, vectorized over episodes and steps
+        robustness = np.full((len(traces), len(self._specs)), np.nan)
+        comfort = []
+        for i, req in enumerate(self._specs):
+            rho = batch_predicate_robustness(
+                req._predicate, self._used_variables, traces
+            )
+            if req._operator == "encourage":
+                comfort.append(np.sum((rho >= 0) & valid, axis=1) / n_steps)
+            else:
+                robustness[:, i] = batch_temporal_robustness(req._operator, rho, valid)
+        comfort = np.stack(comfort, axis=1) if comfort else np.zeros((len(traces), 0))
+
+        operators = [req._operator for req in self._specs]
+        safety_rhos = robustness[:, [op == "ensure" for op in operators]]
+        target_rhos = robustness[:, [op in ["achieve", "conquer"] for op in operators]]
+        return BatchEvaluation(
+            robustness=robustness,
+            comfort=comfort,
+            pam=pam_reward_batch(safety_rhos, target_rhos, comfort),
+            rpr=rpr_reward_batch(
+                safety_rhos, target_rhos, comfort, base_coeff=base_coeff
+            ),
+        )
+
     @staticmethod
-    def from_yaml(file: pathlib.Path) -> "RewardSpec":
+    def from_yaml(file: pathlib.Path, cache: bool = True) -> "RewardSpec":
+        """
+        Load a specification from a yaml file.
+
+        The compiled specification is cached on disk (see `spec_cache_dir`), keyed by the content
+        of the file and of the grammar, so that loading the same file again skips yaml and the parser.
+        Within a process, loading the same content returns the same shared instance.
+
+        :param file: the path to the yaml file
+        :param cache: whether to use the caches
+        """
+        with open(file, "rb") as f:
+            content = f.read()
+
+        if not cache:
+            return RewardSpec._from_yaml_content(content)
+
+        digest = _spec_digest(content)
+        with _loaded_specs_lock:
+            spec = _loaded_specs.get(digest)
+            if spec is not None:
+                return spec
+
+            cache_dir = spec_cache_dir()
+            cache_path = None if cache_dir is None else cache_dir / f"{digest}.json"
+            if cache_path is not None:
+                spec = _load_cached_spec(cache_path)
+
+            if spec is None:
+                spec = RewardSpec._from_yaml_content(content)
+                if cache_path is not None:
+                    _store_cached_spec(cache_path, spec)
+
+            _loaded_specs[digest] = spec
+            return spec
+
+    @staticmethod
+    def _from_yaml_content(content: bytes) -> "RewardSpec":
         import yaml
 
-        with open(file, "r") as f:
-            spec = yaml.safe_load(f)
+        spec = yaml.safe_load(content)
 
         specs = spec["specs"]
 
@@ -201,3 +740,66 @@ class RewardSpec:
                 constants.append(const)
 
         return RewardSpec(specs=specs, variables=variables, constants=constants)
+
+
+def spec_cache_dir() -> Union[pathlib.Path, None]:
+    """
+    Return the directory of the on-disk cache of compiled specifications, set by the environment
+    variable `AUTO_SHAPING_CACHE_DIR` (an empty value disables the cache),
+    by default in `$XDG_CACHE_HOME/auto_shaping` or `~/.cache/auto_shaping`.
+    """
+    cache_dir = os.environ.get("AUTO_SHAPING_CACHE_DIR")
+    if cache_dir is None:
+        cache_home = os.environ.get("XDG_CACHE_HOME") or pathlib.Path.home() / ".cache"
+        return pathlib.Path(cache_home) / "auto_shaping"
+    if cache_dir == "":
+        return None
+    return pathlib.Path(cache_dir)
+
+
+_grammar_digest = None
+
+# specifications loaded from yaml in this process, by digest of their content
+_loaded_specs = {}
+_loaded_specs_lock = threading.Lock()
+
+
+def _spec_digest(content: bytes) -> str:
+    # the key changes with the yaml content, the grammar and the compiled format
+    global _grammar_digest
+    if _grammar_digest is None:
+        with open(RequirementSpec.grammar_path, "rb") as f:
+            _grammar_digest = hashlib.sha256(f.read()).hexdigest()
+
+    key = hashlib.sha256()
+    key.update(f"{COMPILED_FORMAT}:{COMPILED_VERSION}:{_grammar_digest}:".encode())
+    key.update(content)
+    return key.hexdigest()
+
+
+def _load_cached_spec(path: pathlib.Path) -> Union[RewardSpec, None]:
+    try:
+        with open(path, "r") as f:
+            return RewardSpec.from_compiled(json.load(f))
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        # unreadable or stale entry, compiled again and overwritten
+        logging.debug(f"Ignored cached spec {path}: {e}")
+        return None
+
+
+def _store_cached_spec(path: pathlib.Path, spec: RewardSpec):
+    # written to a temporary file and renamed, so that concurrent readers never see a partial file
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(spec.to_compiled(), f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError as e:
+        logging.debug(f"Failed to cache spec in {path}: {e}")
@@ -1,10 +1,15 @@
-import warnings
-
 import gymnasium
 
 from auto_shaping.utils.collection_wrapper import CollectionWrapper
-from auto_shaping.spec.reward_spec import RewardSpec, Variable, Constant
-from auto_shaping.utils.utils import monitor_stl_episode, extend_state
+from auto_shaping.spec.reward_spec import (
+    RewardSpec,
+    Variable,
+    Constant,
+    build_reward_spec,
+)
+from auto_shaping.utils.online_monitor import OnlineRequirementsMonitor
+from auto_shaping.utils.robustness import monitor_requirements, stl_requirements
+from auto_shaping.utils.utils import StateExtractor
 
 
 class TLTLWrapper(CollectionWrapper):
@@ -12,58 +17,83 @@ class TLTLWrapper(CollectionWrapper):
     Robustness-based reward auto_shaping from:
     "Reinforcement Learning With Temporal Logic Rewards" by Li, Vasile, and Belta (2016)
     https://arxiv.org/abs/1612.03471
+
+    :param engine: "native" to use the numpy robustness engine, "rtamt" to always monitor with rtamt,
+                   "online" to update the robustness at every step without storing the episode
+    :param spec: the reward specification, alternative to specs, variables and constants
     """
 
     def __init__(
         self,
         env: gymnasium.Env,
-        specs: list[str],
-        variables: list[Variable],
+        specs: list[str] = None,
+        variables: list[Variable] = None,
         constants: list[Constant] = None,
+        engine: str = "native",
+        spec: RewardSpec = None,
     ):
-        self._spec = RewardSpec(
+        gymnasium.utils.RecordConstructorArgs.__init__(
+            self,
             specs=specs,
             variables=variables,
             constants=constants,
+            spec=spec,
+            engine=engine,
         )
+        assert engine in ["native", "rtamt", "online"], f"Unknown engine {engine}"
+        self._engine = engine
 
-        reqs = []
-        for req_spec in self._spec.specs:
-            try:
-                stl_req = req_spec.to_rtamt()
-                reqs.append(stl_req)
-            except Exception as e:
-                warnings.warn(
-                    f"Failed to parse requirement: {req_spec}, if comfort requirement no worries because it is not supported by STL"
-                )
-        self._stl_spec = " and ".join(reqs)
-        self._variables = [var for var in self._spec.variables] + [
-            var for var in self._spec.constants
-        ]
+        self._spec = build_reward_spec(specs, variables, constants, spec)
 
-        extractor_fn = lambda state, action: extend_state(
-            env=env, state=state, action=action, spec=self._spec
-        )
+        self._reqs = stl_requirements(self._spec)
+        # constants are resolved in the requirements, only used variables are collected
+        self._variables = list(self._spec.used_variables)
+
+        extractor_fn = StateExtractor(env=env, spec=self._spec)
+        # the online monitor only needs the most recent sample
+        window_len = 1 if self._engine == "online" else None
         super(TLTLWrapper, self).__init__(
             env,
             extractor_fn=extractor_fn,
             variables=self._variables,
+            window_len=window_len,
         )
 
+        self._monitor = None
+        if self._engine == "online":
+            self._monitor = OnlineRequirementsMonitor(self._reqs)
+
     def _reward(self, obs, done, info):
         reward = 0.0
 
         if done:
-            robustness_trace = monitor_stl_episode(
-                self._stl_spec,
-                self._variables,
-                self._episode,
-            )
-            reward = robustness_trace[0][1]
+            if self._monitor is not None:
+                reward = self._monitor.robustness
+            else:
+                t0 = self.profiler.start()
+                reward = monitor_requirements(
+                    self._reqs,
+                    self._variables,
+                    self._episode,
+                    engine=self._engine,
+                )
+                self.profiler.stop("monitor", t0)
 
         return reward
 
+    def reset(self, **kwargs):
+        obs, info = super().reset(**kwargs)
+        if self._monitor is not None:
+            self._monitor.reset()
+            self._monitor.update_last(self._episode)
+        return obs, info
+
     def step(self, action):
         obs, _, done, truncated, info = super().step(action)
+        if self._monitor is not None:
+            t0 = self.profiler.start()
+            self._monitor.update_last(self._episode)
+            self.profiler.stop("monitor", t0)
         reward = self._reward(obs, done, info)
+        self.profiler.step(info)
         return obs, reward, done, truncated, info
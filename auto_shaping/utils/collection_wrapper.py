@@ -1,9 +1,12 @@
-from collections import deque
 from typing import List, Callable
 
 import gymnasium
 import numpy as np
 
+from auto_shaping.utils.profiling import StepProfiler
+from auto_shaping.utils.trace_buffer import TraceBuffer
+from auto_shaping.utils.utils import ExtendedState, get_extraction_cache
+
 
 class CollectionWrapper(gymnasium.Wrapper, gymnasium.utils.RecordConstructorArgs):
     """
@@ -11,8 +14,15 @@ class CollectionWrapper(gymnasium.Wrapper, gymnasium.utils.RecordConstructorArgs
 
     :param env: the environment to wrap
     :param variables: the list of observable variables to collect from the state
-    :param extractor_fn: a function that extracts the variables from the state
+    :param extractor_fn: a function that extracts the variables from the state,
+                         if it has a `reset` method, this is called at the beginning of each episode
     :param window_len: the length k of the window to collect the variables, if None, the whole episode is collected
+
+    The episode is stored in a `TraceBuffer`, allocated at the first reset and reused in the next episodes.
+    If the extractor has a `cache` attribute, it is set to the extraction cache shared by the stacked wrappers.
+    The time spent to extract and collect the variables is recorded by `profiler`, if enabled
+    (see `auto_shaping.utils.profiling`). The collected samples, actions and done flags of every episode
+    are streamed to disk by `recorder`, if any (see `auto_shaping.utils.episode_recorder`).
     """
 
     def __init__(
@@ -38,39 +48,105 @@ class CollectionWrapper(gymnasium.Wrapper, gymnasium.utils.RecordConstructorArgs
         self._time = None
         self._episode = None
 
+        # one sample of all the collected variables, followed by time if not among them
+        self._names = list(variables) if self._flag_time else list(variables) + ["time"]
+        self._sample = np.zeros(len(self._names), dtype=np.float64)
+        self._layout = None
+        self._layout_indices = None
+
+        self.extraction_cache, self._owns_cache = get_extraction_cache(env)
+        if hasattr(extractor_fn, "cache"):
+            extractor_fn.cache = self.extraction_cache
+
+        self.profiler = StepProfiler(name=type(self).__name__)
+        self.recorder = None
+
     def reset(self, **kwargs):
         state, info = super().reset(**kwargs)
+        if self._owns_cache:
+            self.extraction_cache.clear()
 
-        self._episode = {var: deque(maxlen=self._window_len) for var in self._variables}
+        if self._episode is None:
+            self._episode = TraceBuffer(self._names, window_len=self._window_len)
+        self._episode.reset()
         if not self._flag_time:
-            self._episode["time"] = deque(maxlen=self._window_len)
             self._time = 0.0
 
         # collect observable variables from the state
+        if hasattr(self._extractor_fn, "reset"):
+            self._extractor_fn.reset()
         action0 = np.zeros_like(self.action_space.sample())
         obs = self._extractor_fn(state, action0) if self._extractor_fn else state
-        for key in self._variables:
-            self._episode[key].append(obs[key])
+        self._collect(obs)
 
-        if not self._flag_time:
-            self._time += 1.0
-            self._episode["time"].append(self._time)
+        if self.recorder is not None:
+            self.recorder.end_episode()
+            self.recorder.append(self._sample, action0)
 
         return state, info
 
+    def _collect(self, obs):
+        n_vars = len(self._variables)
+        if isinstance(obs, ExtendedState) and self._gather_indices(obs) is not None:
+            np.take(obs.array, self._layout_indices, out=self._sample[:n_vars])
+        else:
+            for i, key in enumerate(self._variables):
+                self._sample[i] = obs[key]
+
+        if not self._flag_time:
+            self._time += 1.0
+            self._sample[-1] = self._time
+
+        self._episode.append(self._sample)
+
+    def __getstate__(self) -> dict:
+        # the layout is a read-only view, the indices are computed again after loading
+        state = dict(self.__dict__)
+        state["_layout"] = None
+        state["_layout_indices"] = None
+        state["recorder"] = None
+        return state
+
+    def _gather_indices(self, obs: ExtendedState) -> np.ndarray:
+        # indices of the variables in the array of the extended state, computed once per layout
+        if obs.layout is not self._layout:
+            self._layout = obs.layout
+            self._layout_indices = None
+            if all([key in obs.layout for key in self._variables]):
+                self._layout_indices = np.array(
+                    [obs.layout[key] for key in self._variables], dtype=np.intp
+                )
+        return self._layout_indices
+
     def step(self, action):
         if self._episode is None:
             raise RuntimeError("reset() must be called before step()")
 
         state, reward, done, truncated, info = super().step(action)
+        if self._owns_cache:
+            self.extraction_cache.clear()
 
         # collect observable variables from the state
+        t0 = self.profiler.start()
         obs = self._extractor_fn(state, action) if self._extractor_fn else state
-        for key in self._variables:
-            self._episode[key].append(obs[key])
+        self.profiler.stop("extract", t0)
 
-        if not self._flag_time:
-            self._time += 1.0
-            self._episode["time"].append(self._time)
+        t0 = self.profiler.start()
+        self._collect(obs)
+        self.profiler.stop("collect", t0)
+
+        if self.recorder is not None:
+            self.recorder.append(self._sample, action, done, truncated)
+            if done or truncated:
+                self.recorder.end_episode()
 
         return state, reward, done, truncated, info
+
+    def _recorded_names(self) -> List[str]:
+        # one sample of the collected variables and time
+        return list(self._names)
+
+    def close(self):
+        if self.recorder is not None:
+            self.recorder.close()
+        super().close()
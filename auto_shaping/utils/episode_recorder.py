@@ -0,0 +1,263 @@
+"""
+Append-only columnar store of episode traces, in memory-mapped `.npy` segments.
+
+Layout of a store directory:
+    meta.json           the names of the columns and the dtype
+    segment-00000.npy   array with shape (n_columns, capacity), one contiguous row per column
+    episodes.bin        the index of the completed episodes, as int64 triples (segment, start, length)
+
+The columns are the recorded values, then the components of the action, then the flags
+"terminated" and "truncated". An episode is never split across segments, so that it is read
+as views of one memory-mapped segment, without copies.
+"""
+
+import json
+import os
+import pathlib
+from collections.abc import Sequence
+from typing import List, Union
+
+import numpy as np
+
+_META_FILE = "meta.json"
+_INDEX_FILE = "episodes.bin"
+
+
+def _segment_file(segment: int) -> str:
+    return f"segment-{segment:05d}.npy"
+
+
+class EpisodeRecorder:
+    """
+    Streams the steps of the episodes to a columnar store on disk (see module docstring).
+
+    The steps are buffered in memory and written in bulk to a preallocated memory-mapped segment,
+    at the end of each episode and every `flush_every` steps, when the segment is also flushed to disk.
+    The episodes are visible to readers once completed, appending to an existing store.
+
+    :param path: the directory of the store
+    :param names: the names of the recorded values
+    :param action_size: the number of components of the flattened action
+    :param segment_len: the number of steps of a segment
+    :param flush_every: the number of steps between two flushes to disk
+    :param dtype: the dtype of the store
+    """
+
+    def __init__(
+        self,
+        path: Union[str, pathlib.Path],
+        names: List[str],
+        action_size: int,
+        segment_len: int = 65536,
+        flush_every: int = 4096,
+        dtype: np.dtype = np.float64,
+    ):
+        assert segment_len > 0, "segment_len must be positive"
+        assert flush_every > 0, "flush_every must be positive"
+
+        self._path = pathlib.Path(path)
+        self._path.mkdir(parents=True, exist_ok=True)
+        self._names = list(names)
+        self._action_size = action_size
+        self._segment_len = segment_len
+        self._dtype = np.dtype(dtype)
+
+        columns = self._names + [f"action_{i}" for i in range(action_size)]
+        columns += ["terminated", "truncated"]
+        meta = {"columns": columns, "dtype": self._dtype.str}
+        meta_path = self._path / _META_FILE
+        if meta_path.exists():
+            with open(meta_path, "r") as f:
+                existing = json.load(f)
+            if existing != meta:
+                raise ValueError(f"Store {self._path} has different columns or dtype")
+        else:
+            with open(meta_path, "w") as f:
+                json.dump(meta, f)
+        self._n_columns = len(columns)
+
+        # the most recent steps, written to the segment in bulk
+        self._buffer = np.zeros((flush_every, self._n_columns), dtype=self._dtype)
+        self._buffered = 0
+        self._n_values = len(self._names)
+
+        # new segments after the existing ones
+        self._segment_id = len(list(self._path.glob("segment-*.npy"))) - 1
+        self._segment = None
+        self._size = 0
+        self._episode_start = 0
+        self._index = open(self._path / _INDEX_FILE, "ab")
+
+    def _write_buffer(self):
+        if self._buffered > 0:
+            start = self._size - self._buffered
+            self._segment[:, start : self._size] = self._buffer[: self._buffered].T
+            self._buffered = 0
+
+    def _new_segment(self, min_len: int = 0):
+        # the steps of the ongoing episode are moved to the new segment
+        if self._segment is not None:
+            self._write_buffer()
+        episode_len = self._size - self._episode_start
+        capacity = max(self._segment_len, 2 * min_len)
+        self._segment_id += 1
+        segment = np.lib.format.open_memmap(
+            self._path / _segment_file(self._segment_id),
+            mode="w+",
+            dtype=self._dtype,
+            shape=(self._n_columns, capacity),
+        )
+        if self._segment is not None:
+            if episode_len > 0:
+                segment[:, :episode_len] = self._segment[
+                    :, self._episode_start : self._size
+                ]
+            self._segment.flush()
+        self._segment = segment
+        self._size = episode_len
+        self._episode_start = 0
+
+    def append(
+        self,
+        values: np.ndarray,
+        action: Union[np.ndarray, int, float],
+        terminated: bool = False,
+        truncated: bool = False,
+    ):
+        """
+        Record one step of the ongoing episode.
+
+        :param values: the recorded values, in the order of `names`
+        :param action: the action of the step
+        """
+        if self._segment is None or self._size == self._segment.shape[1]:
+            self._new_segment(min_len=self._size - self._episode_start + 1)
+
+        row = self._buffer[self._buffered]
+        n_values = self._n_values
+        row[:n_values] = values
+        row[n_values : n_values + self._action_size] = np.ravel(action)
+        row[-2] = terminated
+        row[-1] = truncated
+        self._buffered += 1
+        self._size += 1
+
+        if self._buffered == len(self._buffer):
+            self.flush()
+
+    def end_episode(self):
+        """
+        Complete the ongoing episode and add it to the index, if it has any step.
+        """
+        length = self._size - self._episode_start
+        if length == 0:
+            return
+        self._write_buffer()
+        entry = np.array(
+            [self._segment_id, self._episode_start, length], dtype=np.int64
+        )
+        self._index.write(entry.tobytes())
+        self._episode_start = self._size
+
+    def flush(self):
+        """
+        Write the recorded steps and the index to disk.
+        """
+        if self._segment is not None:
+            self._write_buffer()
+            self._segment.flush()
+        self._index.flush()
+
+    def close(self):
+        """
+        Complete the ongoing episode, flush and close the store.
+        """
+        if self._index.closed:
+            return
+        if self._segment is not None:
+            self.end_episode()
+        self.flush()
+        self._index.close()
+        self._segment = None
+
+    def __getstate__(self):
+        raise TypeError("EpisodeRecorder cannot be pickled, it writes to open files")
+
+
+class EpisodeStore(Sequence):
+    """
+    Read-only access to the episodes of a store written by `EpisodeRecorder`.
+
+    Each episode is a dict from the column names to read-only views of the memory-mapped segment,
+    with "action" for the actions with shape (length, action_size). Segments are mapped lazily,
+    only the pages actually read are loaded in memory.
+
+    :param path: the directory of the store
+    """
+
+    def __init__(self, path: Union[str, pathlib.Path]):
+        self._path = pathlib.Path(path)
+        with open(self._path / _META_FILE, "r") as f:
+            meta = json.load(f)
+        self.columns = meta["columns"]
+        self._dtype = np.dtype(meta["dtype"])
+
+        # only whole entries, in case a writer is appending
+        index_path = self._path / _INDEX_FILE
+        n_entries = os.path.getsize(index_path) // (3 * 8)
+        self._index = np.fromfile(index_path, dtype=np.int64, count=3 * n_entries)
+        self._index = self._index.reshape(n_entries, 3)
+        self._segments = {}
+
+        self._action_columns = [
+            i for i, col in enumerate(self.columns) if col.startswith("action_")
+        ]
+
+    def _segment(self, segment: int) -> np.ndarray:
+        if segment not in self._segments:
+            self._segments[segment] = np.load(
+                self._path / _segment_file(segment), mmap_mode="r"
+            )
+        return self._segments[segment]
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return self._index[:, 2]
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __getitem__(self, i: int) -> dict:
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        segment, start, length = self._index[i]
+        data = self._segment(int(segment))[:, start : start + length]
+
+        episode = {}
+        for j, col in enumerate(self.columns):
+            if j not in self._action_columns:
+                episode[col] = data[j]
+        if len(self._action_columns) > 0:
+            a0, a1 = self._action_columns[0], self._action_columns[-1] + 1
+            episode["action"] = data[a0:a1].T
+        return episode
+
+
+def enable_recording(env, path: Union[str, pathlib.Path], **kwargs) -> EpisodeRecorder:
+    """
+    Record the episodes of the outermost auto-shaping wrapper in `env` which supports it
+    (`CollectionWrapper` and the HPRS wrappers), and return the recorder.
+
+    :param env: the wrapped environment
+    :param path: the directory of the store
+    :param kwargs: the keyword arguments of `EpisodeRecorder`
+    """
+    while env is not None:
+        if "recorder" in vars(env):
+            action_size = int(np.prod(env.action_space.shape, dtype=np.int64))
+            env.recorder = EpisodeRecorder(
+                path, names=env._recorded_names(), action_size=action_size, **kwargs
+            )
+            return env.recorder
+        env = vars(env).get("env")
+    raise ValueError("No wrapper supports recording")
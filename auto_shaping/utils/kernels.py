@@ -0,0 +1,54 @@
+"""
+Vectorized kernels scoring states against all the requirements compiled by `RewardSpec.requirement_arrays`,
+with a constant number of array operations independent of the number of requirements.
+
+The values of the variables are given as an array of shape (n_variables,) for one state,
+or (n_variables, batch_size) for a batch of states; the results have shape (n_requirements,)
+or (n_requirements, batch_size) accordingly.
+"""
+
+import numpy as np
+
+from auto_shaping.spec.reward_spec import RequirementArrays
+from auto_shaping.utils.utils import clip_and_norm_batch
+
+
+def _column(param: np.ndarray, ndim: int) -> np.ndarray:
+    # one parameter per requirement, broadcast along the batch dimension
+    return param.reshape(param.shape + (1,) * (ndim - 1))
+
+
+def requirement_inputs(reqs: RequirementArrays, values: np.ndarray) -> np.ndarray:
+    """
+    Values of the variables of the requirements, after their processing function.
+    """
+    x = values[reqs.var_index]
+    if len(reqs.abs_rows) > 0:
+        x[reqs.abs_rows] = np.abs(x[reqs.abs_rows])
+    if len(reqs.exp_rows) > 0:
+        x[reqs.exp_rows] = np.exp(x[reqs.exp_rows])
+    return x
+
+
+def requirement_satisfaction(reqs: RequirementArrays, values: np.ndarray) -> np.ndarray:
+    """
+    Boolean satisfaction of the predicates of the requirements.
+    """
+    x = requirement_inputs(reqs, values)
+    ndim = x.ndim
+    s = _column(reqs.sign, ndim) * (x - _column(reqs.threshold, ndim))
+    offset = _column(reqs.offset, ndim)
+    return np.where(_column(reqs.strict, ndim), s < offset, s <= offset)
+
+
+def requirement_scores(reqs: RequirementArrays, values: np.ndarray) -> np.ndarray:
+    """
+    Scores in [0, 1] of how close the predicates of the requirements are to be satisfied,
+    normalized in the domain of their variables.
+    """
+    x = requirement_inputs(reqs, values)
+    ndim = x.ndim
+    norm_x = clip_and_norm_batch(
+        x, _column(reqs.score_min, ndim), _column(reqs.score_max, ndim)
+    )
+    return np.where(_column(reqs.lower, ndim), norm_x, 1.0 - norm_x)
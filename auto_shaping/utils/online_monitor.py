@@ -0,0 +1,151 @@
+"""
+Online robustness monitors, updated with one sample per step in amortized O(1).
+"""
+from collections import deque
+from typing import List, Mapping, Sequence
+
+from auto_shaping.spec.reward_spec import RequirementSpec
+from auto_shaping.utils.robustness import (
+    is_native_requirement,
+    predicate_robustness,
+)
+
+
+class RunningExtremum:
+    """
+    Running min (or max) over all the samples since the last reset, in constant memory.
+
+    :param mode: "min" or "max"
+    """
+
+    def __init__(self, mode: str = "min"):
+        assert mode in ["min", "max"], f"Unknown mode {mode}"
+
+        self._fn = min if mode == "min" else max
+        self._value = None
+
+    def reset(self):
+        self._value = None
+
+    def update(self, value: float):
+        self._value = value if self._value is None else self._fn(self._value, value)
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+
+class SlidingExtremum:
+    """
+    Running min (or max) over the last `window_len` samples, with a monotonic deque.
+
+    The deque stores (index, value) pairs with monotonic values, so that the front is always
+    the extremum of the window. Each sample is pushed and popped at most once.
+
+    :param window_len: the number of most recent samples in the window
+    :param mode: "min" or "max"
+    """
+
+    def __init__(self, window_len: int, mode: str = "min"):
+        assert window_len is not None and window_len > 0, "window_len must be positive"
+        assert mode in ["min", "max"], f"Unknown mode {mode}"
+
+        self._window_len = window_len
+        self._sign = 1.0 if mode == "min" else -1.0
+        self._deque = deque()
+        self._index = -1
+
+    def reset(self):
+        self._deque.clear()
+        self._index = -1
+
+    def update(self, value: float):
+        self._index += 1
+        key = self._sign * value
+
+        # drop dominated samples from the back
+        while self._deque and self._deque[-1][1] >= key:
+            self._deque.pop()
+        self._deque.append((self._index, key))
+
+        # drop expired samples from the front
+        if self._deque[0][0] <= self._index - self._window_len:
+            self._deque.popleft()
+
+    @property
+    def value(self) -> float:
+        return self._sign * self._deque[0][1]
+
+
+class OnlineRequirementsMonitor:
+    """
+    Robustness of a conjunction of requirements over the last `window_len` samples,
+    or over the whole episode if `window_len` is None, with the same semantics of the
+    offline engines applied to the monitored samples.
+
+    - `ensure p` (always) is the running min of the robustness of p,
+    - `achieve p` (eventually) is the running max of the robustness of p,
+    - `conquer p` (eventually always) is the max over suffix minima; since the suffix minima
+      are non-decreasing, it is attained at the last suffix and equals the robustness of p
+      at the most recent sample.
+
+    Over the whole episode, the monitor keeps only these summaries, so memory does not grow
+    with the episode length and reading the robustness is constant time.
+
+    :param requirements: the list of requirements in conjunction
+    :param window_len: the number of most recent samples to monitor, None for the whole episode
+    """
+
+    def __init__(self, requirements: List[RequirementSpec], window_len: int = None):
+        for req in requirements:
+            if not is_native_requirement(req):
+                raise NotImplementedError(f"Requirement {req} not supported online")
+
+        self._requirements = requirements
+        # the variables of the predicates, read from the samples
+        self._variables = list(
+            dict.fromkeys(req._predicate.to_tuple()[0][1] for req in requirements)
+        )
+        self._window_len = window_len
+        self._extrema = []
+        for req in requirements:
+            if req._operator in ["ensure", "achieve"]:
+                mode = "min" if req._operator == "ensure" else "max"
+                if window_len is None:
+                    self._extrema.append(RunningExtremum(mode=mode))
+                else:
+                    self._extrema.append(SlidingExtremum(window_len, mode=mode))
+            else:
+                self._extrema.append(None)
+        self._rhos = [None] * len(requirements)
+        # the number of samples since the last reset, also beyond the window
+        self.n_samples = 0
+
+    def reset(self):
+        for extremum in self._extrema:
+            if extremum is not None:
+                extremum.reset()
+        self._rhos = [None] * len(self._requirements)
+        self.n_samples = 0
+
+    def update(self, sample: Mapping[str, float]):
+        """
+        Update the monitor with the most recent values of the variables.
+        """
+        self.n_samples += 1
+        for i, (req, extremum) in enumerate(zip(self._requirements, self._extrema)):
+            rho = float(predicate_robustness(req._predicate, sample))
+            if extremum is not None:
+                extremum.update(rho)
+                rho = extremum.value
+            self._rhos[i] = rho
+
+    def update_last(self, episode: Mapping[str, Sequence[float]]):
+        """
+        Update the monitor with the last sample of the collected episode.
+        """
+        self.update({var: episode[var][-1] for var in self._variables})
+
+    @property
+    def robustness(self) -> float:
+        return min(self._rhos)
@@ -0,0 +1,130 @@
+"""
+Opt-in profiling of the shaping wrappers, with monotonic timers and counters per phase of a step.
+"""
+
+import time
+from typing import Any, Dict
+
+
+class StepProfiler:
+    """
+    Accumulates the time spent in each phase of the steps of a wrapper (e.g., "extract", "collect", "monitor")
+    with `time.perf_counter_ns`, together with named counters.
+
+    When disabled, `start` returns 0 and the other methods return immediately, so the instrumented code
+    only pays a method call per phase.
+
+    Usage in a wrapper:
+        t0 = self.profiler.start()
+        ...
+        self.profiler.stop("extract", t0)
+        ...
+        self.profiler.step(info)
+
+    :param name: the name of the profiled wrapper, used as key in `info["profiling"]`
+    :param enabled: whether to collect the timings
+    :param info_every: if given, the stats are added to `info["profiling"][name]` every `info_every` steps
+    """
+
+    def __init__(self, name: str, enabled: bool = False, info_every: int = None):
+        assert info_every is None or info_every > 0, "info_every must be positive"
+        self.name = name
+        self.enabled = enabled
+        self.info_every = info_every
+        self.reset()
+
+    def enable(self, info_every: int = None):
+        assert info_every is None or info_every > 0, "info_every must be positive"
+        self.enabled = True
+        self.info_every = info_every
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        self.steps = 0
+        self._total_ns = {}
+        self._calls = {}
+        self._counters = {}
+
+    def start(self) -> int:
+        return time.perf_counter_ns() if self.enabled else 0
+
+    def stop(self, phase: str, t0: int):
+        """
+        Add the time elapsed since `t0`, as returned by `start`, to the phase.
+        """
+        if not self.enabled:
+            return
+        elapsed = time.perf_counter_ns() - t0
+        self._total_ns[phase] = self._total_ns.get(phase, 0) + elapsed
+        self._calls[phase] = self._calls.get(phase, 0) + 1
+
+    def count(self, counter: str, n: int = 1):
+        if not self.enabled:
+            return
+        self._counters[counter] = self._counters.get(counter, 0) + n
+
+    def step(self, info: dict = None):
+        """
+        Count one step, to be called at the end of the step of the wrapper,
+        and add the stats to `info` every `info_every` steps.
+        """
+        if not self.enabled:
+            return
+        self.steps += 1
+        if (
+            info is not None
+            and self.info_every is not None
+            and self.steps % self.info_every == 0
+        ):
+            info.setdefault("profiling", {})[self.name] = self.stats()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return the stats since the last reset, as plain data: the number of steps,
+        for each phase the number of calls, the total time in seconds and the mean time
+        per call in microseconds, and the counters.
+        """
+        phases = {}
+        for phase, total_ns in self._total_ns.items():
+            calls = self._calls[phase]
+            phases[phase] = {
+                "calls": calls,
+                "total_s": total_ns * 1e-9,
+                "mean_us": total_ns * 1e-3 / calls,
+            }
+        return {"steps": self.steps, "phases": phases, "counters": dict(self._counters)}
+
+
+def enable_profiling(env, info_every: int = None) -> Dict[str, StepProfiler]:
+    """
+    Enable the profilers of all the auto-shaping wrappers stacked in `env`,
+    and return them by name of the wrapper.
+
+    The wrappers of the same class stacked more than once are named with their depth in the stack,
+    from 0 for the outermost wrapper, e.g. "TLTLWrapper[0]" and "TLTLWrapper[2]".
+
+    :param env: the wrapped environment, or vector environment
+    :param info_every: if given, the stats are added to `info["profiling"]` every `info_every` steps
+    """
+    stack = []
+    depth = 0
+    while env is not None:
+        # only the attribute of this wrapper, not the one forwarded from the inner ones
+        profiler = vars(env).get("profiler")
+        if isinstance(profiler, StepProfiler):
+            stack.append((depth, type(env).__name__, profiler))
+        env = vars(env).get("env")
+        depth += 1
+
+    class_names = [class_name for _, class_name, _ in stack]
+    profilers = {}
+    for depth, class_name, profiler in stack:
+        name = class_name
+        if class_names.count(class_name) > 1:
+            name = f"{class_name}[{depth}]"
+        profiler.name = name
+        profiler.enable(info_every=info_every)
+        profilers[name] = profiler
+    return profilers
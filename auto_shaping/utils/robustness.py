@@ -0,0 +1,212 @@
+"""
+Native robustness engine for the STL fragment emitted by `RequirementSpec.to_rtamt`:
+`always p`, `eventually p` and `eventually always p` over one atomic predicate `p`,
+and conjunctions of these, evaluated at time 0 with discrete-time semantics.
+"""
+import warnings
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from auto_shaping.spec.reward_spec import PredicateSpec, RequirementSpec, RewardSpec
+from auto_shaping.utils.utils import monitor_stl_episode
+
+_native_fns = {
+    "abs": np.abs,
+    "exp": np.exp,
+    None: lambda x: x,
+}
+
+_native_operators = ["ensure", "achieve", "conquer"]
+
+
+def is_native_predicate(predicate: PredicateSpec) -> bool:
+    (fn, _), cmp_op, _ = predicate.to_tuple()
+    return fn in _native_fns and cmp_op in ["<", "<=", ">", ">="]
+
+
+def is_native_requirement(requirement: RequirementSpec) -> bool:
+    return requirement._operator in _native_operators and is_native_predicate(
+        requirement._predicate
+    )
+
+
+def predicate_robustness(
+    predicate: PredicateSpec, episode: Dict[str, Any]
+) -> np.ndarray:
+    """
+    Robustness trace of an atomic predicate, with the same quantitative semantics as rtamt
+    (strict and non-strict comparisons have the same robustness).
+    """
+    (fn, var), cmp_op, threshold = predicate.to_tuple()
+    values = _native_fns[fn](np.asarray(episode[var], dtype=np.float64))
+
+    if cmp_op in ["<", "<="]:
+        return threshold - values
+    elif cmp_op in [">", ">="]:
+        return values - threshold
+
+    raise ValueError(f"Unknown comparison operator {cmp_op}")
+
+
+def temporal_robustness(operator: str, rho: np.ndarray) -> float:
+    """
+    Robustness at time 0 of a temporal operator applied to the robustness trace `rho`.
+    """
+    if operator == "ensure":
+        # always p
+        return float(np.min(rho))
+    elif operator == "achieve":
+        # eventually p
+        return float(np.max(rho))
+    elif operator == "conquer":
+        # eventually always p, as max over the suffix minima
+        suffix_min = np.minimum.accumulate(rho[::-1])
+        return float(np.max(suffix_min))
+
+    raise NotImplementedError(f"Operator {operator} not supported by native engine")
+
+
+def requirement_robustness(
+    requirement: RequirementSpec, episode: Dict[str, Any]
+) -> float:
+    rho = predicate_robustness(requirement._predicate, episode)
+    return temporal_robustness(requirement._operator, rho)
+
+
+def monitor_requirements(
+    requirements: List[RequirementSpec],
+    vars: List[str],
+    episode: Dict[str, Any],
+    engine: str = "native",
+) -> float:
+    """
+    Robustness at time 0 of the conjunction of the given requirements.
+
+    The native engine is used if requested and all requirements are in the supported fragment,
+    otherwise the conjunction is monitored with rtamt.
+
+    :param requirements: the list of requirements in conjunction
+    :param vars: the list of variables collected in the episode
+    :param episode: the collected episode, as a dict of variable traces
+    :param engine: "native" or "rtamt"
+    """
+    if engine == "native" and all([is_native_requirement(r) for r in requirements]):
+        return min([requirement_robustness(r, episode) for r in requirements])
+
+    stl_spec = " and ".join([f"({r.to_rtamt()})" for r in requirements])
+    robustness_trace = monitor_stl_episode(stl_spec, vars, episode)
+    return robustness_trace[0][1]
+
+
+def monitor_predicate(
+    predicate: PredicateSpec,
+    vars: List[str],
+    episode: Dict[str, Any],
+    engine: str = "native",
+) -> np.ndarray:
+    """
+    Robustness trace of an atomic predicate over the episode.
+
+    :param predicate: the atomic predicate
+    :param vars: the list of variables collected in the episode
+    :param episode: the collected episode, as a dict of variable traces
+    :param engine: "native" or "rtamt"
+    """
+    if engine == "native" and is_native_predicate(predicate):
+        return predicate_robustness(predicate, episode)
+
+    robustness_trace = monitor_stl_episode(predicate.to_rtamt(), vars, episode)
+    return np.array([rob for t, rob in robustness_trace], dtype=np.float64)
+
+
+def stl_requirements(spec: RewardSpec) -> List[RequirementSpec]:
+    """
+    The requirements of the specification supported by STL, as monitored by TLTL and BHNR.
+    """
+    reqs = []
+    for req_spec in spec.specs:
+        try:
+            req_spec.to_rtamt()
+            reqs.append(req_spec)
+        except Exception as e:
+            warnings.warn(
+                f"Failed to parse requirement: {req_spec}, if comfort requirement no worries because it is not supported by STL"
+            )
+    return reqs
+
+
+def split_requirements(
+    spec: RewardSpec,
+) -> Tuple[List[RequirementSpec], List[RequirementSpec], List[PredicateSpec]]:
+    """
+    The safety and target requirements, and the predicates of the comfort requirements,
+    of the specification, as monitored by PAM and RPR.
+    """
+    safety_specs, target_specs, comfort_specs = [], [], []
+    for req_spec in spec.specs:
+        try:
+            if req_spec._operator == "ensure":
+                req_spec.to_rtamt()
+                safety_specs.append(req_spec)
+            elif req_spec._operator in ["achieve", "conquer"]:
+                req_spec.to_rtamt()
+                target_specs.append(req_spec)
+            elif req_spec._operator == "encourage":
+                # encourage is a special case, monitored with average semantics
+                req_spec._predicate.to_rtamt()
+                comfort_specs.append(req_spec._predicate)
+            else:
+                raise NotImplementedError()
+        except Exception as e:
+            warnings.warn(
+                f"Failed to parse requirement: {req_spec}, make sure it is a valid STL formula"
+            )
+    return safety_specs, target_specs, comfort_specs
+
+
+def valid_steps(lengths: np.ndarray, max_length: int) -> np.ndarray:
+    """
+    Mask of the steps of a batch of padded episodes, with shape (n_episodes, max_length).
+    """
+    return np.arange(max_length) < np.asarray(lengths)[:, None]
+
+
+def batch_predicate_robustness(
+    predicate: PredicateSpec, vars: List[str], traces: np.ndarray
+) -> np.ndarray:
+    """
+    Robustness traces of an atomic predicate over a batch of padded episodes,
+    with shape (n_episodes, max_length).
+
+    :param predicate: the atomic predicate, in the native fragment
+    :param vars: the variables of the last axis of `traces`
+    :param traces: the padded episodes, with shape (n_episodes, max_length, n_vars)
+    """
+    if not is_native_predicate(predicate):
+        raise ValueError(
+            f"Predicate {predicate.to_rtamt()} not supported by native engine"
+        )
+    (_, var), _, _ = predicate.to_tuple()
+    return predicate_robustness(predicate, {var: traces[:, :, vars.index(var)]})
+
+
+def batch_temporal_robustness(
+    operator: str, rho: np.ndarray, valid: np.ndarray
+) -> np.ndarray:
+    """
+    Robustness at time 0 of a temporal operator applied to a batch of padded robustness traces,
+    with shape (n_episodes,). The padding steps, where `valid` is False, are ignored.
+    """
+    if operator == "ensure":
+        return np.min(np.where(valid, rho, np.inf), axis=1)
+    elif operator == "achieve":
+        return np.max(np.where(valid, rho, -np.inf), axis=1)
+    elif operator == "conquer":
+        # suffix minima from the last valid step, padding steps excluded from the max
+        suffix_min = np.minimum.accumulate(
+            np.where(valid, rho, np.inf)[:, ::-1], axis=1
+        )[:, ::-1]
+        return np.max(np.where(valid, suffix_min, -np.inf), axis=1)
+
+    raise NotImplementedError(f"Operator {operator} not supported by native engine")
@@ -0,0 +1,111 @@
+"""
+Structure-of-arrays storage of the traces of an episode, reused across episodes.
+"""
+
+from collections.abc import Mapping
+from typing import List
+
+import numpy as np
+
+
+class TraceBuffer(Mapping):
+    """
+    Traces of some variables over an episode, stored in a preallocated array with one row per variable.
+
+    If `window_len` is None, the whole episode is stored and the array grows by doubling its capacity.
+    Otherwise, only the most recent `window_len` samples are kept in a ring buffer: each sample is written
+    twice, at its position and `window_len` positions later, so that the window is always
+    a contiguous slice of the array, also after wrapping around.
+
+    It is a read-only mapping from the names of the variables to their traces, as views of the array
+    which are valid until the next `append` or `reset`.
+
+    :param names: the names of the variables
+    :param window_len: the number of most recent samples to keep, if None, the whole episode is kept
+    :param capacity: the initial capacity of the array, if the whole episode is kept
+    :param dtype: the dtype of the array
+    """
+
+    def __init__(
+        self,
+        names: List[str],
+        window_len: int = None,
+        capacity: int = 1024,
+        dtype: np.dtype = np.float64,
+    ):
+        assert window_len is None or window_len > 0, "window_len must be positive"
+        assert capacity > 0, "capacity must be positive"
+
+        self._names = list(names)
+        self._index = {name: i for i, name in enumerate(self._names)}
+        self._window_len = window_len
+
+        n_cols = capacity if window_len is None else 2 * window_len
+        self._data = np.zeros((len(self._names), n_cols), dtype=dtype)
+        self._start = 0
+        self._length = 0
+
+    @property
+    def length(self) -> int:
+        """
+        The number of samples currently stored.
+        """
+        return self._length
+
+    def reset(self):
+        """
+        Remove all the samples, keeping the allocated array.
+        """
+        self._start = 0
+        self._length = 0
+
+    def append(self, values: np.ndarray):
+        """
+        Append one sample, with the values of the variables in the order of `names`.
+        """
+        if self._window_len is None:
+            if self._length == self._data.shape[1]:
+                data = np.zeros(
+                    (self._data.shape[0], 2 * self._data.shape[1]),
+                    dtype=self._data.dtype,
+                )
+                data[:, : self._length] = self._data[:, : self._length]
+                self._data = data
+            self._data[:, self._length] = values
+            self._length += 1
+        elif self._length < self._window_len:
+            self._data[:, self._length] = values
+            self._data[:, self._length + self._window_len] = values
+            self._length += 1
+        else:
+            # overwrite the oldest sample and move the window forward
+            self._data[:, self._start] = values
+            self._data[:, self._start + self._window_len] = values
+            self._start = (self._start + 1) % self._window_len
+
+    def __getstate__(self) -> dict:
+        # only the stored samples, unrolled, instead of the whole preallocated array
+        state = dict(self.__dict__)
+        state["_data"] = self._data[:, self._start : self._start + self._length].copy()
+        state["_n_cols"] = self._data.shape[1]
+        state["_start"] = 0
+        return state
+
+    def __setstate__(self, state: dict):
+        samples = state.pop("_data")
+        n_cols = state.pop("_n_cols")
+        self.__dict__.update(state)
+
+        self._data = np.zeros((samples.shape[0], n_cols), dtype=samples.dtype)
+        self._data[:, : self._length] = samples
+        if self._window_len is not None:
+            self._data[:, self._window_len : self._window_len + self._length] = samples
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self._data[self._index[name], self._start : self._start + self._length]
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self) -> int:
+        return len(self._names)
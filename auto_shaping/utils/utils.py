@@ -1,27 +1,80 @@
-from typing import Any, List, Dict
+import copy
+import threading
+import types
+from collections.abc import Mapping
+from typing import Any, List, Dict, Union
 
 import gymnasium
-import rtamt
 import numpy as np
 
 from auto_shaping.spec.reward_spec import RewardSpec
 
+# the parsed rtamt specifications of each thread
+_monitors = threading.local()
 
-def monitor_stl_episode(
-    stl_spec: str, vars: List[str], episode: Dict[str, Any], types: List[str] = None
-):
-    assert type(episode) == dict, f"episode must be a dict, got {type(episode)}"
 
-    if types is None:
-        types = ["float"] * len(vars)
+def _compile_monitor(semantics: str, stl_spec: str, var_types: frozenset):
+    """
+    Build and parse a rtamt specification, cached by (semantics, spec string, variable set).
+
+    The offline interpreters evaluate the whole dataset from scratch at every call,
+    so a parsed specification can be reused across episodes without carrying any state.
+    Since a specification is modified while evaluated, each thread has its own cache.
+    """
+    cache = getattr(_monitors, "cache", None)
+    if cache is None:
+        cache = _monitors.cache = {}
+
+    key = (semantics, stl_spec, var_types)
+    if key not in cache:
+        cache[key] = _parse_monitor(semantics, stl_spec, var_types)
+    return cache[key]
+
 
-    spec = rtamt.STLSpecification()
-    for v, t in zip(vars, types):
+def _parse_monitor(semantics: str, stl_spec: str, var_types: frozenset):
+    import rtamt
+
+    if semantics == "standard":
+        spec = rtamt.STLSpecification()
+    elif semantics == "filtering":
+        spec = rtamt.FilteringStlDiscreteTimeOfflineSpecification()
+    else:
+        raise ValueError(f"Unknown monitor semantics {semantics}")
+
+    for v, t in sorted(var_types):
         spec.declare_var(v, f"{t}")
 
     spec.spec = stl_spec
     spec.parse()
 
+    return spec
+
+
+def get_monitor(
+    stl_spec: str, vars: List[str], types: List[str] = None, semantics: str = "standard"
+):
+    """
+    Return a parsed rtamt monitor for the given specification, built once per thread.
+
+    :param stl_spec: the STL formula in rtamt syntax
+    :param vars: the names of the declared variables
+    :param types: the types of the declared variables, float if None
+    :param semantics: "standard" for STL robustness, "filtering" for the filtering semantics
+    """
+    if types is None:
+        types = ["float"] * len(vars)
+
+    return _compile_monitor(semantics, stl_spec, frozenset(zip(vars, types)))
+
+
+def monitor_stl_episode(
+    stl_spec: str, vars: List[str], episode: Dict[str, Any], types: List[str] = None
+):
+    assert isinstance(episode, Mapping), f"episode must be a dict, got {type(episode)}"
+    episode = dict(episode)
+
+    spec = get_monitor(stl_spec, vars, types, semantics="standard")
+
     # sanity check: all list in the episode dict have same length
     lengths = set([len(v) for v in episode.values()])
     assert (
@@ -36,17 +89,10 @@ def monitor_stl_episode(
 def monitor_filtering_stl_episode(
     stl_spec: str, vars: List[str], episode: Dict[str, Any], types: List[str] = None
 ):
-    assert type(episode) == dict, f"episode must be a dict, got {type(episode)}"
+    assert isinstance(episode, Mapping), f"episode must be a dict, got {type(episode)}"
+    episode = dict(episode)
 
-    if types is None:
-        types = ["float"] * len(vars)
-
-    spec = rtamt.FilteringStlDiscreteTimeOfflineSpecification()
-    for v, t in zip(vars, types):
-        spec.declare_var(v, f"{t}")
-
-    spec.spec = stl_spec
-    spec.parse()
+    spec = get_monitor(stl_spec, vars, types, semantics="filtering")
 
     # sanity check: all list in the episode dict have same length
     lengths = set([len(v) for v in episode.values()])
@@ -80,24 +126,527 @@ def clip_and_norm(v: float, minv: float, maxv: float) -> float:
     return (v - minv) / (maxv - minv)
 
 
-def extend_state(
-    env: gymnasium.Env, state: dict, action: np.ndarray, spec: RewardSpec
+def clip_and_norm_batch(
+    v: np.ndarray, minv: Union[float, np.ndarray], maxv: Union[float, np.ndarray]
+) -> np.ndarray:
+    """
+    Normalize an array of values in [0, 1], element-wise as `clip_and_norm`.
+
+    :param v: values `v` before normalization,
+    :param minv: `minv` extreme values of the domain, a scalar or an array broadcastable to `v`.
+    :param maxv: `maxv` extreme values of the domain, a scalar or an array broadcastable to `v`.
+    :return: normalized values v' in [0, 1].
+    """
+    width = np.subtract(maxv, minv, dtype=np.float64)
+    degenerate = np.abs(width) <= 0.000001
+
+    # same order of comparisons as clip_and_norm, also when minv > maxv
+    v = np.where(v < minv, minv, np.where(v > maxv, maxv, v))
+    norm_v = (v - minv) / np.where(degenerate, 1.0, width)
+    return np.where(degenerate, 0.0, norm_v)
+
+
+def state_values(state: Mapping, spec: RewardSpec) -> np.ndarray:
+    """
+    Return the values of the used variables of an extended state, in the order of `spec.used_variables`.
+    For a batch of extended states, the result has shape (n_variables, batch_size).
+    """
+    if isinstance(state, ExtendedState):
+        return state.variable_values
+    return np.array(
+        [state[var_name] for var_name in spec._used_variables], dtype=np.float64
+    )
+
+
+class SpecContext:
+    """
+    Per-environment state of a reward specification: the values of the constants depending on
+    the environment and the namespace in which the expressions are evaluated.
+
+    The reward specification is shared by the wrappers and never modified, each wrapper
+    evaluates it in its own context.
+
+    :param spec: the reward specification
+    """
+
+    def __init__(self, spec: RewardSpec):
+        self.constant_values = dict(spec._constant_values)
+        self.constant_array = spec._constant_array.copy()
+        self.namespace = {"np": np, **spec._constant_values}
+
+    def __getstate__(self) -> dict:
+        # the namespace refers to the env and the last state, rebuilt from the constants
+        state = self.__dict__.copy()
+        state["namespace"] = {"np": None, **self.constant_values}
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self.namespace["np"] = np
+
+
+def resolve_constants(
+    env: gymnasium.Env, spec: RewardSpec, context: SpecContext = None
 ) -> dict:
+    """
+    Evaluate the constants which depend on the environment, to be called once per episode.
+    The other constants are resolved once when the reward specification is built.
+
+    :param context: the context of the environment to update, if None a new one is created
+    """
+    context = SpecContext(spec) if context is None else context
+    namespace = context.namespace
+    namespace["env"] = env
+
+    for const_name, code in spec._env_constant_codes.items():
+        value = float(eval(code, namespace))
+        context.constant_values[const_name] = value
+        context.constant_array[spec._state_layout[const_name]] = value
+        namespace[const_name] = value
+
+    return context.constant_values
+
+
+class ExtendedState(Mapping):
+    """
+    Extended state with the values of the constants and the used variables of a reward specification,
+    stored in a preallocated array with the layout `spec.state_layout`.
+
+    It is a read-only mapping from the names to their values, which also includes `state` and `action`,
+    and is meant to be overwritten at every step rather than allocated again.
+
+    :param spec: the reward specification
+    :param dtype: the dtype of the array of values
+    """
+
+    def __init__(self, spec: RewardSpec, dtype: np.dtype = np.float64):
+        self._layout = spec.state_layout
+        self._n_constants = len(spec.constants)
+        self.array = np.zeros(len(self._layout), dtype=dtype)
+        self.state = None
+        self.action = None
+
+    @property
+    def layout(self) -> Mapping:
+        return self._layout
+
+    @property
+    def variable_values(self) -> np.ndarray:
+        """
+        View of the values of the used variables, in the order of `spec.used_variables`.
+        """
+        return self.array[self._n_constants :]
+
+    def copy(self) -> "ExtendedState":
+        other = ExtendedState.__new__(ExtendedState)
+        other._layout = self._layout
+        other._n_constants = self._n_constants
+        other.array = self.array.copy()
+        other.state = self.state
+        other.action = self.action
+        return other
+
+    def __getitem__(self, key: str) -> Any:
+        index = self._layout.get(key)
+        if index is not None:
+            return float(self.array[index])
+        if key == "state":
+            return self.state
+        if key == "action":
+            return self.action
+        raise KeyError(key)
+
+    def __iter__(self):
+        yield from self._layout
+        yield "state"
+        yield "action"
+
+    def __len__(self) -> int:
+        return len(self._layout) + 2
+
+    def __repr__(self) -> str:
+        return f"ExtendedState({dict(self)})"
+
+    def __getstate__(self) -> dict:
+        state = dict(self.__dict__)
+        state["_layout"] = dict(self._layout)
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._layout = types.MappingProxyType(self._layout)
+
+
+def extend_state(
+    env: gymnasium.Env,
+    state: Any,
+    action: np.ndarray,
+    spec: RewardSpec,
+    out: ExtendedState = None,
+    context: SpecContext = None,
+) -> ExtendedState:
     """
     Given a state and a reward specification, return an extended state with all the constants and variables.
+
+    Expressions are pre-compiled in the reward specification and evaluated in the namespace of the context,
+    which is updated in place rather than rebuilt at every call.
+
+    :param out: the extended state to overwrite, if None a new one is allocated
+    :param context: the context of the environment, if None the constants are resolved in a new one
+    """
+    # resolve the constants depending on env, if not done at the beginning of the episode
+    if context is None:
+        context = SpecContext(spec)
+    if len(context.constant_values) < len(spec._constants):
+        resolve_constants(env, spec, context)
+
+    namespace = context.namespace
+    namespace["env"] = env
+    namespace["state"] = state
+    namespace["action"] = action
+
+    if out is None:
+        out = ExtendedState(spec)
+    out.state = state
+    out.action = action
+
+    # first copy the constants, then compute the variables used in the specification
+    array = out.array
+    n_constants = len(spec._constants)
+    array[:n_constants] = context.constant_array
+    for i, var_name in enumerate(spec._used_variables, start=n_constants):
+        value = float(eval(spec._variable_codes[var_name], namespace))
+        array[i] = value
+        namespace[var_name] = value
+    return out
+
+
+class ExtractionCache:
+    """
+    Per-step cache of the extended states of an environment, shared by the auto-shaping wrappers
+    stacked on it, so that the variables of a reward specification are evaluated once per step.
+
+    The cache is cleared at every step by its owner, the innermost wrapper, and an entry is valid
+    only for the same state and action objects, in case an observation or action wrapper is in between.
+    """
+
+    def __init__(self):
+        self._entries = {}
+
+    def clear(self):
+        self._entries.clear()
+
+    def __getstate__(self) -> dict:
+        # the entries are only valid within a step
+        return {"_entries": {}}
+
+    def lookup(
+        self, spec: RewardSpec, state: Any, action: Any, out: ExtendedState
+    ) -> Union[ExtendedState, None]:
+        """
+        Copy the cached extended state of the same specification, state and action into `out`,
+        and return it, or None if not in the cache.
+        """
+        entry = self._entries.get(spec._key)
+        if entry is None or entry.state is not state or entry.action is not action:
+            return None
+        if entry is not out:
+            out.array[:] = entry.array
+            out.state = state
+            out.action = action
+        return out
+
+    def store(self, spec: RewardSpec, ext_state: ExtendedState):
+        self._entries[spec._key] = ext_state
+
+
+def get_extraction_cache(env: gymnasium.Env) -> tuple[ExtractionCache, bool]:
+    """
+    Return the extraction cache of the wrappers stacked on `env`, or a new one if there is none,
+    and whether the caller owns it.
+    """
+    try:
+        return env.get_wrapper_attr("extraction_cache"), False
+    except AttributeError:
+        return ExtractionCache(), True
+
+
+class StateExtractor:
+    """
+    Extracts the extended state of an environment according to a reward specification.
+
+    The returned extended state is overwritten at the next call, use `copy()` to keep it.
+
+    :param env: the environment passed to the expressions of constants and variables
+    :param spec: the reward specification
+    :param dtype: the dtype of the array of values of the extended state
+    :param cache: the extraction cache shared with the other wrappers, if any
+    """
+
+    def __init__(
+        self,
+        env: gymnasium.Env,
+        spec: RewardSpec,
+        dtype: np.dtype = np.float64,
+        cache: ExtractionCache = None,
+    ):
+        self._env = env
+        self._spec = spec
+        self._out = ExtendedState(spec, dtype=dtype)
+        self.context = SpecContext(spec)
+        self.cache = cache
+
+    def reset(self):
+        resolve_constants(self._env, self._spec, self.context)
+
+    def __call__(self, state: Any, action: np.ndarray) -> ExtendedState:
+        if self.cache is not None:
+            ext_state = self.cache.lookup(self._spec, state, action, out=self._out)
+            if ext_state is not None:
+                return ext_state
+
+        ext_state = extend_state(
+            env=self._env,
+            state=state,
+            action=action,
+            spec=self._spec,
+            out=self._out,
+            context=self.context,
+        )
+        if self.cache is not None:
+            self.cache.store(self._spec, ext_state)
+        return ext_state
+
+    def __deepcopy__(self, memo):
+        # the env, the buffers and the cache are copied with the wrapper, the immutable spec is shared
+        memo[id(self._spec)] = self._spec
+        copied = self.__class__.__new__(self.__class__)
+        memo[id(self)] = copied
+        for name, value in vars(self).items():
+            setattr(copied, name, copy.deepcopy(value, memo))
+        return copied
+
+
+class BatchStateExtractor:
     """
-    context = {}
-    # first add the constants
-    for const_name, const in spec._constants.items():
-        value = const.value
-        if isinstance(value, str):
-            value = float(eval(value, {**context, "env": env, "np": np}))
-        context[const_name] = value
-    # then add the variables from the state and action
-    context.update({"state": state})
-    context.update({"action": action})
-    # finally compute derived variables
-    for var_name, var in spec._variables.items():
-        value = float(eval(var.fn, {**context, "env": env, "np": np}))
-        context[var_name] = value
-    return context
+    Extracts the extended states of a batch of states according to a reward specification.
+
+    Each variable is evaluated once for the whole batch, with `state` and `action` transposed
+    so that `state[i]` is the array of the i-th component over the batch. The expressions
+    which do not support it (e.g., reductions over the state, python builtins as `max`)
+    or refer to `env` are evaluated state by state: an expression is evaluated in batch as long as
+    it evaluates without error to one value per state, otherwise state by state from then on.
+
+    :param spec: the reward specification
+    :param envs: the sub-environments passed to the expressions, required only if they refer to `env`
+    """
+
+    def __init__(self, spec: RewardSpec, envs: List[gymnasium.Env] = None):
+        self._spec = spec
+        self._envs = envs
+
+        # True for batch evaluation, False for state by state
+        self._batched = {}
+        env_names = set(["env"]) | set(spec._env_constant_codes)
+        for var_name in spec._used_variables:
+            names = spec._variable_names[var_name]
+            self._batched[var_name] = "env" not in names
+            if envs is None and len(names & env_names) > 0:
+                raise ValueError(
+                    f"Variable {var_name} depends on the environment, the sub-environments must be given"
+                )
+
+        # expressions which depend only on constants are broadcast to the batch
+        batch_names = set(["state", "action", "env"]) | set(spec._used_variables)
+        self._broadcast = set(
+            [
+                var_name
+                for var_name in spec._used_variables
+                if len(spec._variable_names[var_name] & batch_names) == 0
+            ]
+        )
+
+        self._namespace = {"np": np, **spec._constant_values}
+        self._env_constant_values = {}
+
+    def reset(self, indices: np.ndarray = None):
+        """
+        Evaluate the constants which depend on the environment for the given sub-environments,
+        to be called when their episodes begin.
+        """
+        if len(self._spec._env_constant_codes) == 0:
+            return
+
+        indices = range(len(self._envs)) if indices is None else indices
+        for const_name, code in self._spec._env_constant_codes.items():
+            values = self._env_constant_values.setdefault(
+                const_name, np.zeros(len(self._envs), dtype=np.float64)
+            )
+            for i in indices:
+                namespace = {
+                    "np": np,
+                    "env": self._envs[i],
+                    **self._spec._constant_values,
+                }
+                namespace.update(
+                    {k: v[i] for k, v in self._env_constant_values.items()}
+                )
+                values[i] = float(eval(code, namespace))
+
+    def __call__(
+        self,
+        states: np.ndarray,
+        actions: np.ndarray,
+        indices: np.ndarray = None,
+        env_values: Dict[str, np.ndarray] = None,
+    ) -> Dict[str, Any]:
+        """
+        Return the batch of extended states as a dict of arrays, one value per state.
+
+        :param states: the batch of states, with shape (batch_size, ...)
+        :param actions: the batch of actions, with shape (batch_size, ...)
+        :param indices: the sub-environments of the states, by default one state per sub-environment
+        :param env_values: the values of the variables referring to `env`, as reported by `EnvVariablesWrapper`,
+                           by default evaluated on the sub-environments
+        """
+        if len(self._env_constant_values) < len(self._spec._env_constant_codes):
+            self.reset()
+
+        batch_size = len(states)
+        states = np.asarray(states)
+        actions = np.asarray(actions)
+        indices = np.arange(batch_size) if indices is None else np.asarray(indices)
+
+        context = dict(self._spec._constant_values)
+        for const_name, values in self._env_constant_values.items():
+            context[const_name] = values[indices]
+        context["state"] = states
+        context["action"] = actions
+
+        namespace = self._namespace
+        namespace.update(context)
+        namespace["state"] = states.T
+        namespace["action"] = actions.T
+
+        for var_name in self._spec._used_variables:
+            if env_values is not None and var_name in env_values:
+                values = np.asarray(env_values[var_name], dtype=np.float64)
+                context[var_name] = values
+                namespace[var_name] = values
+                continue
+
+            values = None
+            if self._batched[var_name]:
+                values = self._eval_batch(var_name, batch_size)
+
+            if values is None:
+                # the expression does not support batches, e.g. python builtins or reductions
+                self._batched[var_name] = False
+                values = self._eval_elementwise(var_name, context, indices)
+
+            context[var_name] = values
+            namespace[var_name] = values
+
+        return context
+
+    def _eval_batch(self, var_name: str, batch_size: int) -> np.ndarray:
+        try:
+            values = np.asarray(
+                eval(self._spec._variable_codes[var_name], self._namespace),
+                dtype=np.float64,
+            )
+        except Exception:
+            return None
+
+        if values.ndim == 0 and var_name in self._broadcast:
+            return np.full(batch_size, values, dtype=np.float64)
+        if values.shape != (batch_size,):
+            return None
+        return values
+
+    def _eval_elementwise(
+        self, var_name: str, context: Dict[str, Any], indices: np.ndarray
+    ) -> np.ndarray:
+        code = self._spec._variable_codes[var_name]
+        namespace = {"np": np, **self._spec._constant_values}
+        batch_names = [k for k in context if k not in self._spec._constant_values]
+
+        values = np.zeros(len(indices), dtype=np.float64)
+        for j, i in enumerate(indices):
+            for k in batch_names:
+                namespace[k] = context[k][j]
+            if self._envs is not None:
+                namespace["env"] = self._envs[i]
+            values[j] = float(eval(code, namespace))
+        return values
+
+
+def env_variables(spec: RewardSpec) -> List[str]:
+    """
+    Return the used variables which refer to `env` and the variables they depend on,
+    in the order of `spec.used_variables`.
+    """
+    names = set(
+        [
+            var_name
+            for var_name in spec._used_variables
+            if "env" in spec._variable_names[var_name]
+        ]
+    )
+    # the dependencies come before the variables using them
+    for var_name in reversed(spec._used_variables):
+        if var_name in names:
+            names |= spec._variable_names[var_name] & set(spec._used_variables)
+    return [var_name for var_name in spec._used_variables if var_name in names]
+
+
+class EnvVariablesWrapper(gymnasium.Wrapper):
+    """
+    Evaluates the variables of a reward specification which refer to `env` on a sub-environment
+    of a vector environment, and reports them in `info[key]` at every reset and step.
+
+    Vector environments autoreset the sub-environments within the step which ends their episodes,
+    so the values of the terminal states must be taken before the reset, and are reported
+    by the vector environment in `info["final_info"]`.
+
+    :param env: the sub-environment
+    :param spec: the reward specification
+    :param key: the key of the values in the info
+    """
+
+    def __init__(
+        self, env: gymnasium.Env, spec: RewardSpec, key: str = "env_variables"
+    ):
+        super(EnvVariablesWrapper, self).__init__(env)
+        self._spec = spec
+        self._key = key
+        self._variables = env_variables(spec)
+        self._reported = [
+            var_name
+            for var_name in self._variables
+            if "env" in spec._variable_names[var_name]
+        ]
+        self._context = SpecContext(spec)
+
+    def _values(self, state: Any, action: Any) -> Dict[str, float]:
+        namespace = self._context.namespace
+        namespace["env"] = self.env
+        namespace["state"] = state
+        namespace["action"] = action
+        for var_name in self._variables:
+            namespace[var_name] = float(
+                eval(self._spec._variable_codes[var_name], namespace)
+            )
+        return {var_name: namespace[var_name] for var_name in self._reported}
+
+    def reset(self, **kwargs):
+        obs, info = self.env.reset(**kwargs)
+        resolve_constants(env=self.env, spec=self._spec, context=self._context)
+        action0 = np.zeros_like(self.action_space.sample())
+        info[self._key] = self._values(obs, action0)
+        return obs, info
+
+    def step(self, action):
+        obs, reward, terminated, truncated, info = self.env.step(action)
+        info[self._key] = self._values(obs, action)
+        return obs, reward, terminated, truncated, info
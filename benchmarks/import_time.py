@@ -0,0 +1,68 @@
+"""
+Benchmark the startup time of auto_shaping, measured in fresh interpreters.
+
+Each scenario runs in a new process and reports the median wall time over the repetitions,
+and the heavy dependencies that were imported.
+
+Usage:
+    python benchmarks/import_time.py [--repeats 10]
+"""
+
+import argparse
+import json
+import pathlib
+import statistics
+import subprocess
+import sys
+
+root = pathlib.Path(__file__).parent.parent
+
+heavy_modules = ["gymnasium", "lark", "yaml", "rtamt", "numpy"]
+
+scenarios = {
+    "import": "import auto_shaping",
+    "import RewardSpec": "from auto_shaping import RewardSpec",
+    "wrap HPRS": "import auto_shaping\n"
+    "env = auto_shaping.wrap('CartPole-v1', reward='HPRS')\n"
+    "env.reset(seed=0)",
+    "wrap TLTL": "import auto_shaping\n"
+    "env = auto_shaping.wrap('CartPole-v1', reward='TLTL')\n"
+    "env.reset(seed=0)",
+}
+
+template = """
+import json, sys, time
+t0 = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - t0
+print(json.dumps({{"time": elapsed, "modules": [m for m in {modules!r} if m in sys.modules]}}))
+"""
+
+
+def run_scenario(code: str) -> dict:
+    script = template.format(code=code, modules=heavy_modules)
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=root,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeats", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'scenario':<20} {'median (ms)':>12}  imported")
+    for name, code in scenarios.items():
+        results = [run_scenario(code) for _ in range(args.repeats)]
+        median = statistics.median([r["time"] for r in results]) * 1000
+        modules = ", ".join(results[-1]["modules"]) or "-"
+        print(f"{name:<20} {median:>12.1f}  {modules}")
+
+
+if __name__ == "__main__":
+    main()
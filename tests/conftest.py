@@ -0,0 +1,10 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def spec_cache_dir(tmp_path, monkeypatch):
+    """
+    Cache the compiled specifications loaded by the tests in a temporary directory,
+    instead of the cache of the user.
+    """
+    monkeypatch.setenv("AUTO_SHAPING_CACHE_DIR", str(tmp_path / "auto_shaping"))
@@ -51,3 +51,102 @@ class TestBHNR(unittest.TestCase):
             )
 
         env.close()
+
+    def test_online_engine(self):
+        """
+        Check the online engine against the offline monitor over the same window.
+        """
+        import gymnasium
+        import numpy as np
+        from auto_shaping.utils.robustness import monitor_requirements
+
+        for window_len in [1, 2, 10, 300]:
+            env = gymnasium.make("CartPole-v1", render_mode=None)
+            specs, constants, variables = get_cartpole_example2_spec()
+            env = BHNRWrapper(
+                env,
+                specs=specs,
+                variables=variables,
+                constants=constants,
+                window_len=window_len,
+                engine="online",
+            )
+
+            obs, info = env.reset(seed=0)
+            env.action_space.seed(0)
+            # only the last sample is collected by the wrapper, the window is kept here
+            samples = [{var: env._episode[var][-1] for var in env._variables}]
+            done = False
+            while not done:
+                obs, reward, done, truncated, info = env.step(env.action_space.sample())
+                self.assertEqual(len(env._episode["time"]), 1)
+                samples.append({var: env._episode[var][-1] for var in env._variables})
+
+                window = samples[-window_len:]
+                episode = {
+                    var: [sample[var] for sample in window] for var in env._variables
+                }
+                episode["time"] = [float(t) for t in range(len(window))]
+                # rtamt needs at least 2 steps, the window of 1 step is monitored natively
+                expected = monitor_requirements(
+                    env._reqs,
+                    env._variables,
+                    episode,
+                    engine="rtamt" if len(window) > 1 else "native",
+                )
+                self.assertTrue(
+                    np.isclose(reward, expected),
+                    f"window {window_len}: online {reward} != offline {expected}",
+                )
+
+            env.close()
+
+    def _window_trace(self):
+        from auto_shaping import RewardSpec, Variable
+
+        spec = RewardSpec(
+            specs=[
+                'ensure abs "x" <= 1.5',
+                'achieve "x" > 1.0',
+                'conquer "x" < 1.0',
+            ],
+            variables=[Variable(name="x", fn="state[0]", min=-3.0, max=3.0)],
+        )
+        trace = [0.5, 1.2, -0.3, 0.8, 2.0, 0.1]
+        return spec, trace
+
+    def test_online_window_reference(self):
+        """
+        Check the online engine against the standard semantics at the first sample of a window of 3 steps,
+        computed by hand: always is the min over the window, eventually the max, eventually always the max
+        over the suffix minima, and the conjunction the min over the requirements.
+        """
+        import numpy as np
+        from auto_shaping.utils.online_monitor import OnlineRequirementsMonitor
+
+        spec, trace = self._window_trace()
+        # robustness of the predicates:
+        #   1.5 - |x| = [1.0, 0.3, 1.2, 0.7, -0.5, 1.4]
+        #   x - 1.0   = [-0.5, 0.2, -1.3, -0.2, 1.0, -0.9]
+        #   1.0 - x   = [0.5, -0.2, 1.3, 0.2, -1.0, 0.9]
+        expected_reqs = [
+            [1.0, -0.5, 0.5],
+            [0.3, 0.2, -0.2],
+            [0.3, 0.2, 1.3],
+            [0.3, 0.2, 0.2],
+            [-0.5, 1.0, -1.0],
+            [-0.5, 1.0, 0.9],
+        ]
+        expected = [-0.5, -0.2, 0.2, 0.2, -1.0, -0.5]
+
+        monitors = [
+            OnlineRequirementsMonitor([req], window_len=3) for req in spec.specs
+        ]
+        monitor = OnlineRequirementsMonitor(list(spec.specs), window_len=3)
+        for t, x in enumerate(trace):
+            monitor.update({"x": x})
+            for req_monitor, expected_rho in zip(monitors, expected_reqs[t]):
+                req_monitor.update({"x": x})
+                self.assertTrue(np.isclose(req_monitor.robustness, expected_rho), t)
+            self.assertTrue(np.isclose(monitor.robustness, expected[t]), t)
+            self.assertEqual(monitor.n_samples, t + 1)
@@ -0,0 +1,107 @@
+import pathlib
+import tempfile
+import unittest
+
+import gymnasium
+import numpy as np
+
+from auto_shaping import HPRSWrapper, TLTLWrapper
+from auto_shaping.utils.episode_recorder import (
+    EpisodeRecorder,
+    EpisodeStore,
+    enable_recording,
+)
+from tests.utility_functions import get_cartpole_example1_spec
+
+
+class TestEpisodeRecorder(unittest.TestCase):
+    def test_segments(self):
+        """
+        Check that episodes longer than the rest of a segment are moved whole to the next one,
+        and that a store is extended by a new recorder.
+        """
+        rng = np.random.default_rng(0)
+        lengths = [3, 5, 9, 1, 4]
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            recorder = EpisodeRecorder(
+                tmpdir, names=["x", "y"], action_size=2, segment_len=4, flush_every=2
+            )
+            episodes = []
+            for length in lengths:
+                values = rng.normal(size=(length, 2))
+                actions = rng.normal(size=(length, 2))
+                for t in range(length):
+                    recorder.append(values[t], actions[t], terminated=t == length - 1)
+                recorder.end_episode()
+                episodes.append((values, actions))
+            recorder.close()
+
+            # appended by a new recorder
+            recorder = EpisodeRecorder(
+                tmpdir, names=["x", "y"], action_size=2, segment_len=4
+            )
+            recorder.append([1.0, 2.0], [3.0, 4.0], truncated=True)
+            recorder.close()
+            episodes.append((np.array([[1.0, 2.0]]), np.array([[3.0, 4.0]])))
+
+            with self.assertRaises(ValueError):
+                EpisodeRecorder(tmpdir, names=["x", "z"], action_size=2)
+
+            store = EpisodeStore(tmpdir)
+            self.assertEqual(len(store), len(episodes))
+            self.assertEqual(list(store.lengths), lengths + [1])
+            for episode, (values, actions) in zip(store, episodes):
+                self.assertTrue(np.array_equal(episode["x"], values[:, 0]))
+                self.assertTrue(np.array_equal(episode["y"], values[:, 1]))
+                self.assertTrue(np.array_equal(episode["action"], actions))
+                # views of the memory-mapped segment
+                self.assertTrue(isinstance(episode["x"].base, np.memmap))
+                self.assertFalse(episode["x"].flags.writeable)
+
+            self.assertEqual(list(store[-1]["truncated"]), [1.0])
+            self.assertEqual(list(store[0]["terminated"]), [0.0, 0.0, 1.0])
+
+    def test_wrappers(self):
+        specs, constants, variables = get_cartpole_example1_spec()
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            env = gymnasium.make("CartPole-v1")
+            env = HPRSWrapper(env, specs=specs, variables=variables)
+            env = TLTLWrapper(env, specs=specs, variables=variables)
+            recorder = enable_recording(env, pathlib.Path(tmpdir) / "tltl")
+            self.assertTrue(env.recorder is recorder)
+            enable_recording(env.env, pathlib.Path(tmpdir) / "hprs")
+
+            actions = []
+            for seed in range(2):
+                env.reset(seed=seed)
+                env.action_space.seed(seed)
+                done, truncated = False, False
+                while not (done or truncated):
+                    action = env.action_space.sample()
+                    obs, reward, done, truncated, info = env.step(action)
+                    actions.append(action)
+                tltl_episode = {k: np.array(v) for k, v in env._episode.items()}
+                ext_state = env.env._ext_state.copy()
+            env.close()
+
+            store = EpisodeStore(pathlib.Path(tmpdir) / "tltl")
+            self.assertEqual(len(store), 2)
+            self.assertEqual(store.columns[: len(env._names)], env._names)
+
+            # the last episode is the collected one, the first step with the null action
+            episode = store[-1]
+            for name, trace in tltl_episode.items():
+                self.assertTrue(np.array_equal(episode[name], trace))
+            self.assertTrue(
+                np.array_equal(
+                    episode["action"][1:, 0], actions[-len(episode["x"]) + 1 :]
+                )
+            )
+            self.assertEqual(episode["terminated"][-1] + episode["truncated"][-1], 1.0)
+
+            store = EpisodeStore(pathlib.Path(tmpdir) / "hprs")
+            self.assertEqual(len(store), 2)
+            for name in ext_state.layout:
+                self.assertEqual(store[-1][name][-1], ext_state[name])
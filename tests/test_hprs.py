@@ -4,8 +4,9 @@ import unittest
 import gymnasium
 import numpy as np
 
-from auto_shaping.hprs_shaping import HPRSWrapper
-from auto_shaping.utils.utils import extend_state
+from auto_shaping.hprs_shaping import HPRSWrapper, HPRSVectorWrapper
+from auto_shaping.spec.reward_spec import Variable
+from auto_shaping.utils.utils import extend_state, clip_and_norm
 from tests.utility_functions import (
     get_cartpole_example1_spec,
     get_cartpole_example2_spec,
@@ -250,3 +251,207 @@ class TestHPRS(unittest.TestCase):
             )
 
         env.close()
+
+    def test_potentials_carried_forward(self):
+        """
+        Check the rewards against the potentials recomputed for both states at every step.
+        """
+        env = gymnasium.make("CartPole-v1", render_mode=None)
+        specs, constants, variables = get_cartpole_example1_spec()
+        env = HPRSWrapper(env, specs=specs, variables=variables, gamma=0.99)
+
+        cmp_lambdas = {
+            "<": lambda x, y: x < y,
+            "<=": lambda x, y: x <= y,
+            ">": lambda x, y: x > y,
+            ">=": lambda x, y: x >= y,
+        }
+        fns = {"abs": abs, None: lambda x: x}
+
+        def score(state, req):
+            (fn, var), op, threshold = req._predicate.to_tuple()
+            val = fns[fn](state[var])
+            minv, maxv = env._spec.variables[var].min, env._spec.variables[var].max
+            if op in [">", ">="]:
+                return clip_and_norm(val, minv, threshold)
+            return 1.0 - clip_and_norm(val, threshold, maxv)
+
+        def sat(state, req):
+            (fn, var), op, threshold = req._predicate.to_tuple()
+            return float(cmp_lambdas[op](fns[fn](state[var]), threshold))
+
+        def potentials(state):
+            safety, safety_weight = 0.0, 1.0
+            for req in env._safety_specs:
+                safety += sat(state, req)
+                safety_weight *= sat(state, req)
+            target, target_weight = 0.0, 1.0
+            for req in env._target_spec:
+                target += safety_weight * score(state, req)
+                target_weight *= score(state, req)
+            comfort = 0.0
+            for req in env._comfort_specs:
+                comfort += safety_weight * target_weight * score(state, req)
+            return safety + target + comfort
+
+        obs, info = env.reset(seed=0)
+        env.action_space.seed(0)
+        done, truncated = False, False
+        while not (done or truncated):
+            state = env._obs
+            obs, reward, done, truncated, info = env.step(env.action_space.sample())
+            next_state = env._obs
+
+            expected = env._reward(state, None, next_state, done, info)
+            if not done:
+                expected += 0.99 * potentials(next_state) - potentials(state)
+            self.assertTrue(
+                np.isclose(reward, expected), f"expected {expected}, got {reward}"
+            )
+
+        env.close()
+
+    def test_vector_wrapper(self):
+        """
+        Check the batched rewards match the ones of HPRSWrapper on each sub-environment,
+        across the autoreset of the episodes.
+        """
+        n_envs, gamma = 4, 0.99
+        specs, constants, variables = get_cartpole_example2_spec()
+        specs = specs + ['encourage "x_ratio" <= 0.1', 'encourage "max_speed" <= 0.5']
+        variables = variables + [
+            # refers to env, evaluated on each sub-environment
+            Variable(
+                name="x_ratio",
+                fn="abs(x) / env.unwrapped.x_threshold",
+                min=0.0,
+                max=1.0,
+            ),
+            # not supported on batches, evaluated state by state
+            Variable(
+                name="max_speed", fn="max(abs(x_dot), abs(theta_dot))", min=0.0, max=3.0
+            ),
+        ]
+
+        venv = gymnasium.vector.SyncVectorEnv(
+            [lambda: gymnasium.make("CartPole-v1") for _ in range(n_envs)]
+        )
+        venv = HPRSVectorWrapper(
+            venv, specs=specs, variables=variables, constants=constants, gamma=gamma
+        )
+        envs = [
+            HPRSWrapper(
+                gymnasium.make("CartPole-v1"),
+                specs=specs,
+                variables=variables,
+                constants=constants,
+                gamma=gamma,
+            )
+            for _ in range(n_envs)
+        ]
+
+        venv.reset(seed=0)
+        for i, env in enumerate(envs):
+            env.reset(seed=i)
+
+        rng = np.random.default_rng(0)
+        n_dones = 0
+        for _ in range(200):
+            actions = rng.integers(0, 2, size=n_envs)
+            _, rewards, terminateds, truncateds, _ = venv.step(actions)
+            for i, env in enumerate(envs):
+                _, reward, done, truncated, _ = env.step(actions[i])
+                self.assertAlmostEqual(reward, rewards[i], places=10)
+                self.assertEqual(done, terminateds[i])
+                if done or truncated:
+                    env.reset()
+                    n_dones += 1
+
+        self.assertGreater(n_dones, 0, "expected at least one autoreset")
+        self.assertTrue(venv._extractor._batched["dist"])
+        self.assertFalse(venv._extractor._batched["max_speed"])
+        venv.close()
+
+    def test_vector_wrapper_env_state(self):
+        """
+        Check the batched rewards against HPRSWrapper when a variable reads the state of env,
+        which the autoreset changes at the end of the episodes, on terminal and truncated steps.
+        """
+        n_envs, gamma = 4, 0.99
+        specs = ['achieve abs "theta" >= 0.2', 'ensure abs "x" <= 2.4']
+        variables = [
+            Variable(name="x", fn="state[0]", min=-2.4, max=2.4),
+            Variable(
+                name="theta", fn="float(env.unwrapped.state[2])", min=-0.2, max=0.2
+            ),
+        ]
+
+        def make_env():
+            return gymnasium.make("CartPole-v1", max_episode_steps=15)
+
+        venv = HPRSVectorWrapper(
+            gymnasium.vector.SyncVectorEnv([make_env for _ in range(n_envs)]),
+            specs=specs,
+            variables=variables,
+            gamma=gamma,
+        )
+        envs = [
+            HPRSWrapper(make_env(), specs=specs, variables=variables, gamma=gamma)
+            for _ in range(n_envs)
+        ]
+
+        venv.reset(seed=0)
+        for i, env in enumerate(envs):
+            env.reset(seed=i)
+
+        rng = np.random.default_rng(0)
+        n_terminated, n_truncated = 0, 0
+        for _ in range(200):
+            actions = rng.integers(0, 2, size=n_envs)
+            _, rewards, terminateds, truncateds, _ = venv.step(actions)
+            for i, env in enumerate(envs):
+                _, reward, done, truncated, _ = env.step(actions[i])
+                self.assertAlmostEqual(reward, rewards[i], places=10)
+                self.assertEqual(done, terminateds[i])
+                self.assertEqual(truncated, truncateds[i])
+                if done or truncated:
+                    env.reset()
+                    n_terminated += int(done)
+                    n_truncated += int(truncated)
+
+        self.assertGreater(n_terminated, 0, "expected at least one termination")
+        self.assertGreater(n_truncated, 0, "expected at least one truncation")
+        venv.close()
+
+    def test_stacked_extraction_cache(self):
+        """
+        Check the variables are evaluated once per step, also when stacked on another wrapper
+        with the same specification, and the rewards are unchanged.
+        """
+        from unittest import mock
+        from auto_shaping import TLTLWrapper
+        import auto_shaping.utils.utils as utils
+
+        specs, constants, variables = get_cartpole_example2_spec()
+        kwargs = dict(specs=specs, variables=variables, constants=constants)
+
+        def rollout(env):
+            rewards = []
+            env.reset(seed=0)
+            with mock.patch.object(
+                utils, "extend_state", wraps=utils.extend_state
+            ) as mock_fn:
+                with mock.patch("auto_shaping.hprs_shaping.extend_state", new=mock_fn):
+                    for t in range(1, 11):
+                        obs, reward, done, truncated, info = env.step(t % 2)
+                        rewards.append(reward)
+                        self.assertEqual(mock_fn.call_count, t)
+            return rewards
+
+        env = HPRSWrapper(gymnasium.make("CartPole-v1"), gamma=0.99, **kwargs)
+        rewards = rollout(env)
+
+        env = TLTLWrapper(gymnasium.make("CartPole-v1"), **kwargs)
+        env = HPRSWrapper(env, gamma=0.99, **kwargs)
+        self.assertTrue(env.extraction_cache is env.env.extraction_cache)
+        self.assertEqual(rollout(env), rewards)
@@ -0,0 +1,118 @@
+import unittest
+
+import gymnasium
+import numpy as np
+
+import auto_shaping
+from auto_shaping import MultiRewardWrapper, RewardSpec
+
+
+class TestMultiReward(unittest.TestCase):
+    def test_same_rewards(self):
+        """
+        Check the rewards computed from one trace against the ones of the wrappers of each reward.
+        """
+        import pathlib
+
+        configs = pathlib.Path(__file__).parent.parent / "configs"
+        spec = RewardSpec.from_yaml(configs / "CartPole-v1.yaml")
+        rewards = ["HPRS", "TLTL", "PAM", "RPR", "BHNR"]
+        reward_kwargs = {
+            "HPRS": {"gamma": 0.99},
+            "BHNR": {"engine": "online", "window_len": 5},
+        }
+
+        env = MultiRewardWrapper(
+            gymnasium.make("CartPole-v1"),
+            rewards=rewards,
+            train_reward="PAM",
+            reward_kwargs=reward_kwargs,
+            spec=spec,
+        )
+        envs = {
+            reward: auto_shaping.__entry_points__[reward](
+                gymnasium.make("CartPole-v1"),
+                spec=spec,
+                **reward_kwargs.get(reward, {})
+            )
+            for reward in rewards
+        }
+
+        for seed in range(3):
+            env.reset(seed=seed)
+            for single_env in envs.values():
+                single_env.reset(seed=seed)
+
+            rng = np.random.default_rng(seed)
+            done, truncated = False, False
+            while not (done or truncated):
+                action = int(rng.integers(2))
+                obs, reward, done, truncated, info = env.step(action)
+
+                self.assertEqual(set(info["rewards"]), set(rewards))
+                self.assertEqual(reward, info["rewards"]["PAM"])
+                for name, single_env in envs.items():
+                    _, expected, _, _, _ = single_env.step(action)
+                    self.assertEqual(info["rewards"][name], expected, name)
+
+    def test_online_bhnr(self):
+        """
+        Check the online BHNR reward when the shared trace keeps only the last sample.
+        """
+        import pathlib
+
+        configs = pathlib.Path(__file__).parent.parent / "configs"
+        spec = RewardSpec.from_yaml(configs / "CartPole-v1.yaml")
+        reward_kwargs = {"BHNR": {"engine": "online", "window_len": 5}}
+
+        env = MultiRewardWrapper(
+            gymnasium.make("CartPole-v1"),
+            rewards=["HPRS", "BHNR"],
+            reward_kwargs=reward_kwargs,
+            spec=spec,
+        )
+        self.assertEqual(env._window_len, 1)
+        single_env = auto_shaping.__entry_points__["BHNR"](
+            gymnasium.make("CartPole-v1"), spec=spec, **reward_kwargs["BHNR"]
+        )
+
+        env.reset(seed=0)
+        single_env.reset(seed=0)
+        rng = np.random.default_rng(0)
+        done, truncated = False, False
+        while not (done or truncated):
+            action = int(rng.integers(2))
+            _, _, done, truncated, info = env.step(action)
+            _, expected, _, _, _ = single_env.step(action)
+            self.assertNotEqual(expected, 0.0)
+            self.assertEqual(info["rewards"]["BHNR"], expected)
+
+    def test_window_len(self):
+        """
+        Check that the whole episode is collected only if a reward needs it.
+        """
+        import pathlib
+
+        configs = pathlib.Path(__file__).parent.parent / "configs"
+        spec = RewardSpec.from_yaml(configs / "CartPole-v1.yaml")
+
+        env = MultiRewardWrapper(
+            gymnasium.make("CartPole-v1"),
+            rewards=["HPRS", "BHNR"],
+            reward_kwargs={"BHNR": {"window_len": 5}},
+            spec=spec,
+        )
+        self.assertEqual(env._window_len, 5)
+
+        env = MultiRewardWrapper(
+            gymnasium.make("CartPole-v1"), rewards=["HPRS", "TLTL"], spec=spec
+        )
+        self.assertEqual(env._window_len, None)
+
+        with self.assertRaises(AssertionError):
+            MultiRewardWrapper(
+                gymnasium.make("CartPole-v1"),
+                rewards=["HPRS"],
+                train_reward="PAM",
+                spec=spec,
+            )
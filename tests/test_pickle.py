@@ -0,0 +1,126 @@
+import pickle
+import unittest
+
+import gymnasium
+import numpy as np
+
+import auto_shaping
+from auto_shaping import RewardSpec, BHNRWrapper
+from tests.utility_functions import get_cartpole_example2_spec
+
+
+def make_env(reward: str) -> gymnasium.Env:
+    return auto_shaping.wrap("CartPole-v1", reward=reward)
+
+
+class TestPickle(unittest.TestCase):
+    def test_reward_spec(self):
+        specs, constants, variables = get_cartpole_example2_spec()
+        spec = RewardSpec(specs=specs, variables=variables, constants=constants)
+
+        data = pickle.dumps(spec)
+        spec2 = pickle.loads(data)
+
+        self.assertEqual([str(req) for req in spec2.specs], specs)
+        self.assertEqual(spec2.variables, spec.variables)
+        self.assertEqual(spec2.constants, spec.constants)
+        self.assertEqual(spec2.used_variables, spec.used_variables)
+        self.assertEqual(
+            [req._predicate.to_tuple() for req in spec2.specs],
+            [req._predicate.to_tuple() for req in spec.specs],
+        )
+        # pickled as its definition, without compiled code and namespace
+        self.assertNotIn(b"numpy", data)
+
+    def test_constants_not_shared(self):
+        """
+        The constants of a specification are not visible to the others.
+        """
+        RewardSpec(
+            specs=['ensure "x" < "x_limit"'],
+            variables=[auto_shaping.Variable(name="x", fn="state[0]", min=-1, max=1)],
+            constants=[auto_shaping.Constant(name="x_limit", value=0.5)],
+        )
+        with self.assertRaises(ValueError):
+            RewardSpec(
+                specs=['ensure "x" < "x_limit"'],
+                variables=[
+                    auto_shaping.Variable(name="x", fn="state[0]", min=-1, max=1)
+                ],
+            )
+
+    def test_wrappers(self):
+        """
+        Check wrappers loaded from pickle continue the episode with the same rewards,
+        and can be recreated from their spec.
+        """
+        specs, constants, variables = get_cartpole_example2_spec()
+        bhnr = lambda: BHNRWrapper(
+            gymnasium.make("CartPole-v1"),
+            specs=specs,
+            variables=variables,
+            constants=constants,
+            engine="online",
+        )
+        factories = {
+            reward: (lambda reward=reward: make_env(reward))
+            for reward in ["TLTL", "HPRS", "PAM", "RPR"]
+        }
+        factories["BHNR"] = bhnr
+
+        for reward, factory in factories.items():
+            env = factory()
+            env.reset(seed=0)
+            for t in range(5):
+                env.step(t % 2)
+
+            env2 = pickle.loads(pickle.dumps(env))
+            for t in range(5):
+                obs, reward1, done, truncated, info = env.step(t % 2)
+                obs2, reward2, done2, truncated2, info2 = env2.step(t % 2)
+                self.assertTrue(np.array_equal(obs, obs2), reward)
+                self.assertEqual(reward1, reward2, reward)
+
+            env3 = gymnasium.make(env.spec)
+            self.assertEqual(type(env3), type(env))
+            self.assertEqual(env3._spec.specs[0]._spec, env._spec.specs[0]._spec)
+
+    def test_deepcopy(self):
+        """
+        Check a deep copy of a wrapped env evaluates the variables on its own env,
+        sharing only the reward specification.
+        """
+        import copy
+
+        from auto_shaping import TLTLWrapper, Variable
+
+        env = TLTLWrapper(
+            gymnasium.make("CartPole-v1"),
+            specs=['ensure abs "cart_x" <= 2.4'],
+            variables=[
+                Variable(name="cart_x", fn="env.unwrapped.state[0]", min=-2.4, max=2.4)
+            ],
+        )
+        env.reset(seed=0)
+        env2 = copy.deepcopy(env)
+        self.assertIs(env2._extractor_fn._env, env2.env)
+        self.assertIs(env2._extractor_fn._spec, env._extractor_fn._spec)
+
+        for t in range(5):
+            env.step(0)
+            env2.step(1)
+            self.assertEqual(env._episode["cart_x"][-1], env.unwrapped.state[0])
+            self.assertEqual(env2._episode["cart_x"][-1], env2.unwrapped.state[0])
+
+    def test_async_vector_env(self):
+        """
+        Check wrapped envs run in spawned worker processes.
+        """
+        venv = gymnasium.vector.AsyncVectorEnv(
+            [lambda: make_env("HPRS"), lambda: make_env("TLTL")], context="spawn"
+        )
+        venv.reset(seed=0)
+        for _ in range(3):
+            obs, rewards, terminated, truncated, infos = venv.step(np.array([0, 1]))
+        self.assertEqual(rewards.shape, (2,))
+        venv.close()
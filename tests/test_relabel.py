@@ -0,0 +1,206 @@
+import importlib.util
+import pathlib
+import unittest
+
+import gymnasium
+import numpy as np
+
+from auto_shaping import HPRSWrapper, RewardSpec
+from auto_shaping.hprs_shaping import SparseSuccessRewardWrapper
+from auto_shaping.relabel import RewardRelabeler, relabel_replay_buffer
+
+configs = pathlib.Path(__file__).parent.parent / "configs"
+
+
+def collect_transitions(env, n_episodes, seed=0):
+    transitions = {
+        k: []
+        for k in ["obs", "action", "next_obs", "terminated", "truncated", "reward"]
+    }
+    rng = np.random.default_rng(seed)
+    for episode in range(n_episodes):
+        obs, _ = env.reset(seed=seed + episode)
+        done, truncated = False, False
+        while not (done or truncated):
+            action = int(rng.integers(2))
+            next_obs, reward, done, truncated, _ = env.step(action)
+            for k, v in zip(
+                transitions, [obs, action, next_obs, done, truncated, reward]
+            ):
+                transitions[k].append(v)
+            obs = next_obs
+    return {k: np.array(v) for k, v in transitions.items()}
+
+
+class _ReplayBuffer:
+    """
+    Stand-in of the stable-baselines3 `ReplayBuffer` of one environment with a discrete action,
+    with the same arrays of shape (buffer_size, n_envs, ...) and the same `add`.
+    """
+
+    def __init__(self, buffer_size, observation_space, optimize_memory_usage=False):
+        self.buffer_size = buffer_size
+        self.n_envs = 1
+        self.pos = 0
+        self.full = False
+        self.optimize_memory_usage = optimize_memory_usage
+        # as in stable-baselines3, timeouts are not handled when optimizing the memory
+        self.handle_timeout_termination = not optimize_memory_usage
+
+        shape = (buffer_size, self.n_envs)
+        self.observations = np.zeros(
+            shape + observation_space.shape, dtype=observation_space.dtype
+        )
+        self.next_observations = None
+        if not optimize_memory_usage:
+            self.next_observations = np.zeros_like(self.observations)
+        self.actions = np.zeros(shape + (1,), dtype=np.int64)
+        self.rewards = np.zeros(shape, dtype=np.float32)
+        self.dones = np.zeros(shape, dtype=np.float32)
+        self.timeouts = np.zeros(shape, dtype=np.float32)
+
+    def add(self, obs, next_obs, action, reward, done, infos):
+        self.observations[self.pos] = np.array(obs)
+        if self.optimize_memory_usage:
+            self.observations[(self.pos + 1) % self.buffer_size] = np.array(next_obs)
+        else:
+            self.next_observations[self.pos] = np.array(next_obs)
+        self.actions[self.pos] = np.array(action).reshape(self.n_envs, 1)
+        self.rewards[self.pos] = np.array(reward)
+        self.dones[self.pos] = np.array(done)
+        if self.handle_timeout_termination:
+            self.timeouts[self.pos] = np.array(
+                [info.get("TimeLimit.truncated", False) for info in infos]
+            )
+
+        self.pos += 1
+        if self.pos == self.buffer_size:
+            self.full = True
+            self.pos = 0
+
+
+class TestRelabel(unittest.TestCase):
+    def test_same_rewards(self):
+        """
+        Check the relabeled rewards against the ones of the wrappers, with a new gamma and threshold.
+        """
+        spec = RewardSpec.from_yaml(configs / "CartPole-v1.yaml")
+        new_spec = RewardSpec(
+            specs=[str(req) for req in spec.specs],
+            variables=list(spec.variables.values()),
+            constants=[
+                const._replace(value=0.01) if const.name == "x_tol" else const
+                for const in spec.constants.values()
+            ],
+        )
+
+        for reward, wrapper_kwargs in [
+            ("HPRS", {"gamma": 0.9}),
+            ("sparse", {}),
+        ]:
+            wrapper_cls = (
+                HPRSWrapper if reward == "HPRS" else SparseSuccessRewardWrapper
+            )
+            env = wrapper_cls(
+                gymnasium.make("CartPole-v1"), spec=new_spec, **wrapper_kwargs
+            )
+            transitions = collect_transitions(env, n_episodes=5)
+
+            # the action of the previous step of the same episode
+            episode_start = np.roll(
+                transitions["terminated"] | transitions["truncated"], 1
+            )
+            episode_start[0] = True
+            prev_actions = np.where(episode_start, 0, np.roll(transitions["action"], 1))
+
+            relabeler = RewardRelabeler(spec, reward=reward, **wrapper_kwargs)
+            self.assertFalse(
+                np.allclose(
+                    relabeler(
+                        transitions["obs"],
+                        transitions["action"],
+                        transitions["next_obs"],
+                        transitions["terminated"],
+                        prev_actions,
+                    ),
+                    transitions["reward"],
+                ),
+                "the relabeled spec should change the rewards",
+            )
+
+            relabeler = RewardRelabeler(new_spec, reward=reward, **wrapper_kwargs)
+            rewards = relabeler(
+                transitions["obs"],
+                transitions["action"],
+                transitions["next_obs"],
+                transitions["terminated"],
+                prev_actions,
+            )
+            self.assertTrue(np.allclose(rewards, transitions["reward"]), reward)
+
+    def _check_replay_buffer(self, make_buffer):
+        """
+        Fill the buffers returned by `make_buffer(buffer_size, env, optimize_memory_usage)`
+        past their size and check the relabeled rewards against the ones of the wrapper.
+        """
+        spec = RewardSpec.from_yaml(configs / "CartPole-v1.yaml")
+        env = HPRSWrapper(gymnasium.make("CartPole-v1"), spec=spec, gamma=0.99)
+        transitions = collect_transitions(env, n_episodes=10)
+
+        # smaller than the transitions, so that the oldest ones are overwritten
+        buffer_size = 2 * len(transitions["obs"]) // 5
+        for optimize_memory_usage in [False, True]:
+            buffer = make_buffer(buffer_size, env, optimize_memory_usage)
+            for i in range(len(transitions["obs"])):
+                buffer.add(
+                    transitions["obs"][i],
+                    transitions["next_obs"][i],
+                    np.array([transitions["action"][i]]),
+                    np.array([0.0]),
+                    np.array(
+                        [transitions["terminated"][i] or transitions["truncated"][i]]
+                    ),
+                    [{"TimeLimit.truncated": bool(transitions["truncated"][i])}],
+                )
+
+            self.assertGreater(buffer.pos, 0)
+            rewards = relabel_replay_buffer(
+                buffer, spec, reward="HPRS", gamma=0.99, chunk_size=100
+            )
+            # the newest transitions, except the oldest one whose previous action is lost,
+            # or whose observation is overwritten by the newest next observation
+            expected = np.roll(transitions["reward"][-buffer_size:], buffer.pos)
+            valid = np.arange(buffer_size) != buffer.pos
+            if optimize_memory_usage:
+                # the next observations at the ends of the episodes are overwritten, the rewards are kept
+                ends = buffer.dones[:, 0] > 0
+                self.assertTrue(np.all(rewards[ends, 0] == 0.0))
+                valid &= ~ends
+            self.assertTrue(np.allclose(rewards[valid, 0], expected[valid]))
+
+    def test_replay_buffer(self):
+        self._check_replay_buffer(
+            lambda buffer_size, env, optimize_memory_usage: _ReplayBuffer(
+                buffer_size, env.observation_space, optimize_memory_usage
+            )
+        )
+
+    @unittest.skipUnless(
+        importlib.util.find_spec("stable_baselines3"), "requires stable-baselines3"
+    )
+    def test_sb3_replay_buffer(self):
+        from stable_baselines3.common.buffers import ReplayBuffer
+
+        self._check_replay_buffer(
+            lambda buffer_size, env, optimize_memory_usage: ReplayBuffer(
+                buffer_size,
+                env.observation_space,
+                env.action_space,
+                optimize_memory_usage=optimize_memory_usage,
+                handle_timeout_termination=not optimize_memory_usage,
+            )
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
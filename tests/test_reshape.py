@@ -0,0 +1,192 @@
+import pathlib
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import gymnasium
+import numpy as np
+
+from auto_shaping import MultiRewardWrapper, RewardSpec
+from auto_shaping.reshape import reshape
+from auto_shaping.utils.episode_recorder import (
+    EpisodeRecorder,
+    EpisodeStore,
+    enable_recording,
+)
+from tests.utility_functions import get_cartpole_example2_spec
+
+configs = pathlib.Path(__file__).parent.parent / "configs"
+
+
+class TestReshape(unittest.TestCase):
+    def _record(self, path, spec, rewards, reward_kwargs, n_episodes=3):
+        env = MultiRewardWrapper(
+            gymnasium.make("CartPole-v1"),
+            rewards=rewards,
+            reward_kwargs=reward_kwargs,
+            spec=spec,
+        )
+        enable_recording(env, path)
+
+        expected = []
+        for seed in range(n_episodes):
+            env.reset(seed=seed)
+            rng = np.random.default_rng(seed)
+            episode_rewards = [[0.0] * len(rewards)]
+            done, truncated = False, False
+            while not (done or truncated):
+                obs, reward, done, truncated, info = env.step(int(rng.integers(2)))
+                episode_rewards.append([info["rewards"][name] for name in rewards])
+            expected.append(np.array(episode_rewards))
+        env.close()
+        return expected
+
+    def test_same_rewards(self):
+        """
+        Check the rewards computed on the recorded episodes against the ones computed online.
+        """
+        spec = RewardSpec.from_yaml(configs / "CartPole-v1.yaml")
+        rewards = ["HPRS", "TLTL", "PAM", "RPR", "BHNR"]
+        reward_kwargs = {
+            "HPRS": {"gamma": 0.99},
+            "BHNR": {"engine": "online", "window_len": 5},
+        }
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmpdir = pathlib.Path(tmpdir)
+            expected = self._record(tmpdir / "episodes", spec, rewards, reward_kwargs)
+
+            for workers in [0, 2]:
+                out = reshape(
+                    tmpdir / "episodes",
+                    tmpdir / f"rewards-{workers}",
+                    spec=spec,
+                    rewards=rewards,
+                    reward_kwargs=reward_kwargs,
+                    workers=workers,
+                    chunk_size=2,
+                )
+                self.assertEqual(len(out), len(expected))
+                episodes = EpisodeStore(tmpdir / "episodes")
+                for episode, reshaped, expected_rewards in zip(episodes, out, expected):
+                    for j, name in enumerate(rewards):
+                        self.assertTrue(
+                            np.array_equal(reshaped[name], expected_rewards[:, j]), name
+                        )
+                    self.assertTrue(
+                        np.array_equal(reshaped["terminated"], episode["terminated"])
+                    )
+                    self.assertTrue(
+                        np.array_equal(reshaped["truncated"], episode["truncated"])
+                    )
+
+    def test_new_constants(self):
+        """
+        Check the rewards under a spec with another constant against the ones of a rollout of that spec,
+        where the derived variables depend on the constant.
+        """
+        specs, constants, variables = get_cartpole_example2_spec()
+        spec = RewardSpec(specs=specs, variables=variables, constants=constants)
+        new_spec = RewardSpec(
+            specs=specs,
+            variables=variables,
+            constants=[
+                const._replace(value=1.0) if const.name == "x_goal" else const
+                for const in constants
+            ],
+        )
+        rewards = ["HPRS", "TLTL", "PAM", "RPR", "BHNR"]
+        reward_kwargs = {
+            "HPRS": {"gamma": 0.99},
+            "BHNR": {"engine": "online", "window_len": 5},
+        }
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmpdir = pathlib.Path(tmpdir)
+            recorded = self._record(tmpdir / "episodes", spec, rewards, reward_kwargs)
+            expected = self._record(
+                tmpdir / "new-episodes", new_spec, rewards, reward_kwargs
+            )
+
+            out = reshape(
+                tmpdir / "episodes",
+                tmpdir / "rewards",
+                spec=new_spec,
+                rewards=rewards,
+                reward_kwargs=reward_kwargs,
+                workers=0,
+            )
+            self.assertEqual(len(out), len(expected))
+            for reshaped, recorded_rewards, expected_rewards in zip(
+                out, recorded, expected
+            ):
+                self.assertFalse(
+                    np.array_equal(recorded_rewards, expected_rewards),
+                    "the new constant should change the rewards",
+                )
+                for j, name in enumerate(rewards):
+                    self.assertTrue(
+                        np.array_equal(reshaped[name], expected_rewards[:, j]), name
+                    )
+
+    def test_cli(self):
+        spec = RewardSpec.from_yaml(configs / "CartPole-v1.yaml")
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmpdir = pathlib.Path(tmpdir)
+            expected = self._record(tmpdir / "episodes", spec, ["TLTL"], {}, 2)
+
+            subprocess.run(
+                [
+                    sys.executable,
+                    "-m",
+                    "auto_shaping.reshape",
+                    str(tmpdir / "episodes"),
+                    str(tmpdir / "rewards"),
+                    "--spec",
+                    str(configs / "CartPole-v1.yaml"),
+                    "--rewards",
+                    "TLTL",
+                    "--workers",
+                    "1",
+                ],
+                cwd=pathlib.Path(__file__).parent.parent,
+                capture_output=True,
+                check=True,
+            )
+
+            out = EpisodeStore(tmpdir / "rewards")
+            self.assertEqual(out.columns, ["TLTL", "terminated", "truncated"])
+            for reshaped, expected_rewards in zip(out, expected):
+                self.assertTrue(
+                    np.array_equal(reshaped["TLTL"], expected_rewards[:, 0])
+                )
+
+    def test_missing_variables(self):
+        """
+        Check that the variables depending on the state must be recorded.
+        """
+        spec = RewardSpec.from_yaml(configs / "CartPole-v1.yaml")
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmpdir = pathlib.Path(tmpdir)
+            recorder = EpisodeRecorder(
+                tmpdir / "episodes", names=["time"], action_size=1
+            )
+            recorder.append([1.0], [0.0])
+            recorder.append([2.0], [1.0], terminated=True)
+            recorder.close()
+
+            with self.assertRaises(ValueError):
+                reshape(
+                    tmpdir / "episodes",
+                    tmpdir / "rewards",
+                    spec=spec,
+                    rewards=["TLTL"],
+                    workers=0,
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()
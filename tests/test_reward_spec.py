@@ -34,3 +34,397 @@ class TestRewardSpec(unittest.TestCase):
         )
 
         self.assertTrue(True, "RewardSpec with negated constant failed to initialize")
+
+    def test_extend_state(self):
+        import gymnasium
+        import numpy as np
+        from auto_shaping import RewardSpec
+        from auto_shaping.utils.utils import extend_state
+        from tests.utility_functions import get_cartpole_example2_spec
+
+        env = gymnasium.make("CartPole-v1")
+        specs, constants, variables = get_cartpole_example2_spec()
+        spec = RewardSpec(specs=specs, variables=variables, constants=constants)
+
+        obs, info = env.reset(seed=0)
+        action = np.zeros_like(env.action_space.sample())
+        for _ in range(10):
+            ext_state = extend_state(env=env, state=obs, action=action, spec=spec)
+
+            x, theta = float(obs[0]), float(obs[2])
+            y = 100.0 + 1.0 * np.cos(theta)
+            dist = np.sqrt((x - 0.0) ** 2 + (y - (100.0 + 1.0)) ** 2)
+            self.assertTrue(np.isclose(ext_state["x"], x))
+            self.assertTrue(np.isclose(ext_state["y"], y))
+            self.assertTrue(np.isclose(ext_state["dist"], dist))
+            self.assertTrue(np.isclose(ext_state["y_goal"], 101.0))
+
+            action = env.action_space.sample()
+            obs, reward, done, truncated, info = env.step(action)
+
+    def test_extended_state(self):
+        import gymnasium
+        import numpy as np
+        from auto_shaping import RewardSpec
+        from auto_shaping.utils.utils import ExtendedState, StateExtractor
+        from tests.utility_functions import get_cartpole_example2_spec
+
+        env = gymnasium.make("CartPole-v1")
+        specs, constants, variables = get_cartpole_example2_spec()
+        spec = RewardSpec(specs=specs, variables=variables, constants=constants)
+
+        # constants first, then the used variables in evaluation order
+        layout = list(spec.state_layout)
+        self.assertEqual(layout, list(spec.constants) + spec.used_variables)
+        with self.assertRaises(TypeError):
+            spec.state_layout["x"] = 0
+
+        extractor = StateExtractor(env=env, spec=spec)
+        obs, info = env.reset(seed=0)
+        action = np.zeros_like(env.action_space.sample())
+        ext_state = extractor(obs, action)
+        array, first = ext_state.array, ext_state.copy()
+
+        obs, reward, done, truncated, info = env.step(1)
+        ext_state = extractor(obs, 1)
+
+        # the same array is overwritten, the copy keeps the previous values
+        self.assertTrue(isinstance(ext_state, ExtendedState))
+        self.assertTrue(ext_state.array is array)
+        self.assertNotEqual(first["x"], ext_state["x"])
+
+        # dict-like view of the values
+        self.assertEqual(ext_state["x"], float(obs[0]))
+        self.assertTrue(ext_state["state"] is obs)
+        self.assertEqual(ext_state["action"], 1)
+        self.assertEqual(set(ext_state), set(layout) | {"state", "action"})
+        self.assertEqual(dict(ext_state)["y_goal"], 101.0)
+        self.assertTrue(np.array_equal(ext_state.variable_values, array[4:]))
+        with self.assertRaises(KeyError):
+            ext_state["unknown"]
+
+    def test_constants_resolution(self):
+        import gymnasium
+        import numpy as np
+        from auto_shaping import RewardSpec, TLTLWrapper
+
+        specs = ['ensure abs "x" <= "x_limit"', 'achieve "x_ratio" <= 0.5']
+        variables = [
+            Variable(name="x", fn="state[0]", min=-2.4, max=2.4),
+            Variable(name="x_ratio", fn="abs(x) / x_threshold", min=0.0, max=1.0),
+        ]
+        constants = [
+            Constant(name="half_limit", value=1.2),
+            Constant(name="x_limit", value="2 * half_limit"),
+            Constant(name="x_threshold", value="float(env.unwrapped.x_threshold)"),
+        ]
+
+        # constants not depending on env are resolved once, and usable in requirements
+        spec = RewardSpec(specs=specs, variables=variables, constants=constants)
+        self.assertEqual(spec._constant_values, {"half_limit": 1.2, "x_limit": 2.4})
+        self.assertEqual(list(spec._env_constant_codes), ["x_threshold"])
+
+        # constants depending on env are resolved on reset, and not collected in the episode
+        env = gymnasium.make("CartPole-v1")
+        env = TLTLWrapper(env, specs=specs, variables=variables, constants=constants)
+        obs, info = env.reset(seed=0)
+        self.assertEqual(env._extractor_fn.context.constant_values["x_threshold"], 2.4)
+        self.assertTrue("x_threshold" not in spec._constant_values)
+        self.assertEqual(set(env._episode), {"x", "x_ratio", "time"})
+
+        obs, reward, done, truncated, info = env.step(env.action_space.sample())
+        self.assertTrue(np.isclose(env._episode["x_ratio"][-1], abs(obs[0]) / 2.4))
+
+        # constants depending on env cannot be used in requirements
+        with self.assertRaises(Exception):
+            RewardSpec(
+                specs=['ensure abs "x" <= "x_threshold"'],
+                variables=variables,
+                constants=constants,
+            )
+
+    def test_shared_parser(self):
+        from unittest import mock
+        from auto_shaping import RewardSpec
+        from auto_shaping.spec.reward_spec import RequirementSpec
+        from tests.utility_functions import get_cartpole_example2_spec
+
+        specs, constants, variables = get_cartpole_example2_spec()
+        RewardSpec(specs=specs, variables=variables, constants=constants)
+        parser = RequirementSpec.get_parser()
+
+        # no grammar is read nor parser built for new requirements
+        with mock.patch("lark.Lark") as lark_cls:
+            spec = RewardSpec(specs=specs, variables=variables, constants=constants)
+            lark_cls.assert_not_called()
+
+        self.assertTrue(RequirementSpec.get_parser() is parser)
+        self.assertEqual([str(req) for req in spec.specs], specs)
+
+    def test_compiled_spec(self):
+        import json
+        import pathlib
+        import subprocess
+        import sys
+        import tempfile
+        import auto_shaping
+        from auto_shaping import RewardSpec
+
+        configs = pathlib.Path(__file__).parent.parent / "configs"
+        spec = RewardSpec.from_yaml(configs / "CartPole-v1.yaml")
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "CartPole-v1.json"
+            spec.to_json(path)
+            spec2 = RewardSpec.from_json(path)
+
+            self.assertEqual(
+                [req._predicate.to_tuple() for req in spec2.specs],
+                [req._predicate.to_tuple() for req in spec.specs],
+            )
+            self.assertEqual(
+                [str(req) for req in spec2.specs], [str(req) for req in spec.specs]
+            )
+            self.assertEqual(spec2.variables, spec.variables)
+            self.assertEqual(spec2.constants, spec.constants)
+            self.assertEqual(spec2.used_variables, spec.used_variables)
+
+            # accepted by wrap, as a file or as data
+            env = auto_shaping.wrap("CartPole-v1", reward="HPRS", spec=path)
+            self.assertEqual(env._spec.to_compiled(), spec.to_compiled())
+            env = auto_shaping.wrap(
+                "CartPole-v1", reward="TLTL", spec=spec.to_compiled()
+            )
+            self.assertEqual(env._spec.to_compiled(), spec.to_compiled())
+
+            # loaded without the parser nor yaml
+            code = (
+                "import sys, auto_shaping\n"
+                f"env = auto_shaping.wrap('CartPole-v1', reward='HPRS', spec={str(path)!r})\n"
+                "env.reset(seed=0)\n"
+                "env.step(0)\n"
+                "assert 'lark' not in sys.modules, 'lark imported'\n"
+                "assert 'yaml' not in sys.modules, 'yaml imported'\n"
+            )
+            root = pathlib.Path(__file__).parent.parent
+            result = subprocess.run(
+                [sys.executable, "-c", code], cwd=root, capture_output=True, text=True
+            )
+            self.assertEqual(result.returncode, 0, result.stderr)
+
+        # unknown versions are rejected
+        compiled = json.loads(json.dumps(spec.to_compiled()))
+        compiled["version"] += 1
+        with self.assertRaises(ValueError):
+            RewardSpec.from_compiled(compiled)
+
+    def test_spec_cache(self):
+        import os
+        import pathlib
+        import shutil
+        import tempfile
+        from unittest import mock
+        from auto_shaping import RewardSpec
+        from auto_shaping.spec import reward_spec
+
+        configs = pathlib.Path(__file__).parent.parent / "configs"
+
+        with tempfile.TemporaryDirectory() as tmpdir, mock.patch.dict(
+            os.environ, {"AUTO_SHAPING_CACHE_DIR": str(pathlib.Path(tmpdir) / "cache")}
+        ):
+            file = pathlib.Path(tmpdir) / "spec.yaml"
+            shutil.copy(configs / "CartPole-v1.yaml", file)
+            cache_dir = reward_spec.spec_cache_dir()
+
+            parse = mock.Mock(wraps=RewardSpec._from_yaml_content)
+            loaded_specs = {}
+            with mock.patch.object(
+                RewardSpec, "_from_yaml_content", parse
+            ), mock.patch.object(reward_spec, "_loaded_specs", loaded_specs):
+                spec = RewardSpec.from_yaml(file)
+                self.assertEqual(parse.call_count, 1)
+                self.assertEqual(len(list(cache_dir.glob("*.json"))), 1)
+
+                # same instance within the process
+                self.assertTrue(RewardSpec.from_yaml(file) is spec)
+
+                # cache hit in a new process, not parsed again
+                loaded_specs.clear()
+                spec2 = RewardSpec.from_yaml(file)
+                self.assertEqual(parse.call_count, 1)
+                self.assertFalse(spec2 is spec)
+                self.assertEqual(spec2.to_compiled(), spec.to_compiled())
+
+                # changed content
+                with open(file, "a") as f:
+                    f.write("\n# comment\n")
+                RewardSpec.from_yaml(file)
+                self.assertEqual(parse.call_count, 2)
+
+                # corrupted entries are compiled again
+                for entry in cache_dir.glob("*.json"):
+                    entry.write_text("{")
+                loaded_specs.clear()
+                spec3 = RewardSpec.from_yaml(file)
+                self.assertEqual(parse.call_count, 3)
+                self.assertEqual(spec3.to_compiled(), spec.to_compiled())
+
+                # changed grammar
+                with mock.patch.object(reward_spec, "_grammar_digest", "other"):
+                    RewardSpec.from_yaml(file)
+                self.assertEqual(parse.call_count, 4)
+
+                # disabled cache
+                RewardSpec.from_yaml(file, cache=False)
+                self.assertEqual(parse.call_count, 5)
+                with mock.patch.dict(os.environ, {"AUTO_SHAPING_CACHE_DIR": ""}):
+                    self.assertIsNone(reward_spec.spec_cache_dir())
+                    loaded_specs.clear()
+                    RewardSpec.from_yaml(file)
+                self.assertEqual(parse.call_count, 6)
+
+    def test_shared_spec(self):
+        import gymnasium
+        import numpy as np
+        from concurrent.futures import ThreadPoolExecutor
+        import auto_shaping
+        from auto_shaping import HPRSWrapper, TLTLWrapper
+
+        specs = ['ensure "x_ratio" <= 1.0', 'achieve abs "x" <= 0.1']
+        variables = [
+            Variable(name="x", fn="state[0]", min=-2.4, max=2.4),
+            Variable(name="x_ratio", fn="abs(x) / x_limit", min=0.0, max=1.0),
+        ]
+        constants = [Constant(name="x_limit", value="float(env.unwrapped.x_threshold)")]
+
+        # one spec for many environments, with the constants resolved per environment
+        envs = []
+        for i in range(4):
+            env = gymnasium.make("CartPole-v1")
+            env.unwrapped.x_threshold = 1.0 + i
+            env = HPRSWrapper(
+                env, specs=specs, variables=variables, constants=constants
+            )
+            env = TLTLWrapper(
+                env, specs=specs, variables=variables, constants=constants
+            )
+            env.reset(seed=i)
+            envs.append(env)
+
+        spec = envs[0]._spec
+        self.assertTrue(all([env._spec is spec for env in envs]))
+        self.assertTrue(all([env.env._spec is spec for env in envs]))
+        self.assertTrue("x_limit" not in spec._constant_values)
+        for i, env in enumerate(envs):
+            self.assertEqual(env.env._ext_state["x_limit"], 1.0 + i)
+            self.assertEqual(
+                env._extractor_fn.context.constant_values["x_limit"], 1.0 + i
+            )
+
+        # loaded specs are shared as well
+        env1 = auto_shaping.wrap("CartPole-v1", reward="HPRS")
+        env2 = auto_shaping.wrap("CartPole-v1", reward="HPRS")
+        self.assertTrue(env1._spec is env2._spec)
+
+        # compiled arrays are read-only and built once, also from concurrent threads
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            arrays = list(
+                pool.map(lambda _: spec.requirement_arrays(["ensure"]), range(8))
+            )
+        self.assertTrue(all([a is arrays[0] for a in arrays]))
+        with self.assertRaises(ValueError):
+            arrays[0].threshold[0] = 0.0
+        with self.assertRaises(ValueError):
+            spec._constant_array[0] = 0.0
+
+    def test_used_variables(self):
+        import pathlib
+        from auto_shaping import RewardSpec
+
+        configs = pathlib.Path(__file__).parent.parent / "configs"
+
+        spec = RewardSpec.from_yaml(configs / "CartPole-v1.yaml")
+        self.assertEqual(spec.used_variables, ["x", "theta"])
+
+        # derived variables are evaluated after their dependencies
+        spec = RewardSpec(
+            specs=['achieve "dist" <= 0.0'],
+            variables=[
+                Variable(name="dist", fn="max(dist_x, dist_y)", min=0.0, max=1.0),
+                Variable(name="unused", fn="state[2]", min=0.0, max=1.0),
+                Variable(name="dist_y", fn="state[1]", min=0.0, max=1.0),
+                Variable(name="dist_x", fn="abs(x)", min=0.0, max=1.0),
+                Variable(name="x", fn="state[0]", min=-1.0, max=1.0),
+            ],
+        )
+        self.assertEqual(spec.used_variables, ["dist_y", "x", "dist_x", "dist"])
+
+        with self.assertRaises(ValueError):
+            RewardSpec(
+                specs=['achieve "a" <= 0.0'],
+                variables=[
+                    Variable(name="a", fn="b + 1", min=0.0, max=1.0),
+                    Variable(name="b", fn="a - 1", min=0.0, max=1.0),
+                ],
+            )
+
+    def test_variable_dependencies(self):
+        """
+        Check that attribute names are not dependencies among variables.
+        """
+        import gymnasium
+        from auto_shaping import RewardSpec, TLTLWrapper
+
+        # attribute with the same name of the variable
+        spec = RewardSpec(
+            specs=['ensure abs "x" <= 2.4'],
+            variables=[Variable(name="x", fn="env.unwrapped.x", min=-2.4, max=2.4)],
+        )
+        self.assertEqual(spec.used_variables, ["x"])
+        self.assertEqual(spec._variable_names["x"], {"env"})
+
+        # attribute of numpy with the same name of a variable, declared after its user
+        spec = RewardSpec(
+            specs=['ensure "y" <= 1.0', 'ensure "abs" <= 1.0'],
+            variables=[
+                Variable(name="y", fn="np.abs(state[0])", min=0.0, max=2.4),
+                Variable(name="abs", fn="y + 1", min=0.0, max=3.4),
+            ],
+        )
+        self.assertEqual(spec.used_variables, ["y", "abs"])
+
+        # names bound in comprehensions are not dependencies
+        spec = RewardSpec(
+            specs=['ensure "s" <= 1.0'],
+            variables=[
+                Variable(name="s", fn="sum([x * x for x in state])", min=0.0, max=9.0),
+                Variable(name="x", fn="s + 1", min=0.0, max=9.0),
+            ],
+        )
+        self.assertEqual(spec.used_variables, ["s"])
+
+        # only within the comprehension, the name is also read outside of it
+        spec = RewardSpec(
+            specs=['ensure "s" <= 1.0'],
+            variables=[
+                Variable(name="s", fn="x + sum(x for x in state)", min=0.0, max=9.0),
+                Variable(name="x", fn="state[0]", min=-2.4, max=2.4),
+            ],
+        )
+        self.assertEqual(spec.used_variables, ["x", "s"])
+        self.assertEqual(spec._variable_names["s"], {"x", "sum", "state"})
+
+        # evaluated on the attribute of the environment
+        class PositionWrapper(gymnasium.Wrapper):
+            @property
+            def x(self):
+                return float(self.env.unwrapped.state[0])
+
+        env = TLTLWrapper(
+            PositionWrapper(gymnasium.make("CartPole-v1")),
+            specs=['ensure abs "x" <= 2.4'],
+            variables=[Variable(name="x", fn="env.x", min=-2.4, max=2.4)],
+        )
+        env.reset(seed=0)
+        env.step(0)
+        self.assertEqual(env._episode["x"][-1], env.unwrapped.state[0])
@@ -0,0 +1,172 @@
+import unittest
+
+import numpy as np
+
+from auto_shaping import RewardSpec, Variable, Constant
+from auto_shaping.utils import monitor_stl_episode
+from auto_shaping.utils.robustness import monitor_requirements, monitor_predicate
+
+
+class TestNativeRobustness(unittest.TestCase):
+    def _random_episode(self, rng, length):
+        return {
+            "x": rng.uniform(-2.0, 2.0, size=length).tolist(),
+            "y": rng.uniform(-1.0, 1.0, size=length).tolist(),
+            "time": [float(t) for t in range(length)],
+        }
+
+    def test_native_vs_rtamt_requirements(self):
+        specs = [
+            'ensure abs "x" <= 1.5',
+            'achieve "y" > 0.5',
+            'conquer exp "y" < "y_limit"',
+            'ensure "x" >= -1.0',
+        ]
+        spec = RewardSpec(
+            specs=specs,
+            variables=[
+                Variable(name="x", fn="state[0]", min=-2.0, max=2.0),
+                Variable(name="y", fn="state[1]", min=-1.0, max=1.0),
+            ],
+            constants=[Constant(name="y_limit", value=2.0)],
+        )
+
+        rng = np.random.default_rng(0)
+        for length in [2, 3, 10, 100]:
+            episode = self._random_episode(rng, length)
+
+            # each requirement in isolation
+            for req in spec.specs:
+                rho_native = monitor_requirements([req], ["x", "y"], episode)
+                rho_rtamt = monitor_stl_episode(req.to_rtamt(), ["x", "y"], episode)
+                self.assertTrue(
+                    np.isclose(rho_native, rho_rtamt[0][1]),
+                    f"{req}: native {rho_native} != rtamt {rho_rtamt[0][1]}",
+                )
+
+            # conjunction of all requirements
+            rho_native = monitor_requirements(spec.specs, ["x", "y"], episode)
+            rho_rtamt = monitor_requirements(
+                spec.specs, ["x", "y"], episode, engine="rtamt"
+            )
+            self.assertTrue(
+                np.isclose(rho_native, rho_rtamt),
+                f"conjunction: native {rho_native} != rtamt {rho_rtamt}",
+            )
+
+            # predicate robustness trace
+            for req in spec.specs:
+                trace_native = monitor_predicate(req._predicate, ["x", "y"], episode)
+                trace_rtamt = monitor_predicate(
+                    req._predicate, ["x", "y"], episode, engine="rtamt"
+                )
+                self.assertTrue(
+                    np.allclose(trace_native, trace_rtamt),
+                    f"{req}: native trace differs from rtamt trace",
+                )
+
+    def test_batch_evaluation(self):
+        """
+        Check the robustness and rewards of a batch of padded episodes against the ones of each episode.
+        """
+        from auto_shaping.pam_shaping import pam_reward
+        from auto_shaping.rpr_shaping import rpr_reward
+        from auto_shaping.utils.robustness import split_requirements
+
+        spec = RewardSpec(
+            specs=[
+                'ensure abs "x" <= 1.5',
+                'achieve "y" > 0.5',
+                'encourage "y" <= 0.0',
+                'conquer exp "y" < "y_limit"',
+                'ensure "x" >= -1.0',
+                'encourage abs "x" < 1.0',
+            ],
+            variables=[
+                Variable(name="x", fn="state[0]", min=-2.0, max=2.0),
+                Variable(name="y", fn="state[1]", min=-1.0, max=1.0),
+            ],
+            constants=[Constant(name="y_limit", value=2.0)],
+        )
+
+        rng = np.random.default_rng(0)
+        lengths = np.array([1, 2, 7, 30, 30, 12])
+        episodes = [self._random_episode(rng, length) for length in lengths]
+        traces = np.full((len(episodes), 30, 2), np.nan)
+        for i, episode in enumerate(episodes):
+            traces[i, : lengths[i]] = np.stack([episode["x"], episode["y"]], axis=1)
+
+        result = spec.evaluate_batch(traces, lengths, max_length=20)
+        self.assertEqual(result.robustness.shape, (len(episodes), len(spec.specs)))
+        self.assertEqual(result.comfort.shape, (len(episodes), 2))
+
+        for i, episode in enumerate(episodes):
+            for j, req in enumerate(spec.specs):
+                if req._operator == "encourage":
+                    self.assertTrue(np.isnan(result.robustness[i, j]))
+                    continue
+                # rtamt needs at least 2 steps
+                engine = "rtamt" if lengths[i] > 1 else "native"
+                rho = monitor_requirements([req], ["x", "y"], episode, engine)
+                self.assertTrue(np.isclose(result.robustness[i, j], rho), req)
+
+            specs = split_requirements(spec)
+            pam = pam_reward(*specs, ["x", "y"], episode, max_length=20)
+            rpr = rpr_reward(*specs, ["x", "y"], episode, max_length=20)
+            self.assertTrue(np.isclose(result.pam[i], pam))
+            self.assertTrue(np.isclose(result.rpr[i], rpr))
+
+        with self.assertRaises(ValueError):
+            spec.evaluate_batch(traces, lengths + 1)
+
+    def test_tltl_engines(self):
+        """
+        Check TLTL rewards are the same for all engines, and the online engine keeps no episode.
+        """
+        import gymnasium
+        from auto_shaping import TLTLWrapper
+        from tests.utility_functions import get_cartpole_example2_spec
+
+        specs, constants, variables = get_cartpole_example2_spec()
+        envs = [
+            TLTLWrapper(
+                gymnasium.make("CartPole-v1"),
+                specs=specs,
+                variables=variables,
+                constants=constants,
+                engine=engine,
+            )
+            for engine in ["native", "rtamt", "online"]
+        ]
+
+        for env in envs:
+            env.reset(seed=0)
+            env.action_space.seed(0)
+
+        done = False
+        while not done:
+            results = [env.step(env.action_space.sample()) for env in envs]
+            (_, r1, done, _, _), (_, r2, _, _, _), (_, r3, _, _, _) = results
+            self.assertTrue(np.isclose(r1, r2), f"native {r1} != rtamt {r2}")
+            self.assertTrue(np.isclose(r1, r3), f"native {r1} != online {r3}")
+            self.assertEqual(len(envs[2]._episode["time"]), 1)
+
+        for env in envs:
+            env.close()
+
+
+class TestOnlineMonitor(unittest.TestCase):
+    def test_sliding_extremum(self):
+        from auto_shaping.utils.online_monitor import SlidingExtremum
+
+        rng = np.random.default_rng(0)
+        values = rng.normal(size=500)
+        for window_len in [1, 3, 50]:
+            running_min = SlidingExtremum(window_len, mode="min")
+            running_max = SlidingExtremum(window_len, mode="max")
+            for t, v in enumerate(values):
+                running_min.update(v)
+                running_max.update(v)
+                window = values[max(0, t - window_len + 1) : t + 1]
+                self.assertEqual(running_min.value, np.min(window))
+                self.assertEqual(running_max.value, np.max(window))
@@ -86,6 +86,49 @@ class TestRTAMTUtils(unittest.TestCase):
             rob, rob1, atol=1e-5
         ), f"robustness is not correct, expected {rob}, got {rob1}"
 
+    def test_stl_monitor_cache(self):
+        from auto_shaping.utils.utils import get_monitor
+
+        spec1 = get_monitor("always x <= 1.5", vars=["x", "y"])
+        spec2 = get_monitor("always x <= 1.5", vars=["y", "x"])
+        spec3 = get_monitor("eventually x <= 1.5", vars=["x", "y"])
+        self.assertTrue(spec1 is spec2, "expected cached monitor for same spec")
+        self.assertTrue(spec1 is not spec3, "expected new monitor for different spec")
+
+        # the cached monitor must not carry state across episodes
+        episode1 = {"x": [2.0, 0.0], "y": [0.0, 0.0], "time": [1.0, 2.0]}
+        episode2 = {"x": [0.0, 1.0, 0.5], "y": [0.0, 0.0, 0.0], "time": [1.0, 2.0, 3.0]}
+        rob1 = monitor_stl_episode("always x <= 1.5", ["x", "y"], episode1)[0][1]
+        rob2 = monitor_stl_episode("always x <= 1.5", ["x", "y"], episode2)[0][1]
+        self.assertTrue(np.isclose(rob1, -0.5), f"expected -0.5, got {rob1}")
+        self.assertTrue(np.isclose(rob2, 0.5), f"expected 0.5, got {rob2}")
+
+    def test_stl_monitor_threads(self):
+        """
+        Check that threads evaluating the same formula do not share the state of the monitor.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        from auto_shaping.utils.utils import get_monitor
+
+        def evaluate(seed):
+            rng = np.random.default_rng(seed)
+            errors = []
+            for _ in range(50):
+                n = int(rng.integers(2, 50))
+                x = rng.uniform(-3.0, 3.0, size=n).tolist()
+                episode = {"x": x, "y": [0.0] * n, "time": list(range(n))}
+                rob = monitor_stl_episode("always x <= 1.5", ["x", "y"], episode)
+                errors.append(abs(rob[0][1] - (1.5 - max(x))))
+            return get_monitor("always x <= 1.5", vars=["x", "y"]), max(errors)
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(evaluate, range(8)))
+
+        for monitor, error in results:
+            self.assertLess(error, 1e-9)
+        monitors = set([id(monitor) for monitor, _ in results])
+        self.assertNotIn(id(get_monitor("always x <= 1.5", vars=["x", "y"])), monitors)
+
 
 class TestWrappers(unittest.TestCase):
     def test_dict_wrapper(self):
@@ -131,3 +174,254 @@ class TestRewardTypes(unittest.TestCase):
             assert (
                 reward.name == reward_type
             ), f"reward type {reward_type} not in RewardType enum"
+
+
+class TestLazyImports(unittest.TestCase):
+    def test_lazy_imports(self):
+        """
+        Check that importing the package does not import the heavy dependencies,
+        and that the HPRS wrapper does not import rtamt.
+        """
+        import pathlib
+        import subprocess
+        import sys
+
+        code = (
+            "import sys, auto_shaping\n"
+            "for m in ['gymnasium', 'lark', 'rtamt', 'auto_shaping.hprs_shaping']:\n"
+            "    assert m not in sys.modules, f'{m} imported'\n"
+            "assert set(auto_shaping.__entry_points__) == {'TLTL', 'HPRS', 'BHNR', 'PAM', 'RPR'}\n"
+            "env = auto_shaping.wrap('CartPole-v1', reward='HPRS')\n"
+            "env.reset(seed=0)\n"
+            "env.step(0)\n"
+            "assert 'rtamt' not in sys.modules, 'rtamt imported'\n"
+            "assert auto_shaping.__entry_points__['HPRS'] is auto_shaping.HPRSWrapper\n"
+        )
+        root = pathlib.Path(__file__).parent.parent
+        result = subprocess.run(
+            [sys.executable, "-c", code], cwd=root, capture_output=True, text=True
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+        import auto_shaping
+
+        with self.assertRaises(AttributeError):
+            auto_shaping.UnknownWrapper
+
+
+class TestKernels(unittest.TestCase):
+    def test_requirement_kernels(self):
+        """
+        Check the vectorized kernels against the predicates evaluated one by one,
+        for one state and for a batch of states.
+        """
+        from auto_shaping.spec.reward_spec import RewardSpec, Variable
+        from auto_shaping.utils.kernels import (
+            requirement_satisfaction,
+            requirement_scores,
+        )
+        from auto_shaping.utils.utils import clip_and_norm
+
+        rng = np.random.default_rng(0)
+        variables = [
+            Variable(name=f"x{i}", fn=f"state[{i}]", min=-2.0, max=2.0)
+            for i in range(5)
+        ]
+        fns = {None: lambda x: x, "abs": abs, "exp": np.exp}
+        cmps = {
+            "<": lambda x, y: x < y,
+            "<=": lambda x, y: x <= y,
+            ">": lambda x, y: x > y,
+            ">=": lambda x, y: x >= y,
+        }
+
+        specs = ['achieve "x0" > 0.0']
+        for i in range(150):
+            fn = rng.choice(["", "abs ", "exp "])
+            op = rng.choice(list(cmps))
+            var = f"x{rng.integers(5)}"
+            specs.append(f'ensure {fn}"{var}" {op} {rng.uniform(-1.0, 1.0):.1f}')
+        spec = RewardSpec(specs=specs, variables=variables)
+        reqs = spec.requirement_arrays(["ensure"])
+
+        # rounded as the thresholds, to have values at the boundary of the predicates
+        batch = np.round(rng.uniform(-1.0, 1.0, size=(5, 8)), 1)
+        sat = requirement_satisfaction(reqs, batch)
+        scores = requirement_scores(reqs, batch)
+        self.assertEqual(sat.shape, (150, 8))
+
+        for j in range(batch.shape[1]):
+            values = dict(zip(spec.used_variables, batch[:, j]))
+            self.assertTrue(
+                np.array_equal(sat[:, j], requirement_satisfaction(reqs, batch[:, j]))
+            )
+            for i, req in enumerate(spec.specs[1:]):
+                (fn, var), op, threshold = req._predicate.to_tuple()
+                val = fns[fn](values[var])
+                self.assertEqual(sat[i, j], cmps[op](val, threshold))
+
+                var_spec = spec.variables[var]
+                if op in [">", ">="]:
+                    expected = clip_and_norm(val, var_spec.min, threshold)
+                else:
+                    expected = 1.0 - clip_and_norm(val, threshold, var_spec.max)
+                self.assertAlmostEqual(scores[i, j], expected, places=12)
+
+    def test_batch_extraction(self):
+        """
+        Check the batched extraction against the state-by-state one, with expressions which
+        evaluate in batch only on some batches (e.g., a conditional on a batch of one state).
+        """
+        from auto_shaping.spec.reward_spec import RewardSpec, Variable
+        from auto_shaping.utils.utils import BatchStateExtractor, extend_state
+
+        variables = [
+            Variable(name="x", fn="state[0]", min=-1.0, max=1.0),
+            Variable(name="x_pos", fn="x if x > 0 else 0.0", min=0.0, max=1.0),
+            Variable(name="x_max", fn="np.max(state)", min=-1.0, max=1.0),
+        ]
+        spec = RewardSpec(
+            specs=[
+                'achieve "x" > 0.0',
+                'ensure "x_pos" <= 1.0',
+                'ensure "x_max" <= 1.0',
+            ],
+            variables=variables,
+        )
+        extractor = BatchStateExtractor(spec=spec)
+
+        rng = np.random.default_rng(0)
+        for batch_size in [1, 8, 1]:
+            states = rng.uniform(-1.0, 1.0, size=(batch_size, 3))
+            batch = extractor(states, np.zeros((batch_size, 1)))
+            for j, state in enumerate(states):
+                ext_state = extend_state(None, state, np.zeros(1), spec)
+                for var_name in spec.used_variables:
+                    self.assertEqual(batch[var_name][j], ext_state[var_name])
+
+        self.assertTrue(extractor._batched["x"])
+        self.assertFalse(extractor._batched["x_pos"])
+        self.assertFalse(extractor._batched["x_max"])
+
+
+class TestTraceBuffer(unittest.TestCase):
+    def test_trace_buffer(self):
+        """
+        Check the stored traces against deques, for the whole episode and for sliding windows.
+        """
+        from collections import deque
+        from auto_shaping.utils.trace_buffer import TraceBuffer
+
+        rng = np.random.default_rng(0)
+        for window_len in [None, 1, 3, 10]:
+            buffer = TraceBuffer(["x", "time"], window_len=window_len, capacity=4)
+            data = buffer._data
+
+            for episode in range(3):
+                buffer.reset()
+                expected = {k: deque(maxlen=window_len) for k in ["x", "time"]}
+                for t in range(rng.integers(1, 25)):
+                    x = rng.uniform()
+                    buffer.append([x, float(t)])
+                    expected["x"].append(x)
+                    expected["time"].append(float(t))
+
+                    self.assertEqual(buffer.length, len(expected["x"]))
+                    for k in ["x", "time"]:
+                        self.assertTrue(np.array_equal(buffer[k], list(expected[k])))
+                        self.assertTrue(buffer[k].flags["C_CONTIGUOUS"])
+
+            self.assertEqual(list(buffer), ["x", "time"])
+            if window_len is not None:
+                # the ring buffer is never reallocated
+                self.assertTrue(buffer._data is data)
+
+
+class TestProfiling(unittest.TestCase):
+    def test_profiling(self):
+        import gymnasium
+        from auto_shaping import HPRSWrapper, TLTLWrapper, PAMWrapper
+        from auto_shaping.utils.profiling import enable_profiling
+        from tests.utility_functions import get_cartpole_example1_spec
+
+        specs, constants, variables = get_cartpole_example1_spec()
+        env = gymnasium.make("CartPole-v1")
+        env = HPRSWrapper(env, specs=specs, variables=variables, constants=constants)
+        env = TLTLWrapper(env, specs=specs, variables=variables, constants=constants)
+        env = PAMWrapper(env, specs=specs, variables=variables, constants=constants)
+
+        # disabled by default
+        env.reset(seed=0)
+        obs, reward, done, truncated, info = env.step(0)
+        self.assertTrue("profiling" not in info)
+        self.assertEqual(env.profiler.stats()["steps"], 0)
+
+        profilers = enable_profiling(env, info_every=5)
+        self.assertEqual(set(profilers), {"HPRSWrapper", "TLTLWrapper", "PAMWrapper"})
+
+        env.reset(seed=0)
+        env.action_space.seed(0)
+        for t in range(1, 11):
+            obs, reward, done, truncated, info = env.step(env.action_space.sample())
+            self.assertFalse(done or truncated)
+            self.assertEqual("profiling" in info, t % 5 == 0)
+
+        self.assertEqual(
+            set(info["profiling"]), {"HPRSWrapper", "TLTLWrapper", "PAMWrapper"}
+        )
+        hprs = profilers["HPRSWrapper"].stats()
+        self.assertEqual(hprs, info["profiling"]["HPRSWrapper"])
+        self.assertEqual(hprs["steps"], 10)
+        self.assertEqual(set(hprs["phases"]), {"extract", "reward"})
+        self.assertEqual(hprs["phases"]["extract"]["calls"], 10)
+        self.assertGreater(hprs["phases"]["reward"]["total_s"], 0.0)
+
+        # the outer wrappers read the extended states computed by hprs
+        tltl = profilers["TLTLWrapper"].stats()
+        self.assertEqual(tltl["phases"]["collect"]["calls"], 10)
+
+        # per-requirement monitoring at the end of the episode
+        done = False
+        while not (done or truncated):
+            obs, reward, done, truncated, info = env.step(env.action_space.sample())
+        pam = profilers["PAMWrapper"].stats()
+        monitored = [p for p in pam["phases"] if p.startswith("monitor/")]
+        self.assertEqual(len(monitored), len(specs))
+
+        profilers["PAMWrapper"].reset()
+        self.assertEqual(profilers["PAMWrapper"].stats()["phases"], {})
+
+    def test_profiling_same_wrappers(self):
+        """
+        Check that the profilers of stacked wrappers of the same class are reported separately.
+        """
+        import gymnasium
+        from auto_shaping import HPRSWrapper, TLTLWrapper
+        from auto_shaping.utils.profiling import enable_profiling
+        from tests.utility_functions import (
+            get_cartpole_example1_spec,
+            get_cartpole_example2_spec,
+        )
+
+        env = gymnasium.make("CartPole-v1")
+        for get_spec in [get_cartpole_example1_spec, get_cartpole_example2_spec]:
+            specs, constants, variables = get_spec()
+            env = TLTLWrapper(
+                env, specs=specs, variables=variables, constants=constants
+            )
+        env = HPRSWrapper(env, specs=specs, variables=variables, constants=constants)
+
+        profilers = enable_profiling(env, info_every=5)
+        self.assertEqual(
+            set(profilers), {"HPRSWrapper", "TLTLWrapper[1]", "TLTLWrapper[2]"}
+        )
+        self.assertIs(profilers["TLTLWrapper[1]"], env.env.profiler)
+        self.assertIs(profilers["TLTLWrapper[2]"], env.env.env.profiler)
+
+        env.reset(seed=0)
+        for t in range(5):
+            obs, reward, done, truncated, info = env.step(t % 2)
+        self.assertEqual(set(info["profiling"]), set(profilers))
+
+        # enabled again with the same names
+        self.assertEqual(set(enable_profiling(env)), set(profilers))